@@ -0,0 +1,238 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from disk_cache import CACHE_DIR
+from metrics import span
+
+# Persistent archive of every transcript and summary the app produces, with a SQLite FTS5
+# index over it. Transcripts are indexed one segment per row, so a hit carries its own
+# timestamp and speaker; summaries and text documents are indexed one paragraph per row.
+# Documents are added as soon as their job finishes, there is no batch reindexing.
+
+ARCHIVE_DB_PATH = os.environ.get("SBOBINATOR_ARCHIVE_DB", os.path.join(CACHE_DIR, "archive.sqlite3"))
+SEARCH_LIMIT = 50
+# Words of context shown around a hit
+SNIPPET_TOKENS = 16
+HIGHLIGHT_START = "**"
+HIGHLIGHT_END = "**"
+
+KIND_AUDIO = "audio"
+KIND_TEXT = "text"
+FIELD_TRANSCRIPT = "transcript"
+FIELD_SUMMARY = "summary"
+
+logger = logging.getLogger("sbobinator.archive")
+
+# User query -> FTS5 query. Text in double quotes is a phrase, other words match as prefixes
+# ("lezion" finds "lezione" and "lezioni"). Every term is quoted, so FTS5 operators and
+# punctuation typed by the user can never make the query invalid.
+def fts_query(text):
+    terms = []
+    for match in re.finditer(r'"([^"]*)"|(\S+)', text):
+        phrase, word = match.groups()
+        if phrase is not None:
+            words = re.findall(r"\w+", phrase)
+            if words:
+                terms.append('"' + " ".join(words) + '"')
+        else:
+            for part in re.findall(r"\w+", word):
+                terms.append(f'"{part}"*')
+    return " ".join(terms)
+
+def _paragraphs(text):
+    return [" ".join(p.split()) for p in re.split(r"\n\s*\n", text or "") if p.strip()]
+
+class Archive:
+    def __init__(self, db_path=ARCHIVE_DB_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    kind TEXT NOT NULL,
+                    title TEXT,
+                    source_url TEXT,
+                    job_id TEXT UNIQUE,
+                    engine TEXT,
+                    language TEXT,
+                    duration REAL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS passages (
+                    id INTEGER PRIMARY KEY,
+                    document_id INTEGER NOT NULL REFERENCES documents (id),
+                    field TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    start REAL,
+                    end REAL,
+                    speaker TEXT,
+                    text TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS passages_document ON passages (document_id, position)")
+            # Text documents are identified by the hash of their content (archives created before had no such column)
+            if "content_key" not in [row[1] for row in conn.execute("PRAGMA table_info(documents)")]:
+                conn.execute("ALTER TABLE documents ADD COLUMN content_key TEXT")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS documents_content_key ON documents (content_key)")
+            # External content table: the text is stored once, in passages
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS passages_fts USING fts5 (
+                    text,
+                    content = 'passages',
+                    content_rowid = 'id',
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _insert_passages(self, conn, document_id, field, passages):
+        for position, (start, end, speaker, text) in enumerate(passages):
+            if not text:
+                continue
+            cursor = conn.execute(
+                "INSERT INTO passages (document_id, field, position, start, end, speaker, text) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (document_id, field, position, start, end, speaker, text)
+            )
+            conn.execute("INSERT INTO passages_fts (rowid, text) VALUES (?, ?)", (cursor.lastrowid, text))
+
+    # The FTS index has its own copy of the terms, it is told what goes away
+    def _delete_passages(self, conn, document_id):
+        for passage_id, text in conn.execute("SELECT id, text FROM passages WHERE document_id = ?", (document_id,)).fetchall():
+            conn.execute("INSERT INTO passages_fts (passages_fts, rowid, text) VALUES ('delete', ?, ?)", (passage_id, text))
+        conn.execute("DELETE FROM passages WHERE document_id = ?", (document_id,))
+
+    # A job is archived once. A document with the same content_key is replaced instead, e.g.
+    # a text summarized again gets the new summary and keeps a single entry.
+    def _add(self, kind, title, source_url, job_id, engine, language, duration, fields, content_key=None):
+        with span("archive_index", provider=kind) as attrs, self._connect() as conn:
+            if job_id is not None:
+                row = conn.execute("SELECT id FROM documents WHERE job_id = ?", (job_id,)).fetchone()
+                if row is not None:
+                    return row[0]
+            row = conn.execute("SELECT id FROM documents WHERE content_key = ?", (content_key,)).fetchone() if content_key else None
+            if row is not None:
+                document_id = row[0]
+                conn.execute("UPDATE documents SET created_at = ?, title = ? WHERE id = ?", (time.time(), title, document_id))
+                self._delete_passages(conn, document_id)
+            else:
+                cursor = conn.execute(
+                    "INSERT INTO documents (created_at, kind, title, source_url, job_id, engine, language, duration, content_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (time.time(), kind, title, source_url, job_id, engine, language, duration, content_key)
+                )
+                document_id = cursor.lastrowid
+            for field, passages in fields.items():
+                self._insert_passages(conn, document_id, field, passages)
+            attrs["bytes_in"] = sum(len(p[3]) for passages in fields.values() for p in passages)
+            return document_id
+
+    # Archive a finished transcription job: its Transcript segments and its summary
+    def add_transcript(self, transcript, summary=None, title=None, source_url=None, job_id=None):
+        segments = [(s.start, s.end, s.speaker, s.text) for s in transcript.segments]
+        return self._add(
+            KIND_AUDIO, title, source_url, job_id, transcript.engine, transcript.language, transcript.duration,
+            {
+                FIELD_TRANSCRIPT: segments,
+                FIELD_SUMMARY: [(None, None, None, p) for p in _paragraphs(summary)],
+            }
+        )
+
+    # Archive a text document summarized in the summarizer page, once per content
+    def add_text(self, text, summary=None, title=None):
+        return self._add(
+            KIND_TEXT, title, None, None, None, None, None,
+            {
+                FIELD_TRANSCRIPT: [(None, None, None, p) for p in _paragraphs(text)],
+                FIELD_SUMMARY: [(None, None, None, p) for p in _paragraphs(summary)],
+            },
+            content_key=hashlib.sha256(text.encode("utf-8")).hexdigest()
+        )
+
+    # Best matches first. Each hit has the document, the passage position, timestamp and
+    # speaker (for transcripts) and a snippet with the matching words highlighted.
+    def search(self, query, limit=SEARCH_LIMIT, field=None):
+        match = fts_query(query)
+        if not match:
+            return []
+        sql = f"""
+            SELECT d.id, d.kind, d.title, d.source_url, d.job_id, d.created_at,
+                   p.field, p.position, p.start, p.end, p.speaker,
+                   snippet(passages_fts, 0, ?, ?, '…', {SNIPPET_TOKENS})
+            FROM passages_fts
+            JOIN passages p ON p.id = passages_fts.rowid
+            JOIN documents d ON d.id = p.document_id
+            WHERE passages_fts MATCH ?
+        """
+        params = [HIGHLIGHT_START, HIGHLIGHT_END, match]
+        if field:
+            sql += " AND p.field = ?"
+            params.append(field)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+        with span("archive_search"), self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [
+            {
+                "document_id": row[0],
+                "kind": row[1],
+                "title": row[2],
+                "source_url": row[3],
+                "job_id": row[4],
+                "created_at": row[5],
+                "field": row[6],
+                "position": row[7],
+                "start": row[8],
+                "end": row[9],
+                "speaker": row[10],
+                "snippet": row[11],
+            }
+            for row in rows
+        ]
+
+    # Passages around a hit, to show it in context
+    def context(self, document_id, field, position, radius=2):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT position, start, speaker, text FROM passages WHERE document_id = ? AND field = ? AND position BETWEEN ? AND ? ORDER BY position",
+                (document_id, field, position - radius, position + radius)
+            ).fetchall()
+        return [{"position": r[0], "start": r[1], "speaker": r[2], "text": r[3]} for r in rows]
+
+    def stats(self):
+        with self._connect() as conn:
+            documents, duration = conn.execute("SELECT COUNT(*), COALESCE(SUM(duration), 0) FROM documents").fetchone()
+        return {"documents": documents, "duration": duration}
+
+_archive = None
+_archive_lock = threading.Lock()
+
+def get_archive():
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = Archive()
+        return _archive
+
+# Indexing must never fail the job or the page that produced the document
+def archive_safely(method, *args, **kwargs):
+    try:
+        return getattr(get_archive(), method)(*args, **kwargs)
+    except Exception:
+        logger.exception("Could not archive document")
+        return None
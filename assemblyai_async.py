@@ -0,0 +1,249 @@
+import asyncio
+import json
+import os
+import threading
+import httpx
+from metrics import span
+from ratelimit import PROVIDER_ASSEMBLYAI, scheduler
+
+# Asyncio client for AssemblyAI: uploads stream from disk, and the status of every
+# in-flight transcript is polled from a single loop instead of one blocked thread each.
+
+ASSEMBLYAI_BASE_URL = os.environ.get("ASSEMBLYAI_BASE_URL", "https://api.assemblyai.com")
+# Public URL AssemblyAI should call when a transcript is done, e.g. behind a reverse proxy
+ASSEMBLYAI_WEBHOOK_URL = os.environ.get("ASSEMBLYAI_WEBHOOK_URL")
+# Local address the webhook receiver listens on
+ASSEMBLYAI_WEBHOOK_HOST = os.environ.get("ASSEMBLYAI_WEBHOOK_HOST", "0.0.0.0")
+ASSEMBLYAI_WEBHOOK_PORT = int(os.environ.get("ASSEMBLYAI_WEBHOOK_PORT", "8765"))
+POLL_INTERVAL_SECONDS = 3.0
+# With a webhook configured, polling is only a safety net for lost callbacks
+WEBHOOK_POLL_INTERVAL_SECONDS = 30.0
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+REQUEST_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+REQUEST_RETRIES = 3
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# A transcript still not done after this long is given up on
+TRANSCRIPT_TIMEOUT_SECONDS = float(os.environ.get("SBOBINATOR_ASSEMBLYAI_TIMEOUT_SECONDS", str(3 * 60 * 60)))
+
+class AssemblyAIError(Exception):
+    pass
+
+async def _read_chunks(path, chunk_size=UPLOAD_CHUNK_SIZE):
+    with open(path, "rb") as f:
+        while True:
+            chunk = await asyncio.to_thread(f.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+class AsyncAssemblyAI:
+    def __init__(self, api_key, webhook_url=ASSEMBLYAI_WEBHOOK_URL, poll_interval=None, timeout=TRANSCRIPT_TIMEOUT_SECONDS):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.webhook_url = webhook_url
+        if poll_interval is None:
+            poll_interval = WEBHOOK_POLL_INTERVAL_SECONDS if webhook_url else POLL_INTERVAL_SECONDS
+        self.poll_interval = poll_interval
+        self.client = httpx.AsyncClient(
+            base_url=ASSEMBLYAI_BASE_URL,
+            headers={"authorization": api_key},
+            timeout=REQUEST_TIMEOUT,
+            # Retries connection failures, status codes are handled in _request
+            transport=httpx.AsyncHTTPTransport(
+                retries=REQUEST_RETRIES,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+            )
+        )
+        # transcript id -> (future resolved with the completed transcript JSON, deadline, priority)
+        self._pending = {}
+        self._ready = set()
+        self._wakeup = asyncio.Event()
+        self._poller = None
+
+    async def close(self):
+        await self.client.aclose()
+
+    # Retry 429/5xx with backoff, honouring Retry-After. Streaming bodies are rebuilt on every
+    # attempt through make_content, since a generator can only be consumed once.
+    # Every attempt waits for a slot from the process-wide scheduler, a 429 pauses the key for everyone.
+    async def _request(self, method, url, make_content=None, priority=None, **kwargs):
+        for attempt in range(REQUEST_RETRIES + 1):
+            await scheduler.acquire_async(PROVIDER_ASSEMBLYAI, self.api_key, priority=priority)
+            if make_content:
+                kwargs["content"] = make_content()
+            response = await self.client.request(method, url, **kwargs)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == REQUEST_RETRIES:
+                if response.status_code != 429:
+                    scheduler.report_success(PROVIDER_ASSEMBLYAI, self.api_key)
+                response.raise_for_status()
+                return response
+            # A 429 pauses the key for every caller, a 5xx only delays this one
+            await asyncio.sleep(scheduler.report_failure(PROVIDER_ASSEMBLYAI, self.api_key, attempt, response))
+
+    async def upload(self, path, priority=None):
+        with span("assemblyai_upload", provider="assemblyai", bytes_in=os.path.getsize(path)):
+            response = await self._request(
+                "POST",
+                "/v2/upload",
+                make_content=lambda: _read_chunks(path),
+                priority=priority,
+                headers={"content-type": "application/octet-stream"}
+            )
+        return response.json()["upload_url"]
+
+    async def submit(self, audio_url, language, speaker_labels=True, priority=None):
+        payload = {
+            "audio_url": audio_url,
+            "language_code": language,
+            "speaker_labels": speaker_labels
+        }
+        if self.webhook_url:
+            payload["webhook_url"] = self.webhook_url
+        response = await self._request("POST", "/v2/transcript", priority=priority, json=payload)
+        return response.json()["id"]
+
+    # Wait for a submitted transcript, sharing the poll loop with every other pending one.
+    # Status polls wait for the scheduler like every other request, with the caller's priority.
+    async def wait(self, transcript_id, priority=None):
+        if transcript_id not in self._pending:
+            loop = asyncio.get_running_loop()
+            self._pending[transcript_id] = (loop.create_future(), loop.time() + self.timeout, priority)
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll_loop())
+        return await asyncio.shield(self._pending[transcript_id][0])
+
+    async def transcribe(self, path, language, speaker_labels=True, priority=None):
+        audio_url = await self.upload(path, priority)
+        transcript_id = await self.submit(audio_url, language, speaker_labels, priority)
+        # Time spent queued and processed on AssemblyAI's side
+        with span("assemblyai_processing", provider="assemblyai", model="speaker_labels" if speaker_labels else "default"):
+            return await self.wait(transcript_id, priority)
+
+    # Called by the webhook receiver, the transcript is fetched right away instead of at the next poll
+    def notify(self, transcript_id):
+        if transcript_id in self._pending:
+            self._ready.add(transcript_id)
+            self._wakeup.set()
+
+    def _finish(self, transcript_id, result=None, error=None):
+        future, _, _ = self._pending.pop(transcript_id)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def _fetch(self, transcript_id):
+        _, _, priority = self._pending[transcript_id]
+        try:
+            response = await self._request("GET", f"/v2/transcript/{transcript_id}", priority=priority)
+            data = response.json()
+        except httpx.TransportError:
+            # Network trouble, the next round will try again
+            return
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code in RETRY_STATUS_CODES:
+                # Still throttled or failing after the retries, the next round will try again
+                return
+            # 401, 404...: asking again won't change the answer
+            self._finish(transcript_id, error=AssemblyAIError(f"Trascrizione AssemblyAI non disponibile: errore {e.response.status_code}"))
+            return
+        if data["status"] == "completed":
+            self._finish(transcript_id, data)
+        elif data["status"] == "error":
+            self._finish(transcript_id, error=AssemblyAIError(f"Trascrizione AssemblyAI fallita: {data.get('error')}"))
+
+    async def _poll_loop(self):
+        while self._pending:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                # Woken by a webhook, only fetch the transcripts it reported
+                ids = [transcript_id for transcript_id in self._ready if transcript_id in self._pending]
+            except asyncio.TimeoutError:
+                ids = list(self._pending)
+            self._wakeup.clear()
+            self._ready.clear()
+            await asyncio.gather(*(self._fetch(transcript_id) for transcript_id in ids))
+            # Transcripts still processing, or whose polls keep failing, give up at their deadline
+            now = asyncio.get_running_loop().time()
+            for transcript_id, (_, deadline, _) in list(self._pending.items()):
+                if now >= deadline:
+                    self._finish(transcript_id, error=AssemblyAIError(f"Trascrizione AssemblyAI non completata dopo {self.timeout / 60:.0f} minuti"))
+
+# Minimal HTTP endpoint for AssemblyAI completion callbacks ({"transcript_id": ..., "status": ...})
+class WebhookReceiver:
+    def __init__(self, callback, host=ASSEMBLYAI_WEBHOOK_HOST, port=ASSEMBLYAI_WEBHOOK_PORT):
+        self.callback = callback
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            await reader.readline()
+            content_length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.strip().lower() == "content-length":
+                    content_length = int(value.strip())
+            body = await reader.readexactly(content_length) if content_length else b""
+            transcript_id = json.loads(body or b"{}").get("transcript_id")
+            if transcript_id:
+                self.callback(transcript_id)
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        except (ValueError, asyncio.IncompleteReadError):
+            writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        finally:
+            await writer.drain()
+            writer.close()
+
+# One event loop per process owns every AssemblyAI client, so transcripts from all
+# sessions and job workers share the same poll loop and webhook receiver.
+_loop = None
+_clients = {}
+_loop_lock = threading.Lock()
+
+def _notify_all(transcript_id):
+    for client in _clients.values():
+        client.notify(transcript_id)
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="sbobinator-assemblyai", daemon=True).start()
+            if ASSEMBLYAI_WEBHOOK_URL:
+                asyncio.run_coroutine_threadsafe(WebhookReceiver(_notify_all).start(), _loop).result()
+        return _loop
+
+async def _get_client(api_key):
+    if api_key not in _clients:
+        _clients[api_key] = AsyncAssemblyAI(api_key)
+    return _clients[api_key]
+
+def _run(coro):
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+# Blocking helper for threads (job workers, CLI workers) that hands the work to the shared loop:
+# transcripts submitted from any number of threads are polled together there.
+# The caller's scheduling priority is captured here, the loop thread has none of its own.
+def transcribe_file(api_key, path, language, speaker_labels=True):
+    priority = scheduler.current_priority()
+
+    async def run():
+        client = await _get_client(api_key)
+        return await client.transcribe(path, language, speaker_labels, priority)
+    return _run(run())
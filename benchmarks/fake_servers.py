@@ -0,0 +1,321 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# Local stand-ins for the OpenAI, AssemblyAI and Resend endpoints the app calls, plus a
+# static file server for the download stage. One server answers for every provider; the
+# routes don't overlap, so each client only needs its base URL pointed at it.
+#
+# latency maps a route name (see ROUTES) to extra seconds per request, error_rate injects
+# error_status responses (with Retry-After for 429s) on the provider routes.
+
+# Route name -> (method, path pattern)
+ROUTES = {
+    "openai_models": ("GET", r"^/v1/models$"),
+    "openai_transcription": ("POST", r"^/v1/audio/transcriptions$"),
+    "openai_chat": ("POST", r"^/v1/chat/completions$"),
+    "assemblyai_account": ("GET", r"^/v2/account$"),
+    "assemblyai_upload": ("POST", r"^/v2/upload$"),
+    "assemblyai_submit": ("POST", r"^/v2/transcript$"),
+    "assemblyai_transcript": ("GET", r"^/v2/transcript/(?P<id>[\w-]+)$"),
+    "assemblyai_lemur": ("POST", r"^/lemur/v3/generate/summary$"),
+    "resend_email": ("POST", r"^/emails$"),
+    "resend_batch": ("POST", r"^/emails/batch$"),
+    "file": ("GET", r"^/files/(?P<path>.+)$"),
+}
+# Routes never hit by error injection: the fixture server and key checks
+NO_ERRORS = ("file", "openai_models", "assemblyai_account")
+
+SAMPLE_SENTENCE = "Questa è una frase di prova generata dal server finto."
+# Bytes of uploaded audio per second of fake speech, roughly a 64 kbps mp3
+BYTES_PER_AUDIO_SECOND = 8000
+SEGMENT_SECONDS = 5.0
+
+class FakeConfig:
+    def __init__(self, latency=None, error_rate=0.0, error_status=429, retry_after=1,
+                 processing_seconds=2.0, stream_chunk_delay=0.0, files_dir=None, seed=0):
+        self.latency = latency or {}
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        # How long AssemblyAI transcripts stay "processing" after being submitted
+        self.processing_seconds = processing_seconds
+        # Delay between streamed chat tokens
+        self.stream_chunk_delay = stream_chunk_delay
+        self.files_dir = files_dir
+        self.seed = seed
+
+def _fake_segments(audio_seconds):
+    segments = []
+    start = 0.0
+    while start < audio_seconds:
+        end = min(start + SEGMENT_SECONDS, audio_seconds)
+        segments.append({"id": len(segments), "start": start, "end": end, "text": SAMPLE_SENTENCE})
+        start = end
+    return segments or [{"id": 0, "start": 0.0, "end": 0.0, "text": SAMPLE_SENTENCE}]
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        if self.headers.get("transfer-encoding", "").lower() == "chunked":
+            parts = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if size == 0:
+                    # Trailers end with an empty line
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    return b"".join(parts)
+                parts.append(self.rfile.read(size))
+                self.rfile.readline()
+        length = int(self.headers.get("content-length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, data, status=200, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method):
+        path = urlparse(self.path).path
+        for name, (route_method, pattern) in ROUTES.items():
+            match = re.match(pattern, path)
+            if route_method == method and match:
+                break
+        else:
+            self._read_body()
+            self._send_json({"error": "not found"}, status=404)
+            return
+
+        body = self._read_body() if method == "POST" else b""
+        server = self.server
+        server.count(name)
+        time.sleep(server.config.latency.get(name, 0))
+        if name not in NO_ERRORS and server.should_fail():
+            headers = {"Retry-After": str(server.config.retry_after)} if server.config.error_status == 429 else None
+            self._send_json({"error": {"message": "injected error", "type": "injected"}}, server.config.error_status, headers)
+            return
+        getattr(self, f"_{name}")(body, **match.groupdict())
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _openai_models(self, body):
+        models = ["gpt-3.5-turbo", "gpt-4", "gpt-4-turbo-preview", "whisper-1"]
+        self._send_json({"object": "list", "data": [{"id": m, "object": "model", "created": 0, "owned_by": "fake"} for m in models]})
+
+    def _openai_transcription(self, body):
+        # The multipart body is mostly audio, its size stands in for the duration
+        audio_seconds = len(body) / BYTES_PER_AUDIO_SECOND
+        segments = _fake_segments(audio_seconds)
+        self._send_json({
+            "task": "transcribe",
+            "language": "italian",
+            "duration": audio_seconds,
+            "text": " ".join(s["text"] for s in segments),
+            "segments": [
+                {**s, "seek": 0, "tokens": [], "temperature": 0.0, "avg_logprob": -0.2, "compression_ratio": 1.0, "no_speech_prob": 0.0}
+                for s in segments
+            ],
+            "words": [
+                {"word": word, "start": s["start"] + i * step, "end": s["start"] + (i + 1) * step}
+                for s in segments
+                for words in [s["text"].split()]
+                for step in [(s["end"] - s["start"]) / len(words)]
+                for i, word in enumerate(words)
+            ],
+        })
+
+    def _openai_chat(self, body):
+        request = json.loads(body or b"{}")
+        words = [f"parola{i}" for i in range(min(request.get("max_tokens") or 50, 50))]
+        prompt_tokens = sum(len(m.get("content") or "") for m in request.get("messages", [])) // 4
+        if not request.get("stream"):
+            self._send_json({
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        def send_event(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        for index, word in enumerate(words + [None]):
+            delta = {"content": word + " "} if word else {}
+            send_event(json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None if word else "stop"}],
+            }))
+            time.sleep(self.server.config.stream_chunk_delay)
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _assemblyai_account(self, body):
+        self._send_json({"lemur_enabled": True})
+
+    def _assemblyai_upload(self, body):
+        upload_id = uuid.uuid4().hex
+        self.server.uploads[upload_id] = len(body)
+        self._send_json({"upload_url": f"https://cdn.fake/{upload_id}"})
+
+    def _assemblyai_submit(self, body):
+        request = json.loads(body or b"{}")
+        transcript_id = uuid.uuid4().hex
+        upload_id = request.get("audio_url", "").rsplit("/", 1)[-1]
+        self.server.transcripts[transcript_id] = {
+            "submitted_at": time.monotonic(),
+            "audio_url": request.get("audio_url"),
+            "audio_seconds": self.server.uploads.get(upload_id, 0) / BYTES_PER_AUDIO_SECOND,
+            "language_code": request.get("language_code"),
+        }
+        self._send_json({"id": transcript_id, "status": "queued", "audio_url": request.get("audio_url")})
+
+    def _assemblyai_transcript(self, body, id):
+        transcript = self.server.transcripts.get(id)
+        if transcript is None:
+            self._send_json({"error": "transcript not found"}, status=404)
+            return
+        if time.monotonic() - transcript["submitted_at"] < self.server.config.processing_seconds:
+            self._send_json({"id": id, "status": "processing", "audio_url": transcript["audio_url"]})
+            return
+        utterances = [
+            {"speaker": "AB"[s["id"] % 2], "text": s["text"], "start": int(s["start"] * 1000), "end": int(s["end"] * 1000),
+             "confidence": 0.9, "words": []}
+            for s in _fake_segments(transcript["audio_seconds"])
+        ]
+        self._send_json({
+            "id": id,
+            "status": "completed",
+            "audio_url": transcript["audio_url"],
+            "language_code": transcript["language_code"],
+            "text": " ".join(u["text"] for u in utterances),
+            "utterances": utterances,
+            "words": [],
+        })
+
+    def _assemblyai_lemur(self, body):
+        self._send_json({"request_id": uuid.uuid4().hex, "response": f"**Argomento**\n{SAMPLE_SENTENCE}", "usage": {}})
+
+    def _resend_email(self, body):
+        self._send_json({"id": uuid.uuid4().hex})
+
+    def _resend_batch(self, body):
+        self._send_json({"data": [{"id": uuid.uuid4().hex} for _ in json.loads(body)]})
+
+    # Serves Range requests like a CDN would, so the parallel and resumable download path runs.
+    # Any prefix is accepted and gets its own content: the last bytes of the fixture are mixed
+    # with a checksum of the prefix, so sources with unique URLs never share a cache entry.
+    def _file(self, body, path):
+        if not self.server.config.files_dir:
+            self._send_json({"error": "file not found"}, status=404)
+            return
+        file_path = os.path.join(self.server.config.files_dir, os.path.basename(path))
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            self._send_json({"error": "file not found"}, status=404)
+            return
+        start, end = 0, size - 1
+        match = re.match(r"^bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        with open(file_path, "rb") as f:
+            f.seek(start)
+            data = bytearray(f.read(end - start + 1))
+        tail = zlib.crc32(os.path.dirname(path).encode("utf-8")).to_bytes(4, "big")
+        for position in range(max(start, size - len(tail)), end + 1):
+            data[position - start] ^= tail[position - (size - len(tail))]
+
+        self.send_response(206 if match else 200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{zlib.crc32(path.encode("utf-8")):08x}-{size}"')
+        if match:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        self.wfile.write(data)
+
+class FakeProviders(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        super().__init__((host, port), _Handler)
+        self.config = config or FakeConfig()
+        self.uploads = {}
+        self.transcripts = {}
+        self.requests = {}
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, route):
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+    def should_fail(self):
+        with self._lock:
+            return self._random.random() < self.config.error_rate
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-providers", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    # Environment that points the app's clients at this server
+    def environ(self):
+        return {
+            "OPENAI_BASE_URL": f"{self.base_url}/v1",
+            "ASSEMBLYAI_BASE_URL": self.base_url,
+            "RESEND_BASE_URL": self.base_url,
+        }
@@ -0,0 +1,48 @@
+import os
+from pydub import AudioSegment
+from pydub.generators import Sine
+
+# Synthetic recordings for the benchmarks: short tones separated by pauses, so the
+# silence-based splitting and trimming have something realistic to work on.
+
+TONE_MS = 1200
+PAUSE_MS = 400
+# A longer pause every few tones, like the end of a sentence
+LONG_PAUSE_MS = 1500
+TONES_PER_SENTENCE = 5
+FREQUENCIES = (220, 330, 440, 550)
+
+def speech_like(seconds, frame_rate=44100, channels=2):
+    tones = [Sine(freq).to_audio_segment(duration=TONE_MS, volume=-12) for freq in FREQUENCIES]
+    pause = AudioSegment.silent(duration=PAUSE_MS, frame_rate=frame_rate)
+    long_pause = AudioSegment.silent(duration=LONG_PAUSE_MS, frame_rate=frame_rate)
+    pieces = []
+    total_ms = 0
+    index = 0
+    while total_ms < seconds * 1000:
+        tone = tones[index % len(tones)]
+        gap = long_pause if (index + 1) % TONES_PER_SENTENCE == 0 else pause
+        pieces.append(tone.set_frame_rate(frame_rate))
+        pieces.append(gap)
+        total_ms += len(tone) + len(gap)
+        index += 1
+    # Joining raw frames is linear, summing segments one by one is quadratic
+    audio = pieces[0]._spawn(b"".join(piece.raw_data for piece in pieces))
+    return audio[:seconds * 1000].set_channels(channels)
+
+# Create (or reuse) one file per (seconds, format) pair and return their paths
+def generate_fixtures(directory, lengths, formats):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for seconds in lengths:
+        audio = None
+        for fmt in formats:
+            path = os.path.join(directory, f"fixture-{seconds}s.{fmt}")
+            if not os.path.exists(path):
+                if audio is None:
+                    audio = speech_like(seconds)
+                # Write under a temporary name so an interrupted run leaves no half files
+                audio.export(path + ".part", format=fmt)
+                os.replace(path + ".part", path)
+            paths.append(path)
+    return paths
@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+# Cold-start profile of the Streamlit pages and the CLI: every target runs in a fresh
+# interpreter with -X importtime, so nothing is already imported. Pages are executed in
+# Streamlit's bare mode, which also times the work done before the first element is drawn.
+#
+#   python -m benchmarks.import_time                    # all pages, top 15 modules each
+#   python -m benchmarks.import_time home.py --top 30
+#   python -m benchmarks.import_time --max-seconds 1.0  # exits 1 if a target is slower
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_TARGETS = [
+    "home.py",
+    "pages/config.py",
+    "pages/summarizer.py",
+    "pages/search.py",
+    "pages/metrics.py",
+    "sbobinator",
+]
+BARE_MODE_PREFIX = "bare mode: "
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+# Python code that loads a target: pages are run as scripts, anything else is imported.
+# Bare mode has no script runner, so a page can fail after its imports (st.stop() doesn't
+# stop it); that is reported but only import errors count as failures.
+def _loader(target):
+    if target.endswith(".py"):
+        return (
+            "import runpy, sys\n"
+            "try:\n"
+            f"    runpy.run_path({target!r}, run_name='__main__')\n"
+            "except ImportError:\n"
+            "    raise\n"
+            "except BaseException as e:\n"
+            f"    print({BARE_MODE_PREFIX!r} + type(e).__name__ + ': ' + str(e), file=sys.stderr)\n"
+        )
+    return f"import {target}"
+
+def profile(target, env):
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _loader(target)],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    wall = time.perf_counter() - started
+    modules = []
+    note = None
+    for line in completed.stderr.splitlines():
+        if line.startswith(BARE_MODE_PREFIX):
+            note = line
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append({"module": name, "depth": len(indent) // 2, "self": int(self_us) / 1e6, "cumulative": int(cumulative_us) / 1e6})
+    # Top-level entries add up to the whole import time, nested ones are already included
+    return {
+        "target": target,
+        "ok": completed.returncode == 0,
+        "wall_seconds": wall,
+        "import_seconds": sum(m["cumulative"] for m in modules if m["depth"] == 0),
+        "modules": modules,
+        "error": completed.stderr.strip().splitlines()[-1] if completed.returncode else None,
+        "note": note,
+    }
+
+# Heaviest packages: time spent in each root package's own modules, across all depths
+def heaviest(result, top):
+    packages = {}
+    for module in result["modules"]:
+        root = module["module"].split(".")[0]
+        packages[root] = packages.get(root, 0) + module["self"]
+    return sorted(packages.items(), key=lambda item: -item[1])[:top]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmarks.import_time", description="Tempi di import a freddo delle pagine e della CLI")
+    parser.add_argument("targets", nargs="*", default=DEFAULT_TARGETS, help="Pagine (.py) o moduli da profilare")
+    parser.add_argument("--top", type=int, default=15, help="Pacchetti più lenti da mostrare per ogni target")
+    parser.add_argument("--max-seconds", type=float, help="Tempo massimo ammesso per target, altrimenti esce con 1")
+    parser.add_argument("-o", "--output", help="File JSON in cui salvare i risultati")
+    args = parser.parse_args(argv)
+
+    # Pages create their databases at import, keep them away from the real cache
+    env = dict(os.environ)
+    workdir = tempfile.mkdtemp(prefix="sbobinator-import-")
+    env["SBOBINATOR_CACHE_DIR"] = os.path.join(workdir, "cache")
+    env["SBOBINATOR_SPOOL_DIR"] = os.path.join(workdir, "spool")
+
+    results = [profile(target, env) for target in args.targets]
+    slow = []
+    for result in results:
+        status = f"  ERRORE: {result['error']}" if not result["ok"] else f"  ({result['note']})" if result["note"] else ""
+        print(f"{result['target']}: {result['wall_seconds']:.2f} s totali, {result['import_seconds']:.2f} s di import{status}")
+        for package, seconds in heaviest(result, args.top):
+            print(f"    {seconds * 1000:8.1f} ms  {package}")
+        if not result["ok"] or (args.max_seconds is not None and result["wall_seconds"] > args.max_seconds):
+            slow.append(result["target"])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 1 if slow else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.fake_servers import FakeConfig, FakeProviders, ROUTES
+from benchmarks.fixtures import generate_fixtures
+
+# End-to-end benchmark of download -> transcribe -> summarize -> email against the fake
+# providers, without network access:
+#
+#   python -m benchmarks.run --sources 8 --lengths 60,600 --formats wav,mp3 -o results.json
+#   python -m benchmarks.run --baseline results.json   # exits 1 on a regression
+#
+# Caches, spool and metrics live in a fresh temporary directory, so every run starts cold.
+
+FIXTURES_DIR = os.path.join(tempfile.gettempdir(), "sbobinator-bench-fixtures")
+API_KEYS = {"openai": "bench-openai-key", "assemblyai": "bench-assemblyai-key"}
+# Metrics compared against a baseline, and whether higher is better
+COMPARED = {
+    "throughput_sources_per_minute": True,
+    "latency_p50_seconds": False,
+    "latency_p95_seconds": False,
+    "peak_rss_mb": False,
+}
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+# Peak resident memory of this process and of its children (ffmpeg, worker processes), in MB
+def peak_rss_mb():
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes everywhere else
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return (own + children) / scale
+
+def parse_latency(values):
+    latency = {}
+    for value in values:
+        route, _, seconds = value.partition("=")
+        if route not in ROUTES:
+            raise argparse.ArgumentTypeError(f"Route sconosciuta: {route}")
+        latency[route] = float(seconds)
+    return latency
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, higher_is_better in COMPARED.items():
+        old, new = baseline.get(name), results.get(name)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{name}: {old:.2f} -> {new:.2f} ({change:+.0%})")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmarks.run", description="Benchmark offline della pipeline con provider finti")
+    parser.add_argument("--engine", choices=["openai", "assemblyai"], default="openai")
+    parser.add_argument("--sources", type=int, default=8, help="Numero di sorgenti da elaborare")
+    parser.add_argument("--concurrency", type=int, default=4, help="Sorgenti elaborate in parallelo")
+    parser.add_argument("--lengths", default="30,300", help="Durate delle fixture in secondi, separate da virgole")
+    parser.add_argument("--formats", default="wav,mp3", help="Formati delle fixture, separati da virgole")
+    parser.add_argument("--latency", action="append", default=[], metavar="ROUTE=SECONDS",
+                        help=f"Latenza aggiunta a una route, ripetibile. Route: {', '.join(ROUTES)}")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Frazione di richieste che ricevono un errore")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--processing-seconds", type=float, default=2.0, help="Tempo di elaborazione simulato di AssemblyAI")
+    parser.add_argument("--no-summary", action="store_true")
+    parser.add_argument("--no-email", action="store_true")
+    parser.add_argument("--real-limits", action="store_true", help="Usa i limiti di richieste reali invece di disattivarli")
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="Cartella in cui generare e riusare le fixture")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="File JSON in cui salvare i risultati")
+    parser.add_argument("--baseline", help="Risultati JSON di riferimento da confrontare")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Peggioramento relativo ammesso rispetto alla baseline")
+    args = parser.parse_args(argv)
+
+    lengths = [int(value) for value in args.lengths.split(",")]
+    fixtures = generate_fixtures(args.fixtures, lengths, args.formats.split(","))
+
+    server = FakeProviders(FakeConfig(
+        latency=parse_latency(args.latency),
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        processing_seconds=args.processing_seconds,
+        files_dir=args.fixtures,
+        seed=args.seed
+    )).start()
+
+    workdir = tempfile.mkdtemp(prefix="sbobinator-bench-")
+    os.environ.update(server.environ())
+    os.environ["SBOBINATOR_CACHE_DIR"] = os.path.join(workdir, "cache")
+    os.environ["SBOBINATOR_SPOOL_DIR"] = os.path.join(workdir, "spool")
+    if not args.real_limits:
+        for name in ("OPENAI_AUDIO_RPM", "OPENAI_CHAT_RPM", "OPENAI_CHAT_TPM", "ASSEMBLYAI_RPM", "RESEND_RPM"):
+            os.environ[f"SBOBINATOR_LIMIT_{name}"] = "1000000000"
+
+    # The app reads its configuration at import time, so it is imported only now
+    import pipeline
+    from engines import get_engine
+    import emails
+    from metrics import load_spans
+
+    engine = get_engine(args.engine)
+    language_name = next(name for name, code in pipeline.LANGUAGES.items() if code == "it")
+    formats = args.formats.split(",")
+    # Every source gets its own URL, and the fake server gives every URL its own bytes, so
+    # downloads and transcripts are not served from cache or shared between sources.
+    # Fixtures come in (length, format) order, cycle through them
+    sources = [
+        (f"{server.base_url}/files/{index}/{os.path.basename(fixtures[index % len(fixtures)])}",
+         lengths[(index % len(fixtures)) // len(formats)])
+        for index in range(args.sources)
+    ]
+
+    def run_source(source):
+        url, _ = source
+        started = time.perf_counter()
+        audio_path, _ = pipeline.download_source(url)
+        transcript = engine.transcribe(API_KEYS, audio_path, "it")
+        if not args.no_summary:
+            summary, _ = pipeline.summarize(API_KEYS, args.engine, transcript, language_name)
+            if not args.no_email:
+                emails.send(emails.compose("bench@example.com", "Benchmark", [("Riassunto", summary, "riassunto.txt")]), api_key="bench-resend-key")
+        return time.perf_counter() - started
+
+    started_at = time.time()
+    started = time.perf_counter()
+    latencies = []
+    failures = []
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(run_source, source) for source in sources]
+        for source, future in zip(sources, futures):
+            try:
+                latencies.append(future.result())
+            except Exception as e:
+                failures.append(f"{source[0]}: {e}")
+    wall = time.perf_counter() - started
+
+    stages = {}
+    for span in load_spans(started_at):
+        stages.setdefault(span["stage"], []).append(span["duration"])
+    server.stop()
+
+    audio_seconds = sum(seconds for _, seconds in sources)
+    results = {
+        "engine": args.engine,
+        "sources": args.sources,
+        "concurrency": args.concurrency,
+        "failures": len(failures),
+        "wall_seconds": wall,
+        "throughput_sources_per_minute": len(latencies) / wall * 60 if wall else None,
+        "audio_seconds_per_second": audio_seconds / wall if wall else None,
+        "latency_p50_seconds": percentile(latencies, 0.5),
+        "latency_p95_seconds": percentile(latencies, 0.95),
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": {
+            stage: {"count": len(durations), "p50": percentile(durations, 0.5), "p95": percentile(durations, 0.95)}
+            for stage, durations in sorted(stages.items())
+        },
+        "requests": dict(sorted(server.requests.items())),
+    }
+
+    print(json.dumps(results, indent=2))
+    for failure in failures:
+        print(f"errore: {failure}", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"regressione: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import threading
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Process-wide registry of API clients and HTTP sessions. Each provider/key pair gets one
+# pooled client that is reused across reruns, sessions and job workers, so connections
+# stay warm and every request has a timeout.
+# The openai SDK takes half a second to import, it is only loaded with the first client.
+
+# (connect, read) timeouts for plain HTTP calls
+DEFAULT_TIMEOUT = (10, 60)
+# Whisper uploads and long completions can legitimately take minutes
+OPENAI_TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+# Only for calls that don't go through the scheduler (see get_openai_client)
+OPENAI_MAX_RETRIES = 3
+POOL_MAX_CONNECTIONS = 20
+POOL_MAX_KEEPALIVE = 10
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_openai_clients = {}
+_http_sessions = {}
+_lock = threading.Lock()
+
+# Transcriptions and completions retry through the scheduler (ratelimit.Scheduler.report_failure),
+# which only sees the 429s it is told about: the SDK's own retries are off. Calls made outside
+# the scheduler can get them back with client.with_options(max_retries=OPENAI_MAX_RETRIES).
+def get_openai_client(api_key):
+    from openai import OpenAI
+    with _lock:
+        if api_key not in _openai_clients:
+            _openai_clients[api_key] = OpenAI(
+                api_key=api_key,
+                timeout=OPENAI_TIMEOUT,
+                max_retries=0,
+                http_client=httpx.Client(
+                    timeout=OPENAI_TIMEOUT,
+                    limits=httpx.Limits(
+                        max_connections=POOL_MAX_CONNECTIONS,
+                        max_keepalive_connections=POOL_MAX_KEEPALIVE
+                    )
+                )
+            )
+        return _openai_clients[api_key]
+
+# Only idempotent methods are retried automatically, so a POST (e.g. an email) is never sent twice
+def _new_session(headers):
+    session = requests.Session()
+    retry = Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS_CODES,
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_MAX_KEEPALIVE, pool_maxsize=POOL_MAX_CONNECTIONS, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(headers or {})
+    return session
+
+# One session per provider and credentials, e.g. get_http_session("assemblyai", {"authorization": key})
+def get_http_session(provider, headers=None):
+    key = (provider, tuple(sorted((headers or {}).items())))
+    with _lock:
+        if key not in _http_sessions:
+            _http_sessions[key] = _new_session(headers)
+        return _http_sessions[key]
+
+def assemblyai_session(api_key):
+    return get_http_session("assemblyai", {"authorization": api_key})
+
+def resend_session(api_key):
+    return get_http_session("resend", {"Authorization": f"Bearer {api_key}"})
@@ -0,0 +1,127 @@
+import hashlib
+import sys
+import threading
+import time
+import httpx
+import requests
+from clients import DEFAULT_TIMEOUT, OPENAI_MAX_RETRIES, assemblyai_session, get_openai_client
+from assemblyai_async import ASSEMBLYAI_BASE_URL
+
+# Process-wide credential checks. Each key is validated once, its capabilities are cached
+# with a TTL and shared by every session; expired entries are served while a background
+# refresh runs, so page loads don't wait on third-party APIs.
+
+PROVIDER_OPENAI = "openai"
+PROVIDER_ASSEMBLYAI = "assemblyai"
+CREDENTIAL_TTL_SECONDS = 15 * 60
+# Network failures say nothing about the key, retry them sooner
+ERROR_TTL_SECONDS = 30
+
+INVALID_CAPABILITIES = {
+    PROVIDER_OPENAI: {"valid": False, "models": []},
+    PROVIDER_ASSEMBLYAI: {"valid": False, "lemur_enabled": False},
+}
+
+_cache = {}
+_key_locks = {}
+_refreshing = set()
+_lock = threading.Lock()
+
+# Keys are only kept in memory, but there's no reason to use them as dict keys verbatim
+def _cache_key(provider, api_key):
+    return provider, hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+def _check_openai(api_key):
+    import openai
+    try:
+        models = sorted(model.id for model in get_openai_client(api_key).with_options(max_retries=OPENAI_MAX_RETRIES).models.list())
+        return {"valid": True, "models": models}, CREDENTIAL_TTL_SECONDS
+    except openai.AuthenticationError:
+        return dict(INVALID_CAPABILITIES[PROVIDER_OPENAI]), CREDENTIAL_TTL_SECONDS
+    except Exception:
+        return dict(INVALID_CAPABILITIES[PROVIDER_OPENAI]), ERROR_TTL_SECONDS
+
+def _check_assemblyai(api_key):
+    try:
+        response = assemblyai_session(api_key).get(f"{ASSEMBLYAI_BASE_URL}/v2/account", timeout=DEFAULT_TIMEOUT)
+    except requests.RequestException:
+        return dict(INVALID_CAPABILITIES[PROVIDER_ASSEMBLYAI]), ERROR_TTL_SECONDS
+    if response.status_code == 200:
+        return {"valid": True, "lemur_enabled": bool(response.json().get("lemur_enabled", False))}, CREDENTIAL_TTL_SECONDS
+    ttl = CREDENTIAL_TTL_SECONDS if response.status_code in (401, 403) else ERROR_TTL_SECONDS
+    return dict(INVALID_CAPABILITIES[PROVIDER_ASSEMBLYAI]), ttl
+
+CHECKS = {
+    PROVIDER_OPENAI: _check_openai,
+    PROVIDER_ASSEMBLYAI: _check_assemblyai,
+}
+
+def _refresh(provider, api_key):
+    key = _cache_key(provider, api_key)
+    with _lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    # Concurrent sessions asking for the same key wait for a single check
+    with key_lock:
+        entry = _cache.get(key)
+        if entry and entry["expires_at"] > time.time():
+            return entry["capabilities"]
+        capabilities, ttl = CHECKS[provider](api_key)
+        _cache[key] = {"capabilities": capabilities, "expires_at": time.time() + ttl}
+        return capabilities
+
+def _refresh_in_background(provider, api_key):
+    key = _cache_key(provider, api_key)
+    with _lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def run():
+        try:
+            _refresh(provider, api_key)
+        finally:
+            with _lock:
+                _refreshing.discard(key)
+    threading.Thread(target=run, daemon=True).start()
+
+def get_capabilities(provider, api_key):
+    if not api_key:
+        return dict(INVALID_CAPABILITIES[provider])
+    entry = _cache.get(_cache_key(provider, api_key))
+    if entry is None:
+        return _refresh(provider, api_key)
+    if entry["expires_at"] > time.time():
+        return entry["capabilities"]
+    if entry["capabilities"]["valid"]:
+        # Serve the stale result while a background refresh runs, the key was valid a moment ago
+        _refresh_in_background(provider, api_key)
+        return entry["capabilities"]
+    return _refresh(provider, api_key)
+
+def invalidate(provider, api_key):
+    if api_key:
+        _cache.pop(_cache_key(provider, api_key), None)
+
+# Drop cached capabilities when a provider rejects a key, so the next check hits the API again
+def handle_auth_error(error, api_keys):
+    # An OpenAI error can only exist once the SDK has been imported
+    openai = sys.modules.get("openai")
+    if openai is not None and isinstance(error, openai.AuthenticationError):
+        invalidate(PROVIDER_OPENAI, api_keys.get("openai"))
+        return True
+    response = getattr(error, "response", None)
+    if (
+        isinstance(error, (httpx.HTTPStatusError, requests.HTTPError))
+        and response is not None
+        and response.status_code in (401, 403)
+        and "assemblyai" in str(response.url)
+    ):
+        invalidate(PROVIDER_ASSEMBLYAI, api_keys.get("assemblyai"))
+        return True
+    return False
+
+def get_openai_capabilities(api_key):
+    return get_capabilities(PROVIDER_OPENAI, api_key)
+
+def get_assemblyai_capabilities(api_key):
+    return get_capabilities(PROVIDER_ASSEMBLYAI, api_key)
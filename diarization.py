@@ -0,0 +1,359 @@
+import bisect
+import os
+from collections import Counter
+import numpy as np
+from disk_cache import CACHE_DIR, audio_key
+from metrics import span
+from transcription import stream_mono
+from transcripts import Transcript
+
+# Local speaker diarization on the CPU, so diarized transcripts don't need AssemblyAI:
+#   1. voice activity detection on frame energy against the recording's own noise floor
+#   2. one embedding per 1.5 s window of speech: mean and spread of the MFCCs, computed for
+#      every window at once with cumulative sums over the frames
+#   3. spherical k-means on the embeddings, the number of speakers is picked by silhouette
+# Speaker turns are then matched to Whisper's segments through their word timings (see merge_transcript).
+# Embeddings only depend on the audio, they are cached per audio hash.
+
+SAMPLE_RATE = 16000
+FRAME_SAMPLES = 400  # 25 ms
+HOP_SAMPLES = 160  # 10 ms
+FFT_SIZE = 512
+MEL_BANDS = 40
+MFCC_COUNT = 20
+# Frames are processed in blocks to bound memory on long recordings
+BLOCK_FRAMES = 6000
+
+# Frames this much louder than the noise floor count as speech
+VAD_MARGIN_DB = 12.0
+VAD_SMOOTH_FRAMES = 30
+MIN_SPEECH_SECONDS = 0.25
+MIN_GAP_SECONDS = 0.3
+
+WINDOW_SECONDS = 1.5
+WINDOW_HOP_SECONDS = 0.75
+# Speech shorter than this gives no reliable embedding
+MIN_WINDOW_SECONDS = 0.5
+
+MAX_SPEAKERS = int(os.environ.get("SBOBINATOR_DIARIZATION_MAX_SPEAKERS", "8"))
+# Below this silhouette the windows are not separable, the recording has one speaker
+MIN_SILHOUETTE = 0.12
+SILHOUETTE_SAMPLE = 2000
+KMEANS_ITERATIONS = 30
+SEED = 0
+
+# Part of the transcript cache key, bump it when the algorithm changes
+DIARIZATION_MODEL = "mfcc-kmeans-v1"
+DIARIZATION_CACHE_DIR = os.path.join(CACHE_DIR, "diarization")
+DIARIZATION_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# The recording as blocks of int16 samples, decoded while they are consumed
+def stream_samples(path):
+    for block in stream_mono(path, SAMPLE_RATE, BLOCK_FRAMES * HOP_SAMPLES):
+        yield np.frombuffer(block, dtype=np.int16)
+
+def _mel_filterbank():
+    def hz_to_mel(hz):
+        return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+    def mel_to_hz(mel):
+        return 700.0 * (10 ** (mel / 2595.0) - 1.0)
+
+    mels = np.linspace(hz_to_mel(0), hz_to_mel(SAMPLE_RATE / 2), MEL_BANDS + 2)
+    bins = np.floor((FFT_SIZE + 1) * mel_to_hz(mels) / SAMPLE_RATE).astype(int)
+    filters = np.zeros((MEL_BANDS, FFT_SIZE // 2 + 1), dtype=np.float32)
+    for i in range(MEL_BANDS):
+        left, center, right = bins[i], bins[i + 1], bins[i + 2]
+        if center > left:
+            filters[i, left:center] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            filters[i, center:right] = (right - np.arange(center, right)) / (right - center)
+    return filters
+
+def _dct_matrix():
+    n = np.arange(MEL_BANDS)
+    k = np.arange(MFCC_COUNT)[:, None]
+    return (np.cos(np.pi * k * (2 * n + 1) / (2 * MEL_BANDS)) * np.sqrt(2.0 / MEL_BANDS)).astype(np.float32)
+
+# Per-frame log energy (dB) and MFCCs without c0, shape (frames,) and (frames, MFCC_COUNT - 1).
+# blocks is an iterable of sample arrays, the samples a frame needs from the next block are
+# carried over, so only the features of the whole recording are kept.
+def frame_features(blocks):
+    energies = []
+    mfccs = []
+    window = np.hamming(FRAME_SAMPLES).astype(np.float32)
+    filters = _mel_filterbank()
+    dct = _dct_matrix()
+    offsets = np.arange(FRAME_SAMPLES)
+    pending = np.zeros(0, dtype=np.int16)
+    for block in blocks:
+        samples = np.concatenate((pending, block))
+        frame_count = max(0, 1 + (len(samples) - FRAME_SAMPLES) // HOP_SAMPLES)
+        for block_start in range(0, frame_count, BLOCK_FRAMES):
+            block_end = min(block_start + BLOCK_FRAMES, frame_count)
+            indices = np.arange(block_start, block_end)[:, None] * HOP_SAMPLES + offsets
+            frames = samples[indices].astype(np.float32) / 32768.0
+            energies.append(10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10))
+            frames -= frames.mean(axis=1, keepdims=True)
+            spectrum = np.abs(np.fft.rfft(frames * window, n=FFT_SIZE)) ** 2
+            log_mel = np.log(spectrum @ filters.T + 1e-10)
+            mfccs.append((log_mel @ dct.T)[:, 1:].astype(np.float32))
+        pending = samples[frame_count * HOP_SAMPLES:]
+    if not energies:
+        return np.zeros(0, dtype=np.float32), np.zeros((0, MFCC_COUNT - 1), dtype=np.float32)
+    return np.concatenate(energies).astype(np.float32), np.concatenate(mfccs)
+
+# Boolean speech mask per frame
+def detect_speech(energies):
+    if not len(energies):
+        return np.zeros(0, dtype=bool)
+    threshold = np.percentile(energies, 10) + VAD_MARGIN_DB
+    smoothed = np.convolve((energies > threshold).astype(np.float32), np.ones(VAD_SMOOTH_FRAMES) / VAD_SMOOTH_FRAMES, mode="same")
+    speech = smoothed > 0.5
+    frames_per_second = SAMPLE_RATE / HOP_SAMPLES
+    regions = _regions(speech)
+    # Close short pauses, then drop blips
+    for (_, end), (next_start, _) in zip(regions, regions[1:]):
+        if next_start - end < MIN_GAP_SECONDS * frames_per_second:
+            speech[end:next_start] = True
+    for start, end in _regions(speech):
+        if end - start < MIN_SPEECH_SECONDS * frames_per_second:
+            speech[start:end] = False
+    return speech
+
+# (start, end) frame ranges where mask is True
+def _regions(mask):
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+# Windows over the speech regions and their embeddings, all windows at once: sums over any
+# frame range come from two lookups in the cumulative sums
+def window_embeddings(mfccs, speech):
+    frames_per_second = SAMPLE_RATE / HOP_SAMPLES
+    window = int(WINDOW_SECONDS * frames_per_second)
+    hop = int(WINDOW_HOP_SECONDS * frames_per_second)
+    bounds = []
+    for start, end in _regions(speech):
+        if end - start < MIN_WINDOW_SECONDS * frames_per_second:
+            continue
+        last = max(start, end - window)
+        bounds.extend((s, min(s + window, end)) for s in range(start, last + 1, hop))
+        if bounds[-1][1] < end:
+            bounds.append((last, end))
+    if not bounds:
+        return np.zeros((0, 2), dtype=np.float32), np.zeros((0, 2 * mfccs.shape[1]), dtype=np.float32)
+
+    bounds = np.array(bounds)
+    starts, ends = bounds[:, 0], bounds[:, 1]
+    values = mfccs.astype(np.float64)
+    cumulative = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(values, axis=0)])
+    cumulative_squares = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(values ** 2, axis=0)])
+    counts = (ends - starts)[:, None]
+    means = (cumulative[ends] - cumulative[starts]) / counts
+    variances = (cumulative_squares[ends] - cumulative_squares[starts]) / counts - means ** 2
+    embeddings = np.hstack([means, np.sqrt(np.maximum(variances, 0))]).astype(np.float32)
+    times = (bounds * HOP_SAMPLES / SAMPLE_RATE).astype(np.float32)
+    return times, embeddings
+
+def _cache_path(key):
+    return os.path.join(DIARIZATION_CACHE_DIR, f"{key}-{DIARIZATION_MODEL}.npz")
+
+# Drop the least recently used embedding files beyond DIARIZATION_CACHE_MAX_BYTES
+def _prune_cache():
+    entries = []
+    for name in os.listdir(DIARIZATION_CACHE_DIR):
+        path = os.path.join(DIARIZATION_CACHE_DIR, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= DIARIZATION_CACHE_MAX_BYTES:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+# (times, embeddings) for an audio file, from the cache when it was seen before
+def compute_embeddings(audio_path):
+    path = _cache_path(audio_key(audio_path))
+    if os.path.exists(path):
+        os.utime(path)
+        with np.load(path) as cached:
+            return cached["times"], cached["embeddings"]
+
+    with span("diarization_embeddings", provider="local", model=DIARIZATION_MODEL, bytes_in=os.path.getsize(audio_path)):
+        energies, mfccs = frame_features(stream_samples(audio_path))
+        times, embeddings = window_embeddings(mfccs, detect_speech(energies))
+
+    os.makedirs(DIARIZATION_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(tmp_path, times=times, embeddings=embeddings)
+    os.replace(tmp_path, path)
+    _prune_cache()
+    return times, embeddings
+
+def _normalize(embeddings):
+    centered = (embeddings - embeddings.mean(axis=0)) / (embeddings.std(axis=0) + 1e-6)
+    return centered / (np.linalg.norm(centered, axis=1, keepdims=True) + 1e-9)
+
+# Spherical k-means with k-means++ seeding; rows of x are unit vectors
+def _kmeans(x, k, rng):
+    centroids = [x[rng.integers(len(x))]]
+    for _ in range(1, k):
+        distances = 1 - np.max(x @ np.array(centroids).T, axis=1)
+        distances = np.maximum(distances, 0)
+        total = distances.sum()
+        index = rng.choice(len(x), p=distances / total) if total > 0 else rng.integers(len(x))
+        centroids.append(x[index])
+    centroids = np.array(centroids)
+    labels = None
+    for _ in range(KMEANS_ITERATIONS):
+        new_labels = np.argmax(x @ centroids.T, axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        for j in range(k):
+            members = x[labels == j]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[j] = centroid / (np.linalg.norm(centroid) + 1e-9)
+    return labels
+
+# Mean silhouette with cosine distance
+def _silhouette(x, labels, k):
+    distances = 1 - x @ x.T
+    scores = np.zeros(len(x))
+    per_cluster = np.stack([
+        distances[:, labels == j].mean(axis=1) if np.any(labels == j) else np.full(len(x), np.inf)
+        for j in range(k)
+    ], axis=1)
+    sizes = np.bincount(labels, minlength=k)
+    own = per_cluster[np.arange(len(x)), labels] * sizes[labels] / np.maximum(sizes[labels] - 1, 1)
+    per_cluster[np.arange(len(x)), labels] = np.inf
+    nearest = per_cluster.min(axis=1)
+    valid = sizes[labels] > 1
+    scores[valid] = ((nearest - own) / np.maximum(own, nearest))[valid]
+    return scores.mean()
+
+# Cluster label per window; num_speakers fixes the count instead of estimating it
+def cluster(embeddings, num_speakers=None):
+    if len(embeddings) < 2:
+        return np.zeros(len(embeddings), dtype=int)
+    x = _normalize(embeddings)
+    rng = np.random.default_rng(SEED)
+    if num_speakers:
+        return _kmeans(x, min(num_speakers, len(x)), rng)
+
+    sample = rng.choice(len(x), size=min(SILHOUETTE_SAMPLE, len(x)), replace=False)
+    best_labels, best_score = np.zeros(len(x), dtype=int), MIN_SILHOUETTE
+    for k in range(2, min(MAX_SPEAKERS, len(x) - 1) + 1):
+        labels = _kmeans(x, k, rng)
+        score = _silhouette(x[sample], labels[sample], k)
+        if score > best_score:
+            best_labels, best_score = labels, score
+    return best_labels
+
+# Speaker turns as (start, end, label) in seconds, adjacent windows of one speaker merged
+def speaker_turns(times, labels):
+    if not len(labels):
+        return []
+    # A single window between two windows of another speaker is noise
+    labels = labels.copy()
+    for i in range(1, len(labels) - 1):
+        if labels[i - 1] == labels[i + 1] != labels[i] and times[i][0] < times[i - 1][1] and times[i + 1][0] < times[i][1]:
+            labels[i] = labels[i - 1]
+
+    turns = []
+    for (start, end), label in zip(times, labels):
+        start, end, label = float(start), float(end), int(label)
+        if turns and turns[-1][2] == label and start <= turns[-1][1]:
+            turns[-1][1] = end
+        elif turns and start < turns[-1][1]:
+            # Overlapping windows of different speakers: split the overlap in the middle
+            middle = (start + turns[-1][1]) / 2
+            turns[-1][1] = middle
+            turns.append([middle, end, label])
+        else:
+            turns.append([start, end, label])
+    return [tuple(turn) for turn in turns]
+
+def diarize(audio_path, num_speakers=None):
+    times, embeddings = compute_embeddings(audio_path)
+    with span("diarization_clustering", provider="local", model=DIARIZATION_MODEL) as info:
+        labels = cluster(embeddings, num_speakers)
+        info["speakers"] = int(labels.max()) + 1 if len(labels) else 0
+    return speaker_turns(times, labels)
+
+# Label of the turn overlapping [start, end] the most, or of the nearest one. Turns are
+# sorted and don't overlap, so only the few around the bisection point are candidates
+def _speaker_at(turns, turn_starts, start, end):
+    first = max(0, bisect.bisect_right(turn_starts, start) - 1)
+    last = bisect.bisect_left(turn_starts, end) + 1
+    best, best_overlap, best_distance = None, 0.0, float("inf")
+    for turn_start, turn_end, label in turns[first:last]:
+        overlap = min(end, turn_end) - max(start, turn_start)
+        distance = max(turn_start - end, start - turn_end, 0)
+        if overlap > best_overlap or (best_overlap == 0 and overlap <= 0 and distance < best_distance):
+            best, best_overlap, best_distance = label, max(overlap, 0.0), distance
+    return best
+
+# Whisper output ({"segments", "words"}) plus speaker turns -> diarized Transcript. Each
+# Whisper segment keeps its punctuated text and gets the speaker most of its words fall in;
+# consecutive segments of the same speaker are joined into one utterance, like AssemblyAI's
+# utterances. Speakers are named A, B, ... in order of appearance.
+def merge_transcript(result, turns, engine, language=None):
+    transcript = Transcript(engine=engine, language=language)
+    turn_starts = [turn[0] for turn in turns]
+    names = {}
+
+    def name(label):
+        if label not in names:
+            names[label] = chr(ord("A") + len(names)) if len(names) < 26 else str(len(names) + 1)
+        return names[label]
+
+    words = sorted(result.get("words") or [], key=lambda w: w["start"])
+    segments = sorted(result.get("segments") or [], key=lambda s: s["start"])
+    if not segments:
+        # Only word timings: every word is its own piece of text
+        segments = [{"start": w["start"], "end": w["end"], "text": w["text"]} for w in words]
+    # Words go to the segment their middle falls in, words past a segment's end to that segment
+    segment_starts = [segment["start"] for segment in segments]
+    segment_words = [[] for _ in segments]
+    for word in words:
+        index = bisect.bisect_right(segment_starts, (word["start"] + word["end"]) / 2) - 1
+        segment_words[max(index, 0)].append(word)
+
+    utterance = []
+    speaker = None
+    for segment, own_words in zip(segments, segment_words):
+        labels = Counter(
+            label for label in (_speaker_at(turns, turn_starts, w["start"], w["end"]) for w in own_words)
+            if label is not None
+        )
+        if labels:
+            label = labels.most_common(1)[0][0]
+        else:
+            label = _speaker_at(turns, turn_starts, segment["start"], segment["end"])
+        segment_speaker = name(label) if label is not None else speaker
+        if utterance and segment_speaker != speaker:
+            _add_utterance(transcript, utterance, speaker)
+            utterance = []
+        speaker = segment_speaker
+        utterance.append((segment, own_words))
+    if utterance:
+        _add_utterance(transcript, utterance, speaker)
+    return transcript
+
+# parts: (Whisper segment, its words) of one speaker, in order
+def _add_utterance(transcript, parts, speaker):
+    words = [{**w, "speaker": speaker} for _, own_words in parts for w in own_words]
+    confidences = [s["confidence"] for s, _ in parts if s.get("confidence") is not None]
+    transcript.add_segment(
+        parts[0][0]["start"], parts[-1][0]["end"], " ".join(s["text"].strip() for s, _ in parts if s["text"].strip()), speaker,
+        sum(confidences) / len(confidences) if confidences else None, words
+    )
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Persistent caches live outside the spool so they survive restarts and spool cleanups
+CACHE_DIR = os.environ.get("SBOBINATOR_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "sbobinator"))
+HASH_CHUNK_SIZE = 1024 * 1024
+TRANSCRIPT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+SUMMARY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_hash_memo = {}
+_hash_lock = threading.Lock()
+_audio_keys = {}
+
+# Streaming SHA-256 of a file, memoized on (path, size, mtime) so reruns don't rehash
+def hash_file(path):
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _hash_lock:
+        if memo_key in _hash_memo:
+            return _hash_memo[memo_key]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    with _hash_lock:
+        _hash_memo[memo_key] = digest.hexdigest()
+    return _hash_memo[memo_key]
+
+# Files derived from another one (e.g. the preprocessed upload) are identified by their
+# source and the processing applied, re-encoding the same audio twice doesn't give the same bytes
+def register_audio_key(path, key):
+    stat = os.stat(path)
+    with _hash_lock:
+        _audio_keys[(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)] = key
+
+# Cache identity of an audio file: the registered key of a derived file, else its hash
+def audio_key(path):
+    stat = os.stat(path)
+    with _hash_lock:
+        key = _audio_keys.get((os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+    return key or hash_file(path)
+
+def transcript_cache_key(audio_hash, engine, model, language):
+    return f"{audio_hash}:{engine}:{model}:{language}"
+
+# A chat completion is identified by everything that goes into the request
+def summary_cache_key(text, model, prompt, system_prompt, max_tokens):
+    request = json.dumps([text, model, prompt, system_prompt, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+# SQLite-backed key/value store of JSON values with least-recently-used eviction by size
+class DiskCache:
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+
+    # Connections are per call, so the cache can be shared by every Streamlit session thread
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        data = json.dumps(value, ensure_ascii=False)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, data, len(data.encode("utf-8")), time.time())
+            )
+            self._evict(conn)
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    # Drop the least recently used entries until the total size fits in max_bytes
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+transcript_cache = DiskCache(os.path.join(CACHE_DIR, "transcripts.sqlite3"), TRANSCRIPT_CACHE_MAX_BYTES)
+# Partial and final summaries, so re-summarizing only redoes the chunks that changed
+summary_cache = DiskCache(os.path.join(CACHE_DIR, "summaries.sqlite3"), SUMMARY_CACHE_MAX_BYTES)
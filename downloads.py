@@ -0,0 +1,355 @@
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import unquote, urlparse
+import requests
+from clients import DEFAULT_TIMEOUT, get_http_session
+from spool import CHUNK_SIZE, get_spool_dir, new_spool_path
+from singleflight import SingleFlight
+
+# Download manager for plain URLs. The first request asks for the first segment with a Range
+# header, which gives the metadata (name, size, type, validators) and the first bytes at once.
+# When the server supports ranges the rest is fetched in parallel segments; progress is kept
+# next to the partial file so an interrupted download resumes where it stopped. Concurrent
+# downloads of the same URL share one transfer. A GrowingFile passed as progress lets another
+# thread read the bytes that are already on disk while the rest is still arriving.
+
+SEGMENT_SIZE = 8 * 1024 * 1024
+DOWNLOAD_WORKERS = int(os.environ.get("SBOBINATOR_DOWNLOAD_WORKERS", "4"))
+SEGMENT_RETRIES = 3
+# Error and login pages come back as HTML with a 200, they are never audio
+REJECTED_CONTENT_TYPES = ("text/html",)
+# Some writers report bytes before flushing them, readers that catch up wait this long
+FOLLOW_POLL_SECONDS = 0.2
+
+class DownloadError(Exception):
+    pass
+
+# A download that can be read while it is running. Writers call grow(path, size) whenever
+# the first size bytes of path are on disk, the owner of the download calls finish() or
+# fail(). The path may change while the file grows (a .part file renamed at the end);
+# a reader keeps the file it opened, renames don't affect it.
+class GrowingFile:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.path = None
+        self.size = 0
+        self.done = False
+        self.error = None
+        # What the download produced, read instead when the followed file is already gone
+        self.final_path = None
+
+    def grow(self, path, size):
+        with self._condition:
+            if path != self.path or size > self.size:
+                self.path = path
+                self.size = size
+                self._condition.notify_all()
+
+    def finish(self, final_path):
+        with self._condition:
+            self.final_path = final_path
+            if self.path is None:
+                # Nothing was followed (e.g. a cached download), the result is the stream
+                self.path = final_path
+                self.size = os.path.getsize(final_path)
+            self.done = True
+            self._condition.notify_all()
+
+    def fail(self, error):
+        with self._condition:
+            self.error = error
+            self._condition.notify_all()
+
+    # Byte chunks of the file in order, waiting for new data until the download is over
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        position = 0
+        f = None
+        try:
+            while True:
+                with self._condition:
+                    self._condition.wait_for(lambda: self.error or self.done or (self.path and self.size > position))
+                    if self.error:
+                        raise self.error
+                    path, size, done, final_path = self.path, self.size, self.done, self.final_path
+                if position >= size:
+                    return
+                if f is None:
+                    try:
+                        f = open(path, "rb")
+                    except FileNotFoundError:
+                        if done and position == 0 and final_path and final_path != path:
+                            # Renamed or post-processed before we got to it, read the result
+                            with self._condition:
+                                self.path, self.size = final_path, os.path.getsize(final_path)
+                            continue
+                        if done:
+                            raise DownloadError("Il file scaricato non è più disponibile")
+                        # Renamed under us, wait for the writer to report the new path
+                        with self._condition:
+                            self._condition.wait_for(lambda: self.error or self.done or self.path != path, timeout=FOLLOW_POLL_SECONDS)
+                        continue
+                data = f.read(min(chunk_size, size - position))
+                if not data:
+                    # Reported but not flushed yet
+                    time.sleep(FOLLOW_POLL_SECONDS)
+                    continue
+                position += len(data)
+                yield data
+        finally:
+            if f is not None:
+                f.close()
+
+def _filename_from_headers(headers):
+    disposition = headers.get("content-disposition", "")
+    match = re.search(r"filename\*\s*=\s*[^']*'[^']*'([^;]+)", disposition)
+    if match:
+        return unquote(match.group(1).strip())
+    match = re.search(r'filename\s*=\s*"?([^";]+)"?', disposition)
+    if match:
+        return match.group(1).strip()
+    return None
+
+def _filename_from_url(url):
+    return unquote(os.path.basename(urlparse(url).path)) or "audio"
+
+# Total size from "Content-Range: bytes 0-99/1234", None when unknown
+def _total_from_content_range(value):
+    match = re.match(r"bytes \d+-\d+/(\d+)", value or "")
+    return int(match.group(1)) if match else None
+
+# Validators tell us whether a partial file still matches what the server has
+def _validators(headers):
+    return {"etag": headers.get("etag"), "last_modified": headers.get("last-modified")}
+
+# Content-MD5 covers the body of the response it came with: the whole file for a 200, only
+# the requested range for a 206. The digest is computed while the body is written.
+class _BodyChecksum:
+    def __init__(self, headers):
+        self.expected = (headers.get("content-md5") or "").strip()
+        self.digest = hashlib.md5()
+
+    def feed(self, chunks):
+        for chunk in chunks:
+            if self.expected:
+                self.digest.update(chunk)
+            yield chunk
+
+    def matches(self):
+        return not self.expected or base64.b64encode(self.digest.digest()).decode("ascii") == self.expected
+
+class _PartialDownload:
+    def __init__(self, url):
+        base = os.path.join(get_spool_dir(), f"partial-{hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]}")
+        self.path = base + ".part"
+        self.state_path = base + ".json"
+        self.lock = threading.Lock()
+        self.state = None
+        # Set when a segment failed, the others stop instead of finishing a doomed download
+        self.cancelled = threading.Event()
+
+    def load(self, total, validators):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = None
+        # Only resume if the server still has exactly the same file
+        if (
+            state is None
+            or state["total"] != total
+            or state["validators"] != validators
+            or not any(validators.values())
+            or not os.path.exists(self.path)
+        ):
+            state = {"total": total, "validators": validators, "done": []}
+            with open(self.path, "wb") as f:
+                f.truncate(total)
+        self.state = state
+        self._save()
+
+    def _save(self):
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(self.state, f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def exists(self):
+        return os.path.exists(self.state_path)
+
+    def is_done(self, start):
+        return start in self.state["done"]
+
+    # Bytes from the start of the file that are all written, segments finish out of order
+    def contiguous_bytes(self, segment_size):
+        with self.lock:
+            done = set(self.state["done"])
+        end = 0
+        while end < self.state["total"] and end in done:
+            end += segment_size
+        return min(end, self.state["total"])
+
+    def mark_done(self, start):
+        with self.lock:
+            self.state["done"].append(start)
+            self._save()
+
+    def write(self, start, chunks):
+        written = 0
+        with open(self.path, "r+b") as f:
+            f.seek(start)
+            for chunk in chunks:
+                if self.cancelled.is_set():
+                    break
+                if chunk:
+                    f.write(chunk)
+                    written += len(chunk)
+        return written
+
+    def discard(self):
+        for path in (self.path, self.state_path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+class DownloadManager:
+    def __init__(self, segment_size=SEGMENT_SIZE, max_workers=DOWNLOAD_WORKERS):
+        self.segment_size = segment_size
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sbobinator-download")
+        self._flight = SingleFlight("download_url")
+
+    # Download url to a new spool file and return (path, file name, content type).
+    # A second caller asking for a URL that is already downloading waits for the same result.
+    # progress (a GrowingFile) is told how much of the file can already be read.
+    def download(self, url, progress=None):
+        result, _ = self._flight.do(url, lambda: self._download(url, progress))
+        return result
+
+    def _get(self, url, start, end, validators=None):
+        headers = {"Range": f"bytes={start}-{end}"}
+        if validators and (validators["etag"] or validators["last_modified"]):
+            # Falls back to the full body if the file changed, instead of mixing versions
+            headers["If-Range"] = validators["etag"] or validators["last_modified"]
+        response = get_http_session("download").get(url, headers=headers, stream=True, timeout=DEFAULT_TIMEOUT)
+        response.raise_for_status()
+        return response
+
+    def _download(self, url, progress=None):
+        partial = _PartialDownload(url)
+        # When resuming, the first request is only needed for the metadata
+        first_end = 0 if partial.exists() else self.segment_size - 1
+        response = self._get(url, 0, first_end)
+        with response:
+            content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+            if content_type in REJECTED_CONTENT_TYPES:
+                raise DownloadError("Il link non punta a un file audio")
+            file_name = _filename_from_headers(response.headers) or _filename_from_url(response.url)
+            suffix = os.path.splitext(file_name)[1]
+            total = _total_from_content_range(response.headers.get("content-range"))
+
+            if response.status_code != 206 or total is None:
+                # No range support: stream the whole body from this same response
+                path = self._stream_whole(response, suffix, progress)
+                return path, file_name, content_type
+
+            partial.load(total, _validators(response.headers))
+            first_size = min(self.segment_size, total)
+            if not partial.is_done(0) and first_end + 1 >= first_size:
+                checksum = _BodyChecksum(response.headers)
+                written = partial.write(0, checksum.feed(response.iter_content(chunk_size=CHUNK_SIZE)))
+                # A corrupt first segment is fetched again with the others
+                if written == first_size and checksum.matches():
+                    partial.mark_done(0)
+        self._report(partial, progress)
+
+        # The remaining segments go out in parallel
+        starts = [start for start in range(0, total, self.segment_size) if not partial.is_done(start)]
+        futures = [self.executor.submit(self._fetch_segment, url, partial, start, total, progress) for start in starts]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            # Stop the other segments and let the running ones return before giving up,
+            # the partial file and its state stay consistent for a later resume
+            partial.cancelled.set()
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            raise
+
+        if os.path.getsize(partial.path) != total:
+            partial.discard()
+            raise DownloadError("Il file scaricato è incompleto")
+        path = new_spool_path(suffix)
+        os.replace(partial.path, path)
+        partial.discard()
+        if progress is not None:
+            progress.grow(path, total)
+        return path, file_name, content_type
+
+    def _report(self, partial, progress):
+        if progress is not None:
+            progress.grow(partial.path, partial.contiguous_bytes(self.segment_size))
+
+    def _fetch_segment(self, url, partial, start, total, progress=None):
+        end = min(start + self.segment_size, total) - 1
+        for attempt in range(SEGMENT_RETRIES + 1):
+            if partial.cancelled.is_set():
+                raise DownloadError("Download interrotto, riprova per riprendere da dove si è fermato")
+            try:
+                with self._get(url, start, end, partial.state["validators"]) as response:
+                    if response.status_code != 206:
+                        raise DownloadError("Il file è cambiato sul server durante il download")
+                    checksum = _BodyChecksum(response.headers)
+                    written = partial.write(start, checksum.feed(response.iter_content(chunk_size=CHUNK_SIZE)))
+                if written == end - start + 1:
+                    if checksum.matches():
+                        partial.mark_done(start)
+                        self._report(partial, progress)
+                        return
+                    if attempt == SEGMENT_RETRIES:
+                        raise DownloadError("Il file scaricato è corrotto (checksum non corrispondente)")
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError):
+                if attempt == SEGMENT_RETRIES:
+                    raise
+        raise DownloadError("Download interrotto, riprova per riprendere da dove si è fermato")
+
+    def _stream_whole(self, response, suffix, progress=None):
+        path = new_spool_path(suffix)
+        expected = response.headers.get("content-length")
+        written = 0
+        checksum = _BodyChecksum(response.headers)
+        try:
+            with open(path, "wb") as f:
+                for chunk in checksum.feed(response.iter_content(chunk_size=CHUNK_SIZE)):
+                    if chunk:
+                        f.write(chunk)
+                        written += len(chunk)
+                        if progress is not None:
+                            f.flush()
+                            progress.grow(path, written)
+            # Content-Length is the encoded size, it only matches when there's no content coding
+            if expected and not response.headers.get("content-encoding") and written != int(expected):
+                raise DownloadError("Il file scaricato è incompleto")
+            if not checksum.matches():
+                raise DownloadError("Il file scaricato è corrotto (checksum non corrispondente)")
+        except BaseException:
+            os.unlink(path)
+            raise
+        return path
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_download_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = DownloadManager()
+        return _manager
+
+def download_url(url, progress=None):
+    return get_download_manager().download(url, progress)
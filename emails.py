@@ -0,0 +1,259 @@
+import base64
+import html
+import io
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import Future
+import requests
+from clients import DEFAULT_TIMEOUT, resend_session
+from metrics import span
+from ratelimit import PROVIDER_RESEND, scheduler
+
+# Outbound email through Resend. Messages are composed from escaped templates, queued, and
+# a background worker sends whatever accumulated in the last FLUSH_SECONDS with a single
+# call to the batch endpoint. The batch endpoint doesn't take attachments, so messages
+# that carry one (long transcripts, digests) are sent on their own.
+
+RESEND_BASE_URL = os.environ.get("RESEND_BASE_URL", "https://api.resend.com")
+# The app sends mail on its own account, users don't configure a key
+RESEND_API_KEY = os.environ.get("RESEND_API_KEY", "")
+EMAIL_FROM = os.environ.get("SBOBINATOR_EMAIL_FROM", "Sbobinator <sbobinator@minutohomeserver.xyz>")
+# Public address of the app, emails link back to the job when it is set
+APP_URL = os.environ.get("SBOBINATOR_APP_URL", "").rstrip("/")
+
+# Resend accepts up to 100 messages per batch call
+BATCH_SIZE = 100
+FLUSH_SECONDS = 0.5
+EMAIL_RETRIES = 4
+# Longer texts are attached compressed, the body only shows the beginning
+INLINE_MAX_CHARS = 20000
+EXCERPT_CHARS = 2000
+# Above this (compressed) the text is not attached either, the email links to the app
+ATTACHMENT_MAX_BYTES = 20 * 1024 * 1024
+
+class EmailError(Exception):
+    pass
+
+def email_configured():
+    return bool(RESEND_API_KEY)
+
+def job_link(job_id):
+    return f"{APP_URL}/?job={job_id}" if APP_URL and job_id else None
+
+# Escaped paragraphs; **bold** from the summaries is kept
+def _html_text(text):
+    blocks = []
+    for paragraph in re.split(r"\n\s*\n", text.strip()):
+        escaped = html.escape(paragraph.strip()).replace("\n", "<br>")
+        blocks.append("<p>" + re.sub(r"\*\*(.+?)\*\*", r"<strong>\1</strong>", escaped) + "</p>")
+    return "\n".join(blocks)
+
+def _excerpt(text):
+    cut = text.rfind(" ", 0, EXCERPT_CHARS)
+    return text[:cut if cut > 0 else EXCERPT_CHARS] + " […]"
+
+# files: {name: text} -> one compressed Resend attachment
+def zip_attachment(filename, files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, text in files.items():
+            archive.writestr(name, text)
+    return {"filename": filename, "content": base64.b64encode(buffer.getvalue()).decode("ascii")}
+
+def _attachment_size(attachment):
+    return len(attachment["content"]) * 3 // 4
+
+def _render(heading, blocks, link):
+    html_parts = [f"<h1>{html.escape(heading)}</h1>"]
+    text_parts = [heading]
+    for title, body_html, body_text in blocks:
+        html_parts.append(f"<h2>{html.escape(title)}</h2>\n{body_html}")
+        text_parts.append(f"{title}\n\n{body_text}")
+    if link:
+        html_parts.append(f'<p><a href="{html.escape(link, quote=True)}">Apri in Sbobinator</a></p>')
+        text_parts.append(f"Apri in Sbobinator: {link}")
+    return (
+        '<div style="font-family: sans-serif; line-height: 1.5; max-width: 720px">\n' + "\n".join(html_parts) + "\n</div>",
+        "\n\n".join(text_parts),
+    )
+
+# sections is a list of (title, text, file_name). Texts longer than INLINE_MAX_CHARS are
+# shortened in the body and attached in full, compressed, as file_name; when even that is
+# too big the email only links to the app.
+def compose(to, subject, sections, link=None):
+    files = {file_name: text for _, text, file_name in sections if text and len(text) > INLINE_MAX_CHARS}
+    attachment = None
+    if files:
+        attachment = zip_attachment(os.path.splitext(next(iter(files)))[0] + ".zip", files)
+        if _attachment_size(attachment) > ATTACHMENT_MAX_BYTES:
+            if not link:
+                raise EmailError("Il testo è troppo grande per essere inviato via email")
+            attachment = None
+    note = "Il testo completo è nell'allegato." if attachment else "Il testo completo è disponibile in Sbobinator."
+
+    blocks = []
+    for title, text, file_name in sections:
+        text = text or ""
+        if file_name in files:
+            text = f"{_excerpt(text)}\n\n{note}"
+        blocks.append((title, _html_text(text), text))
+
+    message = {"from": EMAIL_FROM, "to": [to] if isinstance(to, str) else list(to), "subject": subject}
+    if attachment:
+        message["attachments"] = [attachment]
+    message["html"], message["text"] = _render(subject, blocks, link)
+    return message
+
+# One email summarizing many sources for one recipient. entries are dicts with title,
+# summary, and optionally transcript (collected in a single zip) and link.
+def compose_digest(to, subject, entries):
+    blocks = []
+    files = {}
+    for entry in entries:
+        body_html = _html_text(entry.get("summary") or "Riassunto non disponibile.")
+        body_text = entry.get("summary") or "Riassunto non disponibile."
+        if entry.get("link"):
+            body_html += f'\n<p><a href="{html.escape(entry["link"], quote=True)}">Apri in Sbobinator</a></p>'
+            body_text += f"\n\n{entry['link']}"
+        blocks.append((entry["title"], body_html, body_text))
+        if entry.get("transcript"):
+            name = re.sub(r"[^\w.-]+", "_", entry["title"])[:80] or "trascrizione"
+            files[f"{len(files) + 1:03d}-{name}.txt"] = entry["transcript"]
+
+    message = {"from": EMAIL_FROM, "to": [to] if isinstance(to, str) else list(to), "subject": subject}
+    if files:
+        attachment = zip_attachment("trascrizioni.zip", files)
+        if _attachment_size(attachment) > ATTACHMENT_MAX_BYTES:
+            raise EmailError("Le trascrizioni sono troppo grandi per essere inviate via email")
+        message["attachments"] = [attachment]
+        blocks.append(("Trascrizioni", f"<p>Le trascrizioni complete ({len(files)}) sono nell'allegato.</p>", f"Le trascrizioni complete ({len(files)}) sono nell'allegato."))
+    message["html"], message["text"] = _render(subject, blocks, None)
+    return message
+
+def _payload_bytes(payload):
+    messages = payload if isinstance(payload, list) else [payload]
+    return sum(
+        len(m["html"]) + len(m["text"]) + sum(len(a["content"]) for a in m.get("attachments", ()))
+        for m in messages
+    )
+
+def _error_message(response):
+    try:
+        return response.json().get("message") or response.text
+    except ValueError:
+        return response.text
+
+# POST with retries for rate limits, server errors and connection failures. The
+# idempotency key makes a retried request safe even if the first one got through.
+def _post(api_key, path, payload, messages):
+    idempotency_key = uuid.uuid4().hex
+    for attempt in range(EMAIL_RETRIES + 1):
+        scheduler.acquire(PROVIDER_RESEND, api_key)
+        try:
+            with span("email", provider="resend", bytes_out=_payload_bytes(payload), messages=messages):
+                response = resend_session(api_key).post(
+                    f"{RESEND_BASE_URL}{path}", json=payload, timeout=DEFAULT_TIMEOUT,
+                    headers={"Idempotency-Key": idempotency_key}
+                )
+        except requests.ConnectionError:
+            if attempt == EMAIL_RETRIES:
+                raise EmailError("Impossibile contattare il servizio email")
+            time.sleep(scheduler.report_failure(PROVIDER_RESEND, api_key, attempt))
+            continue
+        if response.status_code == 429 or response.status_code >= 500:
+            time.sleep(scheduler.report_failure(PROVIDER_RESEND, api_key, attempt, response))
+        else:
+            scheduler.report_success(PROVIDER_RESEND, api_key)
+            if response.status_code >= 400:
+                raise EmailError(f"Invio rifiutato ({response.status_code}): {_error_message(response)}")
+            return response.json()
+    raise EmailError(f"Invio non riuscito dopo {EMAIL_RETRIES + 1} tentativi ({response.status_code})")
+
+class EmailQueue:
+    def __init__(self, batch_size=BATCH_SIZE, flush_seconds=FLUSH_SECONDS):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # Returns a Future resolved with Resend's {"id": ...} for the message
+    def submit(self, message, api_key=None):
+        api_key = api_key or RESEND_API_KEY
+        if not api_key:
+            raise EmailError("L'invio di email non è configurato (manca RESEND_API_KEY)")
+        future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="sbobinator-email", daemon=True)
+                self._thread.start()
+        self._queue.put((api_key, message, future))
+        return future
+
+    def _worker(self):
+        while True:
+            pending = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(pending) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._deliver(pending)
+
+    def _deliver(self, pending):
+        groups = {}
+        for api_key, message, future in pending:
+            groups.setdefault(api_key, []).append((message, future))
+        for api_key, items in groups.items():
+            single = [item for item in items if "attachments" in item[0]]
+            batchable = [item for item in items if "attachments" not in item[0]]
+            if len(batchable) == 1:
+                single += batchable
+                batchable = []
+            for message, future in single:
+                self._resolve([future], lambda: [_post(api_key, "/emails", message, 1)])
+            for start in range(0, len(batchable), self.batch_size):
+                chunk = batchable[start:start + self.batch_size]
+                self._resolve(
+                    [future for _, future in chunk],
+                    lambda: _post(api_key, "/emails/batch", [message for message, _ in chunk], len(chunk))["data"]
+                )
+
+    @staticmethod
+    def _resolve(futures, send):
+        try:
+            results = send()
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            future.set_result(result)
+        # Never leave a caller of send() waiting on a message Resend didn't answer for
+        if len(results) != len(futures):
+            error = EmailError(f"Risposta incompleta dal servizio email ({len(results)} esiti per {len(futures)} messaggi)")
+            for future in futures[len(results):]:
+                future.set_exception(error)
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_email_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = EmailQueue()
+        return _queue
+
+# Queue a message and wait for it to be sent, raises EmailError on failure
+def send(message, api_key=None):
+    return get_email_queue().submit(message, api_key).result()
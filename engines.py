@@ -0,0 +1,101 @@
+import os
+import pipeline
+import local_whisper
+import transcription
+
+# Transcription engines offered by the app. Each engine turns an audio file into a
+# transcripts.Transcript.
+
+class TranscriptionEngine:
+    name = None
+    label = None
+    # Key in api_keys the engine needs, None for engines that run locally
+    api_key_name = None
+    diarization = False
+
+    def is_available(self):
+        return True
+
+    def transcribe(self, api_keys, audio_path, language, on_segment=None):
+        raise NotImplementedError
+
+    # Bytes sent to the provider to transcribe audio_path
+    def upload_bytes(self, audio_path):
+        return os.path.getsize(audio_path)
+
+class OpenAIWhisperEngine(TranscriptionEngine):
+    name = pipeline.ENGINE_OPENAI
+    label = "Senza diarizzazione (OpenAI)"
+    api_key_name = "openai"
+
+    def transcribe(self, api_keys, audio_path, language, on_segment=None):
+        return pipeline.transcribe_openai(api_keys["openai"], audio_path, language, on_segment)
+
+    def upload_bytes(self, audio_path):
+        return transcription.upload_bytes(audio_path)
+
+class AssemblyAIEngine(TranscriptionEngine):
+    name = pipeline.ENGINE_ASSEMBLYAI
+    label = "Con diarizzazione (AssemblyAI)"
+    api_key_name = "assemblyai"
+    diarization = True
+
+    def transcribe(self, api_keys, audio_path, language, on_segment=None):
+        return pipeline.transcribe_assemblyai(api_keys["assemblyai"], audio_path, language, on_segment)
+
+class LocalWhisperEngine(TranscriptionEngine):
+    name = pipeline.ENGINE_LOCAL
+    label = "Locale, senza connessione (faster-whisper)"
+
+    def is_available(self):
+        return local_whisper.is_available()
+
+    def transcribe(self, api_keys, audio_path, language, on_segment=None):
+        return pipeline.transcribe_local(audio_path, language, on_segment)
+
+    def upload_bytes(self, audio_path):
+        return 0
+
+# Speakers are separated on the server's CPU, Whisper only provides the timed words
+class OpenAIWhisperDiarizedEngine(TranscriptionEngine):
+    name = pipeline.ENGINE_OPENAI_DIARIZED
+    label = "Con diarizzazione locale (OpenAI)"
+    api_key_name = "openai"
+    diarization = True
+
+    def transcribe(self, api_keys, audio_path, language, on_segment=None):
+        return pipeline.transcribe_openai_diarized(api_keys["openai"], audio_path, language, on_segment)
+
+    def upload_bytes(self, audio_path):
+        return transcription.upload_bytes(audio_path)
+
+class LocalWhisperDiarizedEngine(TranscriptionEngine):
+    name = pipeline.ENGINE_LOCAL_DIARIZED
+    label = "Locale con diarizzazione, senza connessione (faster-whisper)"
+    diarization = True
+
+    def is_available(self):
+        return local_whisper.is_available()
+
+    def transcribe(self, api_keys, audio_path, language, on_segment=None):
+        return pipeline.transcribe_local_diarized(audio_path, language, on_segment)
+
+    def upload_bytes(self, audio_path):
+        return 0
+
+ENGINES = {
+    engine.name: engine
+    for engine in (
+        OpenAIWhisperEngine(),
+        AssemblyAIEngine(),
+        OpenAIWhisperDiarizedEngine(),
+        LocalWhisperEngine(),
+        LocalWhisperDiarizedEngine(),
+    )
+}
+
+def get_engine(name):
+    return ENGINES[name]
+
+def available_engines():
+    return [engine for engine in ENGINES.values() if engine.is_available()]
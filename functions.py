@@ -1,19 +1,29 @@
 import streamlit as st
 import re
-import tempfile
 import os
-import yt_dlp
-import gdown
-import requests
+import shutil
 import mimetypes
-from openai import OpenAI
+import requests
+from clients import get_openai_client
+from summarization import summarize_text
+from spool import SPOOL_TTL_SECONDS, new_spool_dir
+from downloads import DownloadError, download_url
+
+# yt_dlp and gdown take a long time to import (yt-dlp loads its whole extractor registry),
+# they are imported in the functions that use them so pages load without them
+
+YOUTUBE_REGEX = r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})'
 
 # Function to validate YouTube URL
 def is_valid_youtube_url(url):
-    youtube_regex = r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})'
-    match = re.match(youtube_regex, url)
+    match = re.match(YOUTUBE_REGEX, url)
     return bool(match)
 
+# Function to extract the 11-character video ID from a YouTube URL
+def extract_youtube_video_id(url):
+    match = re.match(YOUTUBE_REGEX, url)
+    return match.group(6) if match else None
+
 # Function to validate and extract Google Drive file ID
 def extract_google_drive_file_id(url):
     patterns = [
@@ -28,36 +38,56 @@ def extract_google_drive_file_id(url):
             return match.group(1)
     return None
 
+GOOGLE_DRIVE_DOWNLOAD_URL = "https://drive.usercontent.google.com/download?id={file_id}&export=download&confirm=t"
+
+# Downloads are cached as spool file paths, expire them well before the spool cleanup removes the files
+DOWNLOAD_CACHE_TTL = SPOOL_TTL_SECONDS // 2
+
+# The download functions take an optional GrowingFile as _progress, for callers that start
+# working on the audio before it is complete. Arguments starting with "_" are not part of
+# the cache key; a cached result simply never reports any progress.
+
 # Function to download file from Google Drive
-@st.cache_data(show_spinner=False)
-def download_file_from_google_drive(url):
+@st.cache_data(show_spinner=False, ttl=DOWNLOAD_CACHE_TTL)
+def download_file_from_google_drive(url, _progress=None):
     try:
         file_id = extract_google_drive_file_id(url)
         if not file_id:
             raise ValueError("Invalid Google Drive URL")
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".tmp") as temp_file:
-            temp_path = temp_file.name
-            gdown.download(id=file_id, output=temp_path, quiet=False)
-
-            if not os.path.exists(temp_path) or os.path.getsize(temp_path) == 0:
-                raise Exception("Download failed or file is empty")
+        # The direct download endpoint supports ranges, so it goes through the download manager.
+        # gdown is the fallback for files behind a confirmation or permission page
+        try:
+            file_path, file_name, _ = download_url(GOOGLE_DRIVE_DOWNLOAD_URL.format(file_id=file_id), _progress)
+            return file_path, file_name
+        except (DownloadError, requests.HTTPError):
+            pass
 
-            with open(temp_path, 'rb') as file:
-                file_content = file.read()
+        # gdown keeps the original file name when the output is a directory
+        download_dir = new_spool_dir()
+        import gdown
+        file_path = gdown.download(id=file_id, output=download_dir + os.sep, quiet=True)
 
-            file_name = os.path.basename(gdown.download(id=file_id, output=None, quiet=True))
+        if not file_path or not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+            raise Exception("Download failed or file is empty")
 
-        return file_content, file_name
+        return file_path, os.path.basename(file_path)
     except Exception as e:
+        if 'download_dir' in locals():
+            shutil.rmtree(download_dir, ignore_errors=True)
         raise Exception(f"Error downloading from Google Drive: {str(e)}")
-    finally:
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            os.unlink(temp_path)
 
-@st.cache_data(show_spinner=False)
-def download_youtube_audio(youtube_url):
+@st.cache_data(show_spinner=False, ttl=DOWNLOAD_CACHE_TTL)
+def download_youtube_audio(youtube_url, _progress=None):
+    # yt-dlp writes the stream in order, to a .part file renamed when it is complete
+    def report(status):
+        if status["status"] == "downloading" and status.get("tmpfilename"):
+            _progress.grow(status["tmpfilename"], status.get("downloaded_bytes") or 0)
+        elif status["status"] == "finished":
+            _progress.grow(status["filename"], os.path.getsize(status["filename"]))
+
     try:
+        download_dir = new_spool_dir()
         ydl_opts = {
             'format': 'bestaudio/best',
             'postprocessors': [{
@@ -65,38 +95,47 @@ def download_youtube_audio(youtube_url):
                 'preferredcodec': 'mp3',
                 'preferredquality': '192',
             }],
-            'outtmpl': '%(title)s.%(ext)s'
+            'outtmpl': os.path.join(download_dir, '%(title)s.%(ext)s')
         }
-        
-        with tempfile.TemporaryDirectory() as temp_dir:
-            ydl_opts['outtmpl'] = os.path.join(temp_dir, '%(title)s.%(ext)s')
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([youtube_url])
-                
-            # Find the downloaded file
-            files = os.listdir(temp_dir)
-            if not files:
-                raise ValueError("Nessun file audio scaricato")
-            
-            file_name = files[0]
-            file_path = os.path.join(temp_dir, file_name)
-            
-            with open(file_path, 'rb') as audio_file:
-                audio_data = audio_file.read()
-        
-        return audio_data, file_name
+        if _progress is not None:
+            ydl_opts['progress_hooks'] = [report]
+
+        import yt_dlp
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            ydl.download([youtube_url])
+
+        # Find the downloaded file
+        files = os.listdir(download_dir)
+        if not files:
+            raise ValueError("Nessun file audio scaricato")
+
+        file_name = files[0]
+        return os.path.join(download_dir, file_name), file_name
     except Exception as e:
+        if 'download_dir' in locals():
+            shutil.rmtree(download_dir, ignore_errors=True)
         raise Exception(f"Errore nel download dell'audio: {str(e)}")
 
-def download_audio_from_url(url):
-    response = requests.get(url)
-    file_name = url.split("/")[-1]
-    return response.content, file_name
+# Function to list the video URLs of a YouTube playlist without downloading them
+def list_youtube_playlist(playlist_url):
+    import yt_dlp
+    with yt_dlp.YoutubeDL({'extract_flat': True, 'quiet': True}) as ydl:
+        info = ydl.extract_info(playlist_url, download=False)
+    return [
+        entry.get('url') or f"https://www.youtube.com/watch?v={entry['id']}"
+        for entry in info.get('entries') or []
+    ]
 
-def summarize_transcript(api_key, transcript, language):
-    client = OpenAI(api_key=api_key)
-    
+@st.cache_data(show_spinner=False, ttl=DOWNLOAD_CACHE_TTL)
+def download_audio_from_url(url, _progress=None):
+    file_path, file_name, _ = download_url(url, _progress)
+    return file_path, file_name
+
+TRANSCRIPT_SYSTEM_PROMPT = "You are a skilled assistant specializing in summarizing transcripts. Your summaries are clear, concise, and capture the essence of the discussion."
+
+# summarize_text() arguments for a transcript summary in language, also used to start
+# summarizing a transcript that is still being produced (pipeline.EarlySummary)
+def transcript_summary_options(language):
     prompt = f"""Summarize the following transcript in {language}. 
     Focus on the main topics discussed, key points made, and any important conclusions or decisions reached.
     If the transcript includes multiple speakers, try to capture the essence of their contributions without necessarily attributing specific points to individuals.
@@ -104,39 +143,44 @@ def summarize_transcript(api_key, transcript, language):
     If there are any standout quotes or particularly important moments, include those.
     
     Transcript:
-    {transcript}
+    {{text}}
     
     Summary:"""
+
+    # Long transcripts are summarized in parts, the partial summaries are then merged.
+    # The parts are summarized in the transcript's own language: they don't depend on the
+    # chosen language, so asking again in another language only redoes the merge.
+    map_prompt = """Summarize the following part of a transcript, in the same language as the transcript.
+    Keep the main topics, key points, conclusions and standout quotes.
     
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "You are a skilled assistant specializing in summarizing transcripts. Your summaries are clear, concise, and capture the essence of the discussion."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=300  # Increased token limit for a more detailed summary
-    )
+    Transcript:
+    {text}
     
-    return response.choices[0].message.content.strip()
+    Summary:"""
+
+    reduce_prompt = f"""The following are summaries of consecutive parts of the same transcript.
+    Combine them into a single summary in {language}, keeping the main topics, key points, conclusions and standout quotes.
+    Aim for a concise yet comprehensive summary that gives a clear overview of the content.
+    
+    Partial summaries:
+    {{text}}
+    
+    Summary:"""
+    
+    return {
+        "model": "gpt-3.5-turbo",
+        "prompt": prompt,
+        "system_prompt": TRANSCRIPT_SYSTEM_PROMPT,
+        "max_tokens": 300,  # Increased token limit for a more detailed summary
+        "reduce_prompt": reduce_prompt,
+        "map_prompt": map_prompt,
+    }
+
+def summarize_transcript(api_key, transcript, language, on_token=None):
+    client = get_openai_client(api_key)
+    return summarize_text(client, transcript, on_token=on_token, **transcript_summary_options(language))
 
 def add_sidebar_content():
     st.sidebar.title("API Dashboards")
     st.sidebar.markdown("[OpenAI Dashboard](https://platform.openai.com/)")
     st.sidebar.markdown("[AssemblyAI Dashboard](https://www.assemblyai.com/dashboard)")
-
-
-
-
-def send_email(resend_api_key, to_email, subject, body):
-    url = "https://api.resend.com/v1/emails"
-    headers = {
-        "Authorization": f"Bearer {resend_api_key}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "to": to_email,
-        "subject": subject,
-        "html": body
-    }
-    response = requests.post(url, headers=headers, json=data)
-    return response.status_code, response.json()
\ No newline at end of file
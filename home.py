@@ -1,22 +1,25 @@
 import streamlit as st
-from openai import OpenAI
-import assemblyai as aai
-import tempfile
-import requests
 import os
-import io
 import mimetypes
 from pages.config import app as config_page, load_api_keys, is_valid_openai_api_key, is_valid_assemblyai_api_key
-from functions import (
-    is_valid_youtube_url,
-    extract_google_drive_file_id,
-    download_file_from_google_drive,
-    download_youtube_audio,
-    download_audio_from_url,
-    summarize_transcript,
-    add_sidebar_content,
-    send_email  
-)
+from functions import add_sidebar_content, is_valid_youtube_url
+from emails import EmailError, compose, email_configured, job_link, send
+from session_store import SessionQuotaError, current_session_id, get_session_store
+from pipeline import LANGUAGES, start_download
+from engines import available_engines, get_engine
+from transcripts import Transcript
+from jobs import get_job_manager, STATUS_DONE, STATUS_FAILED, STAGE_DOWNLOAD, STAGE_PREPROCESS, STAGE_TRANSCRIBE, STAGE_SUMMARIZE
+
+# Larger downloads are not previewed, the audio player would load them fully in memory
+PREVIEW_MAX_BYTES = 50 * 1024 * 1024
+JOB_POLL_SECONDS = 1
+
+STAGE_LABELS = {
+    STAGE_DOWNLOAD: "Sto scaricando l'audio dall'URL...",
+    STAGE_PREPROCESS: "Sto ottimizzando l'audio...",
+    STAGE_TRANSCRIBE: "Sto trascrivendo...",
+    STAGE_SUMMARIZE: "Sto generando il riassunto...",
+}
 
 # Add this at the very beginning of your file
 st.set_page_config(
@@ -63,210 +66,242 @@ input_option = st.radio("Scegli il tipo di input:", ("File audio", "URL (YouTube
 
 audio_source = None
 file_name = None
+upload_handle = None
 
 if input_option == "File audio":
     uploaded_file = st.file_uploader("Carica un file audio", type=["mp3", "wav", "ogg", "mp4", "m4a", "flac"])
     if uploaded_file is not None:
-        audio_source = {"type": "local", "data": uploaded_file.getvalue()}
-        st.audio(uploaded_file)
+        # Copy each upload to the session store once, later reruns reuse the same file.
+        # Session state only keeps the handle
+        session_store = get_session_store()
+        upload_key = f"upload_{uploaded_file.file_id}"
+        if not session_store.exists(st.session_state.get(upload_key)):
+            try:
+                st.session_state[upload_key] = session_store.put_fileobj(
+                    current_session_id(), uploaded_file, suffix=os.path.splitext(uploaded_file.name)[1], size=uploaded_file.size
+                )
+            except SessionQuotaError as e:
+                st.error(str(e))
+                st.stop()
+        upload_handle = st.session_state[upload_key]
+        audio_source = {"type": "local", "path": session_store.path(upload_handle)}
+        # The player keeps its own copy of the audio in memory, skip it for very large files
+        if uploaded_file.size <= PREVIEW_MAX_BYTES:
+            st.audio(uploaded_file)
         file_name = uploaded_file.name
 
 elif input_option == "URL (YouTube o Google Drive)":
     url = st.text_input("Inserisci l'URL del video YouTube o del file audio su Google Drive")
     if url:
-        try:
-            with st.spinner("Sto scaricando l'audio dall'URL..."):
-                if is_valid_youtube_url(url):
-                    audio_data, file_name = download_youtube_audio(url)
-                elif extract_google_drive_file_id(url):
-                    audio_data, file_name = download_file_from_google_drive(url)
-                else:
-                    audio_data, file_name = download_audio_from_url(url)
-                
-                if not audio_data:
-                    raise ValueError("No audio data downloaded")
-
-                audio_source = {"type": "local", "data": audio_data}
-                
-                # Determine the MIME type based on the file extension
-                mime_type, _ = mimetypes.guess_type(file_name)
-                if mime_type is None:
-                    mime_type = 'audio/wav' if file_name.lower().endswith('.wav') else 'audio/mp3'
-                
-                st.audio(io.BytesIO(audio_data), format=mime_type)
-                st.success(f"File scaricato con successo: {file_name}")
-
-                # Debug information
-                st.write(f"File size: {len(audio_data)} bytes")
-                st.write(f"MIME type: {mime_type}")
-        except Exception as e:
-            st.error(f"Si è verificato un errore durante il download o l'elaborazione dell'audio: {str(e)}")
-            st.error("Per favore, controlla l'URL e riprova. Se il problema persiste, potrebbe essere un problema temporaneo con il servizio di hosting del file.")
+        # The download starts right away in the background, while the options are chosen;
+        # the job picks it up where it got to
+        if url.startswith(("http://", "https://")) or is_valid_youtube_url(url):
+            start_download(url)
+        audio_source = {"type": "url", "url": url}
+        file_name = url
+
+# Download buttons get a callable (Streamlit 1.52+), so the file is built from the stored job only when
+# clicked instead of being kept in memory for every open tab
+def job_download(job_id, render):
+    return lambda: render(job_manager.get(job_id)["result"])
+
+# Render the audio preview, transcript and summary of a finished job
+def show_job_result(job):
+    result = job["result"]
+    audio_path = result["audio_path"]
+    if job["params"]["source"]["type"] == "url" and os.path.exists(audio_path):
+        # Determine the MIME type based on the file extension
+        mime_type, _ = mimetypes.guess_type(result["file_name"])
+        if mime_type is None:
+            mime_type = 'audio/wav' if result["file_name"].lower().endswith('.wav') else 'audio/mp3'
+
+        # The player loads the whole file in memory, skip it for very large downloads
+        if os.path.getsize(audio_path) <= PREVIEW_MAX_BYTES:
+            # Search results link here with the timestamp of the hit in "t", in seconds
+            start_time = st.query_params.get("t", "0")
+            st.audio(audio_path, format=mime_type, start_time=int(start_time) if start_time.isdigit() else 0)
+        st.success(f"File scaricato con successo: {result['file_name']}")
+
+    # Local engines upload nothing, there are no savings to show
+    if result.get("preprocessing", {}).get("bytes_in"):
+        stats = result["preprocessing"]
+        st.caption(
+            f"Audio ottimizzato: {stats['bytes_in'] / 1e6:.1f} MB → {stats['bytes_out'] / 1e6:.1f} MB "
+            f"({stats['bytes_saved'] / 1e6:.1f} MB in meno, circa {max(stats['upload_seconds_saved'], 0):.0f} s di upload risparmiati)"
+        )
+
+    if get_engine(job["params"]["engine"]).diarization:
+        st.subheader("Trascrizione con diarizzazione:")
+        # One element for the whole transcript, not one per utterance
+        st.write(result["transcript_text"])
+        transcript_file_name = "trascrizione_con_diarizzazione.txt"
+    else:
+        st.subheader("Trascrizione:")
+        st.write(result["transcript_text"])
+        transcript_file_name = "trascrizione.txt"
+
+    st.download_button(
+        label="Scarica trascrizione",
+        data=job_download(job["id"], lambda result: result["transcript_text"]),
+        file_name=transcript_file_name,
+        mime="text/plain"
+    )
+
+    # Subtitles come from the stored segment and word timings, no new provider call
+    subtitle_name = os.path.splitext(transcript_file_name)[0]
+    srt_column, vtt_column, json_column = st.columns(3)
+    srt_column.download_button(
+        "Sottotitoli SRT", file_name=f"{subtitle_name}.srt", mime="application/x-subrip",
+        data=job_download(job["id"], lambda result: Transcript.from_dict(result["transcript"]).to_srt())
+    )
+    vtt_column.download_button(
+        "Sottotitoli VTT", file_name=f"{subtitle_name}.vtt", mime="text/vtt",
+        data=job_download(job["id"], lambda result: Transcript.from_dict(result["transcript"]).to_vtt())
+    )
+    json_column.download_button(
+        "Trascrizione JSON", file_name=f"{subtitle_name}.json", mime="application/json",
+        data=job_download(job["id"], lambda result: Transcript.from_dict(result["transcript"]).to_json())
+    )
+
+    for warning in result["warnings"]:
+        st.warning(warning)
+
+    if result["summary"]:
+        st.subheader("Riassunto:")
+        st.write(result["summary"])
+
+        st.download_button(
+            label="Scarica riassunto",
+            data=job_download(job["id"], lambda result: result["summary"]),
+            file_name="riassunto.txt",
+            mime="text/plain"
+        )
+
+# Poll the job table without rerunning the whole page, then rerun once the job is over
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_job_progress(job_id):
+    job = job_manager.get(job_id)
+    if job["status"] in (STATUS_DONE, STATUS_FAILED):
+        st.rerun()
+    stage_label = STAGE_LABELS.get(job["stage"], "In coda...")
+    st.progress(job["progress"], text=f"{stage_label} (lavoro {job_id})")
+
+    # Show the transcript and summary as they are produced
+    partial = job_manager.get_partial(job_id)
+    if partial["transcript"]:
+        st.subheader("Trascrizione:")
+        st.write(partial["transcript"])
+    if partial["summary"]:
+        st.subheader("Riassunto:")
+        st.write(partial["summary"])
+
+job_manager = get_job_manager()
 
 if audio_source:
     # Transcription options
+    engines = {engine.label: engine for engine in available_engines()}
     transcription_option = st.selectbox(
         "Seleziona il tipo di trascrizione",
-        ["Senza diarizzazione (OpenAI)", "Con diarizzazione (AssemblyAI)"]
+        list(engines.keys())
     )
     st.markdown("""
     <small>
     <i>Nota: La diarizzazione è il processo di separazione degli speaker in una conversazione. 
     Attivala se l'audio contiene più voci e desideri distinguere chi sta parlando. 
-    Considera che la diarizzazione non è supportata da OpenAI, quindi l'applicazione utilizzerà AssemblyAI, che ha un costo di trascrizione maggiore.
+    La diarizzazione con AssemblyAI ha un costo di trascrizione maggiore; con la diarizzazione locale l'audio viene trascritto da OpenAI e gli speaker vengono separati sui processori del server, senza costi aggiuntivi.
+    La trascrizione locale, se disponibile, gira sui processori del server: non invia l'audio a servizi esterni e non ha costi per minuto.
     </i>
     </small>
     """, unsafe_allow_html=True)
 
     # Language selection (for both OpenAI and AssemblyAI)
-    languages = {
-        "Italiano": "it",
-        "English": "en",
-        "Français": "fr",
-        "Deutsch": "de",
-        "Español": "es"
-    }
+    languages = LANGUAGES
     selected_language = st.selectbox("Seleziona la lingua dell'audio", list(languages.keys()))
 
-    if st.button("Trascrivi"):
-        if not audio_source or not audio_source.get("data"):
-            st.error("Nessun audio caricato o scaricato. Carica un file audio o inserisci un URL valido.")
-        elif transcription_option == "Senza diarizzazione (OpenAI)":
-            if not api_keys["openai"] or not is_valid_openai_api_key(api_keys["openai"]):
-                st.error("Inserisci una API Key valida di OpenAI nella pagina di configurazione.")
-            else:
-                try:
-                    client = OpenAI(api_key=api_keys["openai"])
-
-                    with tempfile.NamedTemporaryFile(delete=False, suffix="." + file_name.split('.')[-1]) as tmp_file:
-                        tmp_file.write(audio_source["data"])
-                        tmp_file_path = tmp_file.name
-
-                    with st.spinner("Sto trascrivendo..."):
-                        with open(tmp_file_path, "rb") as audio_file:
-                            transcript = client.audio.transcriptions.create(
-                                model="whisper-1",
-                                file=audio_file,
-                                language=languages[selected_language]
-                            )
-
-                    st.subheader("Trascrizione:")
-                    st.write(transcript.text)
-
-                    st.download_button(
-                        label="Scarica trascrizione",
-                        data=transcript.text,
-                        file_name="trascrizione.txt",
-                        mime="text/plain"
-                    )
-
-                    # Summarize the transcript
-                    with st.spinner("Sto generando il riassunto..."):
-                        summary = summarize_transcript(api_keys["openai"], transcript.text, selected_language)
-                    
-                    st.subheader("Riassunto:")
-                    st.write(summary)
-
-                    st.download_button(
-                        label="Scarica riassunto",
-                        data=summary,
-                        file_name="riassunto.txt",
-                        mime="text/plain"
-                    )
-
-                    os.unlink(tmp_file_path)
-                except Exception as e:
-                    st.error(f"Si è verificato un errore: {str(e)}")
-        else:  # With diarization (AssemblyAI)
-            if not api_keys["assemblyai"] or not is_valid_assemblyai_api_key(api_keys["assemblyai"]):
-                st.error("Inserisci una API Key valida di AssemblyAI nella pagina di configurazione.")
-            else:
-                try:
-                    aai.settings.api_key = api_keys["assemblyai"]
-                    transcriber = aai.Transcriber()
-
-                    with tempfile.NamedTemporaryFile(delete=False, suffix="." + file_name.split('.')[-1]) as tmp_file:
-                        tmp_file.write(audio_source["data"])
-                        tmp_file_path = tmp_file.name
-
-                    with st.spinner("Sto trascrivendo con diarizzazione..."):
-                        transcript = transcriber.transcribe(
-                            tmp_file_path,
-                            config=aai.TranscriptionConfig(
-                                speaker_labels=True,
-                                language_code=languages[selected_language]
-                            )
-                        )
-
-                    if not transcript or not transcript.utterances:
-                        raise ValueError("La trascrizione non contiene utterances")
-
-                    st.subheader("Trascrizione con diarizzazione:")
-                    full_transcript = ""
-                    for utterance in transcript.utterances:
-                        st.write(f"Speaker {utterance.speaker}: {utterance.text}\n")
-                        full_transcript += f"Speaker {utterance.speaker}: {utterance.text}\n\n"  # Add a blank line between speakers
-
-                    st.download_button(
-                        label="Scarica trascrizione",
-                        data=full_transcript,
-                        file_name="trascrizione_con_diarizzazione.txt",
-                        mime="text/plain"
-                    )
+    preprocess_audio = st.checkbox(
+        "Ottimizza l'audio prima dell'invio",
+        value=True,
+        help="Converte l'audio in mono a 16 kHz, accorcia le pause lunghe e lo comprime prima di inviarlo. Riduce molto i tempi di upload, soprattutto per i file WAV."
+    )
 
-                    # Summarize the transcript
-                    with st.spinner("Sto generando il riassunto..."):
-                        try:
-                            # Check if the API key has access to LeMUR
-                            lemur_summary = None
-                            response = requests.get(
-                                "https://api.assemblyai.com/v2/account",
-                                headers={"authorization": api_keys["assemblyai"]}
-                            )
-                            if response.status_code == 200 and response.json().get("lemur_enabled", False):
-                                # Use LeMUR for summarization
-                                summary = transcriber.lemur.summarize(
-                                    transcript.id,
-                                    context="",
-                                    answer_format="**<topic header>**\n<topic summary>"
-                                )
-                                lemur_summary = summary.response
-                            else:
-                                # Fallback to OpenAI summarization
-                                lemur_summary = summarize_transcript(api_keys["openai"], full_transcript, selected_language)
-                        except Exception as e:
-                            st.error(f"Errore durante la generazione del riassunto con LeMUR: {str(e)}")
-                            st.error("Utilizzo il fallback con OpenAI per generare il riassunto.")
-                            lemur_summary = summarize_transcript(api_keys["openai"], full_transcript, selected_language)
-                    
-                    st.subheader("Riassunto:")
-                    st.write(lemur_summary)
-
-                    st.download_button(
-                        label="Scarica riassunto",
-                        data=lemur_summary,
-                        file_name="riassunto.txt",
-                        mime="text/plain"
-                    )
+    pipelined = st.checkbox(
+        "Elabora in parallelo",
+        value=True,
+        help="Con OpenAI la trascrizione parte mentre l'audio si sta ancora scaricando, e le parti già trascritte vengono riassunte mentre si trascrive il resto. Mentre si scarica l'audio viene solo convertito in mono a 16 kHz, senza accorciare le pause."
+    )
 
-                    os.unlink(tmp_file_path)
-                except Exception as e:
-                    st.error(f"Si è verificato un errore durante la trascrizione: {str(e)}")
-                    st.error("Stacktrace:", exc_info=True)
+    if st.button("Trascrivi"):
+        engine = engines[transcription_option]
+        if engine.api_key_name == "openai" and not is_valid_openai_api_key(api_keys["openai"]):
+            engine = None
+            st.error("Inserisci una API Key valida di OpenAI nella pagina di configurazione.")
+        elif engine.api_key_name == "assemblyai" and not is_valid_assemblyai_api_key(api_keys["assemblyai"]):
+            engine = None
+            st.error("Inserisci una API Key valida di AssemblyAI nella pagina di configurazione.")
+
+        if engine:
+            if upload_handle:
+                # The session's blob can be evicted while the job is queued, the job reads its own link
+                audio_source = {"type": "local", "path": get_session_store().to_spool(upload_handle)}
+            job_id = job_manager.submit(
+                {
+                    "source": audio_source,
+                    "file_name": file_name,
+                    "engine": engine.name,
+                    "language": languages[selected_language],
+                    "language_name": selected_language,
+                    "preprocess": preprocess_audio,
+                    "pipelined": pipelined
+                },
+                api_keys
+            )
+            st.session_state["job_id"] = job_id
+            st.query_params["job"] = job_id
+
+# Come back to a previous job by its ID
+with st.expander("Recupera un lavoro"):
+    lookup_job_id = st.text_input("ID del lavoro", value=st.query_params.get("job", ""))
+    if st.button("Apri lavoro") and lookup_job_id:
+        st.session_state["job_id"] = lookup_job_id.strip()
+        st.query_params["job"] = lookup_job_id.strip()
+
+if "job_id" not in st.session_state and "job" in st.query_params:
+    st.session_state["job_id"] = st.query_params["job"]
+
+job = job_manager.get(st.session_state["job_id"]) if "job_id" in st.session_state else None
+if "job_id" in st.session_state and job is None:
+    st.error(f"Nessun lavoro trovato con ID {st.session_state['job_id']}.")
+elif job and job["status"] == STATUS_FAILED:
+    st.error(f"Si è verificato un errore durante l'elaborazione: {job['error']}")
+elif job and job["status"] != STATUS_DONE:
+    show_job_progress(job["id"])
+elif job:
+    show_job_result(job)
 
     # Email input and send button
-    st.subheader("Invia Trascrizione e Riassunto via Email")
-    email = st.text_input("Inserisci il tuo indirizzo email")
-    if st.button("Invia Email"):
-        if not email:
-            st.error("Per favore, inserisci un indirizzo email valido.")
-        else:
-            email_body = f"<h2>Trascrizione</h2><p>{full_transcript}</p><h2>Riassunto</h2><p>{lemur_summary}</p>"
-            status_code, response = send_email(api_keys["resend_api_key"], email, f"Trascrizione e Riassunto - {file_name}", email_body)
-            if status_code == 200:
-                st.success("Email inviata con successo!")
+    if email_configured():
+        st.subheader("Invia Trascrizione e Riassunto via Email")
+        email = st.text_input("Inserisci il tuo indirizzo email")
+        if st.button("Invia Email"):
+            if not email:
+                st.error("Per favore, inserisci un indirizzo email valido.")
             else:
-                st.error(f"Errore durante l'invio dell'email: {response}")
+                result = job["result"]
+                try:
+                    message = compose(
+                        email,
+                        f"Trascrizione e Riassunto - {result['file_name']}",
+                        [
+                            ("Trascrizione", result["transcript_text"], "trascrizione.txt"),
+                            ("Riassunto", result["summary"], "riassunto.txt"),
+                        ],
+                        link=job_link(job["id"]),
+                    )
+                    with st.spinner("Invio email in corso..."):
+                        send(message)
+                    st.success("Email inviata con successo!")
+                except EmailError as e:
+                    st.error(f"Errore durante l'invio dell'email: {e}")
 
 # Add footer
 st.markdown("---")
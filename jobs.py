@@ -0,0 +1,229 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from disk_cache import CACHE_DIR
+from preprocessing import normalize_audio, restore_timeline
+from credentials import handle_auth_error
+from metrics import span
+from ratelimit import RATE_LIMIT_MESSAGE, is_rate_limit_error
+from engines import get_engine
+from transcripts import Transcript
+from archive import archive_safely
+import pipeline
+
+# Jobs run download -> transcribe -> summarize on a process-wide worker pool, so the work
+# survives Streamlit reruns and any session can come back to a result by its job ID.
+
+JOBS_DB_PATH = os.environ.get("SBOBINATOR_JOBS_DB", os.path.join(CACHE_DIR, "jobs.sqlite3"))
+JOB_WORKERS = int(os.environ.get("SBOBINATOR_JOB_WORKERS", "4"))
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+STAGE_DOWNLOAD = "download"
+STAGE_PREPROCESS = "preprocess"
+STAGE_TRANSCRIBE = "transcribe"
+STAGE_SUMMARIZE = "summarize"
+
+# Fraction of the progress bar reached when each stage starts
+STAGE_PROGRESS = {
+    STAGE_DOWNLOAD: 0.0,
+    STAGE_PREPROCESS: 0.1,
+    STAGE_TRANSCRIBE: 0.2,
+    STAGE_SUMMARIZE: 0.8,
+}
+
+class JobManager:
+    def __init__(self, db_path=JOBS_DB_PATH, max_workers=JOB_WORKERS):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sbobinator-job")
+        # Output of running jobs, streamed to the page while the job is still going.
+        # It only lives in memory; the final result is what gets persisted.
+        self._partials = {}
+        self._partials_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    progress REAL NOT NULL DEFAULT 0,
+                    params TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT
+                )
+            """)
+            # API keys only live in memory, so jobs cut short by a restart can't be resumed
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ? WHERE status IN (?, ?)",
+                (STATUS_FAILED, "Lavoro interrotto dal riavvio del server", STATUS_QUEUED, STATUS_RUNNING)
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    # params are persisted and shown back to the user, api_keys are kept out of the database
+    def submit(self, params, api_keys):
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, created_at, updated_at, status, params) VALUES (?, ?, ?, ?, ?)",
+                (job_id, now, now, STATUS_QUEUED, json.dumps(params))
+            )
+        self.executor.submit(self._run, job_id, params, dict(api_keys))
+        return job_id
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, created_at, updated_at, status, stage, progress, params, result, error FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "created_at": row[1],
+            "updated_at": row[2],
+            "status": row[3],
+            "stage": row[4],
+            "progress": row[5],
+            "params": json.loads(row[6]),
+            "result": json.loads(row[7]) if row[7] else None,
+            "error": row[8],
+        }
+
+    # Transcript pieces and summary tokens produced so far by a running job
+    def get_partial(self, job_id):
+        with self._partials_lock:
+            partial = self._partials.get(job_id)
+            if partial is None:
+                return {"transcript": "", "summary": ""}
+            return {"transcript": "\n\n".join(partial["transcript"]), "summary": "".join(partial["summary"])}
+
+    def _append_partial(self, job_id, field, text):
+        with self._partials_lock:
+            self._partials[job_id][field].append(text)
+
+    def _set_stage(self, job_id, stage):
+        self._update(job_id, status=STATUS_RUNNING, stage=stage, progress=STAGE_PROGRESS[stage])
+
+    def _run(self, job_id, params, api_keys):
+        with self._partials_lock:
+            self._partials[job_id] = {"transcript": [], "summary": []}
+        on_segment = lambda text, segments: self._append_partial(job_id, "transcript", text)
+        on_token = lambda token: self._append_partial(job_id, "summary", token)
+        try:
+            with span("job", provider=params["engine"]):
+                result = self._execute(job_id, params, api_keys, on_segment, on_token)
+            self._update(job_id, status=STATUS_DONE, progress=1.0, result=json.dumps(result, ensure_ascii=False))
+            # Indexed as soon as it is done, so the search page finds it right away
+            archive_safely(
+                "add_transcript",
+                Transcript.from_dict(result["transcript"]),
+                summary=result["summary"],
+                title=result["file_name"],
+                source_url=params["source"].get("url"),
+                job_id=job_id
+            )
+        except Exception as e:
+            handle_auth_error(e, api_keys)
+            error = RATE_LIMIT_MESSAGE if is_rate_limit_error(e) else str(e)
+            self._update(job_id, status=STATUS_FAILED, error=error)
+        finally:
+            with self._partials_lock:
+                self._partials.pop(job_id, None)
+
+    # Pipelined jobs overlap their stages: the download is shared with the prefetch started by
+    # the page, Whisper gets the audio while it downloads, and the parts of the transcript
+    # that are final are summarized while the rest is still being transcribed.
+    def _execute(self, job_id, params, api_keys, on_segment, on_token):
+        result = {"warnings": []}
+        source = params["source"]
+        audio_path = source.get("path")
+        file_name = params.get("file_name")
+        transcript = None
+
+        early_summary = None
+        if params.get("pipelined"):
+            early_summary = pipeline.start_early_summary(api_keys, params["engine"], params["language_name"])
+        if early_summary:
+            report_segment = on_segment
+
+            def on_segment(text, segments):
+                report_segment(text, segments)
+                early_summary.add(segments)
+
+        try:
+            if source["type"] == "url":
+                self._set_stage(job_id, STAGE_DOWNLOAD)
+                if params.get("pipelined"):
+                    download = pipeline.start_download(source["url"])
+                    if not download.done() and pipeline.can_stream(params["engine"]):
+                        self._set_stage(job_id, STAGE_TRANSCRIBE)
+                        transcript = pipeline.transcribe_openai_stream(api_keys["openai"], download, params["language"], on_segment)
+                    audio_path, file_name = download.result()
+                else:
+                    audio_path, file_name = pipeline.download_source(source["url"])
+            result["audio_path"] = audio_path
+            result["file_name"] = file_name
+
+            if transcript is None:
+                if params.get("preprocess"):
+                    self._set_stage(job_id, STAGE_PREPROCESS)
+                    audio_path, result["preprocessing"] = normalize_audio(audio_path, upload_bytes=get_engine(params["engine"]).upload_bytes)
+
+                self._set_stage(job_id, STAGE_TRANSCRIBE)
+                transcript = get_engine(params["engine"]).transcribe(api_keys, audio_path, params["language"], on_segment)
+                if result.get("preprocessing"):
+                    transcript = restore_timeline(transcript, result["preprocessing"]["timeline"])
+            # Compact columnar form, rebuilt with Transcript.from_dict() for subtitle exports
+            result["transcript"] = transcript.to_columns()
+            result["transcript_text"] = pipeline.transcript_text(transcript)
+
+            self._set_stage(job_id, STAGE_SUMMARIZE)
+            if early_summary:
+                early_summary.wait()
+            summary, warning = pipeline.summarize(api_keys, params["engine"], transcript, params["language_name"], on_token)
+            if warning:
+                result["warnings"].append(warning)
+            result["summary"] = summary
+            return result
+        finally:
+            if early_summary:
+                early_summary.close()
+
+_manager = None
+_manager_lock = threading.Lock()
+
+# One manager per process, shared by every Streamlit session
+def get_job_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
@@ -0,0 +1,65 @@
+import importlib.util
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Offline transcription with faster-whisper (CTranslate2, int8 on CPU). Files are spread over
+# a pool of worker processes; each worker loads the model once and keeps it warm.
+# This module must stay free of Streamlit imports, it is imported again in every worker.
+
+LOCAL_WHISPER_MODEL = os.environ.get("SBOBINATOR_LOCAL_WHISPER_MODEL", "small")
+LOCAL_WHISPER_COMPUTE_TYPE = os.environ.get("SBOBINATOR_LOCAL_WHISPER_COMPUTE_TYPE", "int8")
+LOCAL_WHISPER_PROCESSES = int(os.environ.get("SBOBINATOR_LOCAL_WHISPER_PROCESSES", str(max(1, (os.cpu_count() or 1) // 4))))
+# Threads per worker, by default the cores are split evenly between the workers
+LOCAL_WHISPER_THREADS = int(os.environ.get("SBOBINATOR_LOCAL_WHISPER_THREADS", str(max(1, (os.cpu_count() or 1) // LOCAL_WHISPER_PROCESSES))))
+BEAM_SIZE = 5
+
+_worker_model = None
+
+def is_available():
+    return importlib.util.find_spec("faster_whisper") is not None
+
+def _init_worker(model_name, compute_type, cpu_threads):
+    global _worker_model
+    from faster_whisper import WhisperModel
+    _worker_model = WhisperModel(model_name, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads)
+
+def _transcribe_in_worker(audio_path, language):
+    segments, _ = _worker_model.transcribe(
+        audio_path, language=language, beam_size=BEAM_SIZE, vad_filter=True, word_timestamps=True
+    )
+    # segments is a generator, decoding happens while we iterate
+    result = []
+    words = []
+    for s in segments:
+        result.append({"start": s.start, "end": s.end, "text": s.text.strip(), "confidence": math.exp(s.avg_logprob)})
+        words.extend(
+            {"start": w.start, "end": w.end, "text": w.word.strip(), "confidence": w.probability}
+            for w in (s.words or [])
+        )
+    return {
+        "text": " ".join(s["text"] for s in result if s["text"]),
+        "segments": result,
+        "words": words
+    }
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the parent is a multi-threaded Streamlit server
+            _pool = ProcessPoolExecutor(
+                max_workers=LOCAL_WHISPER_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(LOCAL_WHISPER_MODEL, LOCAL_WHISPER_COMPUTE_TYPE, LOCAL_WHISPER_THREADS)
+            )
+        return _pool
+
+def transcribe_local(audio_path, language):
+    return _get_pool().submit(_transcribe_in_worker, audio_path, language).result()
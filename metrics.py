@@ -0,0 +1,236 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from disk_cache import CACHE_DIR
+
+# Timing spans for the hot paths (download, spooling, preprocessing, provider requests,
+# summarization). Every finished span is logged as a JSON line on the "sbobinator.metrics"
+# logger, aggregated in memory for a Prometheus-style /metrics endpoint, and stored in
+# SQLite so the dashboard page can show percentiles across processes (app and CLI).
+
+METRICS_DB_PATH = os.environ.get("SBOBINATOR_METRICS_DB", os.path.join(CACHE_DIR, "metrics.sqlite3"))
+# Set to serve the Prometheus text format on http://0.0.0.0:<port>/metrics
+METRICS_PORT = os.environ.get("SBOBINATOR_METRICS_PORT")
+# Spans older than this are dropped from the database
+METRICS_RETENTION_SECONDS = 7 * 24 * 3600
+# Histogram buckets for span durations, in seconds
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+WRITE_BATCH_SIZE = 200
+
+# Numeric fields a span may carry besides its duration
+COUNTERS = ("bytes_in", "bytes_out", "tokens_in", "tokens_out")
+
+logger = logging.getLogger("sbobinator.metrics")
+
+@contextmanager
+def _connect(db_path=METRICS_DB_PATH):
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def _init_db():
+    os.makedirs(os.path.dirname(METRICS_DB_PATH), exist_ok=True)
+    with _connect() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS spans (
+                started_at REAL NOT NULL,
+                stage TEXT NOT NULL,
+                duration REAL NOT NULL,
+                status TEXT NOT NULL,
+                provider TEXT,
+                model TEXT,
+                bytes_in INTEGER,
+                bytes_out INTEGER,
+                tokens_in INTEGER,
+                tokens_out INTEGER,
+                attrs TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS spans_started_at ON spans (started_at)")
+        conn.execute("DELETE FROM spans WHERE started_at < ?", (time.time() - METRICS_RETENTION_SECONDS,))
+
+# In-memory aggregates behind render_prometheus(), keyed by (stage, provider, model, status)
+_aggregates = {}
+_aggregates_lock = threading.Lock()
+
+def _aggregate(record):
+    key = (record["stage"], record["provider"] or "", record["model"] or "", record["status"])
+    with _aggregates_lock:
+        entry = _aggregates.get(key)
+        if entry is None:
+            entry = _aggregates[key] = {"count": 0, "sum": 0.0, "buckets": [0] * len(DURATION_BUCKETS)}
+            entry.update({name: 0 for name in COUNTERS})
+        entry["count"] += 1
+        entry["sum"] += record["duration"]
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if record["duration"] <= bound:
+                entry["buckets"][index] += 1
+        for name in COUNTERS:
+            entry[name] += record[name] or 0
+
+# Spans are written by a background thread so the hot path never waits on SQLite
+_queue = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+
+def _write(records):
+    with _connect() as conn:
+        conn.executemany(
+            "INSERT INTO spans (started_at, stage, duration, status, provider, model, bytes_in, bytes_out, tokens_in, tokens_out, attrs)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (r["started_at"], r["stage"], r["duration"], r["status"], r["provider"], r["model"],
+                 r["bytes_in"], r["bytes_out"], r["tokens_in"], r["tokens_out"], json.dumps(r["attrs"], ensure_ascii=False))
+                for r in records
+            ]
+        )
+
+def _drain(block):
+    records = []
+    try:
+        records.append(_queue.get(block=block))
+        while len(records) < WRITE_BATCH_SIZE:
+            records.append(_queue.get_nowait())
+    except queue.Empty:
+        pass
+    if records:
+        try:
+            _write(records)
+        except sqlite3.Error:
+            logger.exception("Could not store %d metric spans", len(records))
+    return records
+
+def _writer_loop():
+    while True:
+        _drain(block=True)
+
+# Flush what's left when a short-lived process (the batch CLI) exits
+def flush():
+    while _drain(block=False):
+        pass
+
+def _ensure_started():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _init_db()
+            _writer = threading.Thread(target=_writer_loop, name="sbobinator-metrics", daemon=True)
+            _writer.start()
+            atexit.register(flush)
+            if METRICS_PORT:
+                start_metrics_server(int(METRICS_PORT))
+
+def record(stage, duration, status="ok", provider=None, model=None, started_at=None, **attrs):
+    _ensure_started()
+    entry = {
+        "started_at": started_at if started_at is not None else time.time() - duration,
+        "stage": stage,
+        "duration": duration,
+        "status": status,
+        "provider": provider,
+        "model": model,
+    }
+    for name in COUNTERS:
+        entry[name] = attrs.pop(name, None)
+    entry["attrs"] = attrs
+    _aggregate(entry)
+    _queue.put(entry)
+    logger.info(json.dumps({"event": "span", **entry}, ensure_ascii=False))
+
+# Time a block of code. The yielded dict can be filled in while the block runs, e.g. with
+# bytes_out or tokens_in once they are known; exceptions mark the span as failed.
+@contextmanager
+def span(stage, provider=None, model=None, **attrs):
+    started_at = time.time()
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield attrs
+    except BaseException as e:
+        status = "error"
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        fields = dict(attrs)
+        provider = fields.pop("provider", provider)
+        model = fields.pop("model", model)
+        record(stage, time.perf_counter() - start, status, provider, model, started_at, **fields)
+
+def _labels(stage, provider, model, status, **extra):
+    labels = {"stage": stage, "provider": provider, "model": model, "status": status, **extra}
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+# Aggregates since process start in the Prometheus text exposition format
+def render_prometheus():
+    with _aggregates_lock:
+        aggregates = {key: dict(entry, buckets=list(entry["buckets"])) for key, entry in _aggregates.items()}
+    lines = [
+        "# HELP sbobinator_stage_duration_seconds Duration of instrumented stages",
+        "# TYPE sbobinator_stage_duration_seconds histogram",
+    ]
+    for key, entry in sorted(aggregates.items()):
+        for bound, count in zip(DURATION_BUCKETS, entry["buckets"]):
+            lines.append(f"sbobinator_stage_duration_seconds_bucket{_labels(*key, le=bound)} {count}")
+        lines.append(f"sbobinator_stage_duration_seconds_bucket{_labels(*key, le='+Inf')} {entry['count']}")
+        lines.append(f"sbobinator_stage_duration_seconds_sum{_labels(*key)} {entry['sum']}")
+        lines.append(f"sbobinator_stage_duration_seconds_count{_labels(*key)} {entry['count']}")
+    for name in COUNTERS:
+        lines.append(f"# TYPE sbobinator_stage_{name}_total counter")
+        for key, entry in sorted(aggregates.items()):
+            if entry[name]:
+                lines.append(f"sbobinator_stage_{name}_total{_labels(*key)} {entry[name]}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_server = None
+
+def start_metrics_server(port, host="0.0.0.0"):
+    global _server
+    if _server is None:
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError:
+            # Another Streamlit process on this host already serves the endpoint
+            logger.warning("Metrics port %s already in use", port)
+            return
+        threading.Thread(target=_server.serve_forever, name="sbobinator-metrics-http", daemon=True).start()
+
+# Spans recorded since the given timestamp, oldest first, as dicts for the dashboard
+def load_spans(since):
+    if not os.path.exists(METRICS_DB_PATH):
+        return []
+    flush()
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT started_at, stage, duration, status, provider, model, bytes_in, bytes_out, tokens_in, tokens_out"
+            " FROM spans WHERE started_at >= ? ORDER BY started_at",
+            (since,)
+        ).fetchall()
+    columns = ("started_at", "stage", "duration", "status", "provider", "model") + COUNTERS
+    return [dict(zip(columns, row)) for row in rows]
@@ -1,33 +1,16 @@
 import streamlit as st
 import json
 import os
-from openai import OpenAI
-import requests
+from credentials import get_openai_capabilities, get_assemblyai_capabilities
 from functions import add_sidebar_content
 
-# Function to validate OpenAI API key
-@st.cache_data(show_spinner=False)
+# Function to validate OpenAI API key (checked once per key and cached for every session)
 def is_valid_openai_api_key(api_key):
-    if not api_key:
-        return False
-    try:
-        client = OpenAI(api_key=api_key)
-        client.models.list()
-        return True
-    except Exception:
-        return False
+    return get_openai_capabilities(api_key)["valid"]
 
-# Function to validate AssemblyAI API key
-@st.cache_data(show_spinner=False)
+# Function to validate AssemblyAI API key (checked once per key and cached for every session)
 def is_valid_assemblyai_api_key(api_key):
-    if not api_key:
-        return False
-    try:
-        headers = {"authorization": api_key}
-        response = requests.get("https://api.assemblyai.com/v2/account", headers=headers)
-        return response.status_code == 200
-    except Exception:
-        return False
+    return get_assemblyai_capabilities(api_key)["valid"]
 
 def load_api_keys():
     if "api_keys" in st.session_state:
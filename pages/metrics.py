@@ -0,0 +1,79 @@
+import streamlit as st
+import time
+import pandas as pd
+from functions import add_sidebar_content
+from metrics import load_spans
+
+st.set_page_config(
+    page_title="Prestazioni",
+    page_icon="📊",
+    layout="wide",
+    initial_sidebar_state="auto",
+)
+
+# Time windows offered in the page, in seconds
+WINDOWS = {
+    "Ultima ora": 3600,
+    "Ultime 24 ore": 24 * 3600,
+    "Ultimi 7 giorni": 7 * 24 * 3600,
+}
+# Width of the throughput buckets for each window
+THROUGHPUT_BUCKETS = {
+    3600: "5min",
+    24 * 3600: "1h",
+    7 * 24 * 3600: "6h",
+}
+
+st.title("Prestazioni")
+
+# Add sidebar content
+add_sidebar_content()
+
+window_label = st.selectbox("Periodo", list(WINDOWS))
+window = WINDOWS[window_label]
+spans = load_spans(time.time() - window)
+
+if not spans:
+    st.info("Nessuna misurazione registrata in questo periodo.")
+    st.stop()
+
+df = pd.DataFrame(spans)
+df["started_at"] = pd.to_datetime(df["started_at"], unit="s")
+
+# Percentiles per stage; provider and model are kept apart since they time very differently
+st.subheader("Durata per fase")
+grouped = df.groupby(["stage", df["provider"].fillna("-"), df["model"].fillna("-")])
+stats = grouped["duration"].agg(
+    chiamate="count",
+    p50=lambda d: d.quantile(0.5),
+    p95=lambda d: d.quantile(0.95),
+    totale="sum",
+)
+stats["errori"] = grouped["status"].apply(lambda s: int((s == "error").sum()))
+for column in ("bytes_in", "bytes_out", "tokens_in", "tokens_out"):
+    stats[column] = grouped[column].sum(min_count=1)
+stats = stats.reset_index().rename(columns={"stage": "fase", "model": "modello"})
+st.dataframe(
+    stats.sort_values("totale", ascending=False),
+    hide_index=True,
+    column_config={
+        "p50": st.column_config.NumberColumn("p50 (s)", format="%.2f"),
+        "p95": st.column_config.NumberColumn("p95 (s)", format="%.2f"),
+        "totale": st.column_config.NumberColumn("Totale (s)", format="%.1f"),
+    }
+)
+
+stages = sorted(df["stage"].unique())
+selected = st.multiselect("Fasi nei grafici", stages, default=[s for s in ("job", "download", "transcribe", "summarize") if s in stages] or stages)
+df = df[df["stage"].isin(selected)]
+bucket = THROUGHPUT_BUCKETS[window]
+
+st.subheader("Throughput nel tempo")
+throughput = df.set_index("started_at").groupby("stage").resample(bucket).size().unstack(level=0).fillna(0)
+st.line_chart(throughput)
+
+st.subheader("p95 nel tempo (s)")
+p95 = df.set_index("started_at").groupby("stage")["duration"].resample(bucket).quantile(0.95).unstack(level=0)
+st.line_chart(p95)
+
+st.caption("Le metriche sono disponibili anche in formato Prometheus impostando SBOBINATOR_METRICS_PORT.")
@@ -0,0 +1,79 @@
+import streamlit as st
+import time
+from functions import add_sidebar_content, extract_youtube_video_id
+from archive import get_archive, FIELD_SUMMARY, FIELD_TRANSCRIPT, KIND_TEXT
+
+st.set_page_config(
+    page_title="Cerca",
+    page_icon="🔎",
+    layout="centered",
+    initial_sidebar_state="auto",
+)
+
+st.title("Cerca nell'archivio")
+
+# Add sidebar content
+add_sidebar_content()
+
+FIELDS = {
+    "Trascrizioni e riassunti": None,
+    "Solo trascrizioni": FIELD_TRANSCRIPT,
+    "Solo riassunti": FIELD_SUMMARY,
+}
+
+def format_timestamp(seconds):
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+# Where a hit can be opened: the original video at that second, or the job in the home page
+def hit_links(hit):
+    links = []
+    # Summary paragraphs have no timestamp, their links open the start
+    seconds = int(hit["start"] or 0)
+    video_id = extract_youtube_video_id(hit["source_url"] or "")
+    if video_id:
+        links.append(f"[YouTube](https://www.youtube.com/watch?v={video_id}&t={seconds}s)")
+    if hit["job_id"]:
+        links.append(f"[Apri lavoro](/?job={hit['job_id']}&t={seconds})")
+    return links
+
+archive = get_archive()
+stats = archive.stats()
+st.caption(f"{stats['documents']} documenti archiviati, {stats['duration'] / 3600:.1f} ore di audio")
+
+query = st.text_input("Cerca", placeholder='Parole chiave, oppure una frase esatta tra virgolette: "teorema di Pitagora"')
+field = FIELDS[st.radio("Cerca in", list(FIELDS), horizontal=True)]
+
+if query:
+    started = time.perf_counter()
+    hits = archive.search(query, field=field)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    if not hits:
+        st.info("Nessun risultato.")
+    else:
+        st.caption(f"{len(hits)} risultati in {elapsed_ms:.0f} ms")
+
+    for hit in hits:
+        with st.container(border=True):
+            header = [f"**{hit['title'] or 'Documento senza titolo'}**"]
+            if hit["field"] == FIELD_SUMMARY:
+                header.append("riassunto")
+            elif hit["kind"] != KIND_TEXT and hit["start"] is not None:
+                header.append(format_timestamp(hit["start"]))
+            if hit["speaker"]:
+                header.append(f"Speaker {hit['speaker']}")
+            header.extend(hit_links(hit))
+            st.markdown(" · ".join(header))
+            st.markdown(hit["snippet"])
+
+            with st.expander("Contesto"):
+                for passage in archive.context(hit["document_id"], hit["field"], hit["position"]):
+                    prefix = ""
+                    if passage["start"] is not None:
+                        prefix += f"`{format_timestamp(passage['start'])}` "
+                    if passage["speaker"]:
+                        prefix += f"Speaker {passage['speaker']}: "
+                    st.markdown(prefix + passage["text"])
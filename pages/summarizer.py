@@ -1,8 +1,7 @@
 import streamlit as st
-from openai import OpenAI
 import os
-import textwrap
-from functions import send_email, add_sidebar_content  # Import the send_email and add_sidebar_content functions
+from functions import add_sidebar_content
+from emails import EmailError, compose, email_configured, send
 
 st.set_page_config(
     page_title="Summarizer",
@@ -11,6 +10,12 @@ st.set_page_config(
     initial_sidebar_state="auto",
 )
 
+from summarization import summarize_text, MAX_WORKERS
+from clients import get_openai_client
+from credentials import get_openai_capabilities, handle_auth_error
+from archive import archive_safely
+from session_store import SessionQuotaError, current_session_id, get_session_store
+
 # Load API keys
 from pages.config import load_api_keys, is_valid_openai_api_key, is_valid_assemblyai_api_key
 
@@ -20,46 +25,65 @@ assemblyai_key_valid = is_valid_assemblyai_api_key(api_keys["assemblyai"])
 
 client = None
 if openai_key_valid:
-    client = OpenAI(api_key=api_keys["openai"])
+    client = get_openai_client(api_keys["openai"])
 
 st.title("Summarizer")
 
 # Add sidebar content
 add_sidebar_content()
 
-# Add OpenAI model selection to sidebar
+# Add OpenAI model selection to sidebar, limited to the models this key can use
+openai_models = ["gpt-3.5-turbo", "gpt-4", "gpt-4-turbo-preview"]
+allowed_models = get_openai_capabilities(api_keys["openai"])["models"]
+if allowed_models:
+    openai_models = [model for model in openai_models if model in allowed_models] or openai_models
 openai_model = st.sidebar.selectbox(
     "Modello OpenAI",
-    ["gpt-3.5-turbo", "gpt-4", "gpt-4-turbo-preview"],
+    openai_models,
+    format_func=lambda x: x.upper()
+)
+
+# Long texts are summarized in parts with this model and merged with the one above.
+# It doesn't follow the final model, so changing that only redoes the final merge: the
+# parts come from the cache. The default is the first (cheapest) model.
+map_model = st.sidebar.selectbox(
+    "Modello per le parti",
+    openai_models,
     format_func=lambda x: x.upper()
 )
 
+max_workers = st.sidebar.slider("Richieste parallele", min_value=1, max_value=8, value=MAX_WORKERS)
+
 if not openai_key_valid:
     st.warning("Le API keys non sono valide o mancanti. Per favore, inseriscile nella pagina di configurazione.")
 
 uploaded_file = st.file_uploader("Carica un file di testo", type=["txt"])
 
-def chunk_text(text, chunk_size=6000):
-    return textwrap.wrap(text, chunk_size, break_long_words=False)
-
-def summarize_chunk(client, chunk, model):
-    prompt = f"Riassumi il seguente testo:\n\n{chunk}\n\nRiassunto:"
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are a skilled assistant specializing in summarizing text. Your summaries are clear, concise, and capture the essence of the content."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=1000
-    )
-    return response.choices[0].message.content.strip()
+# Only the beginning of long files is shown, the text itself stays in the session store
+PREVIEW_BYTES = 20000
+
+SUMMARY_PROMPT = "Riassumi il seguente testo:\n\n{text}\n\nRiassunto:"
+REDUCE_PROMPT = "I seguenti sono riassunti di parti consecutive dello stesso testo. Uniscili in un unico riassunto:\n\n{text}\n\nRiassunto:"
+SYSTEM_PROMPT = "You are a skilled assistant specializing in summarizing text. Your summaries are clear, concise, and capture the essence of the content."
 
 if uploaded_file is not None:
-    file_content = uploaded_file.read().decode("utf-8")
-    st.text_area("Contenuto del file", file_content, height=300)
+    # The text and its summary are kept in the session store, session state only has the handles
+    session_store = get_session_store()
+    text_key = f"text_{uploaded_file.file_id}"
+    if not session_store.exists(st.session_state.get(text_key)):
+        try:
+            st.session_state[text_key] = session_store.put_fileobj(current_session_id(), uploaded_file, suffix=".txt", size=uploaded_file.size)
+        except SessionQuotaError as e:
+            st.error(str(e))
+            st.stop()
+    text_handle = st.session_state[text_key]
+
+    st.text_area("Contenuto del file", session_store.read_text(text_handle, limit=PREVIEW_BYTES), height=300)
+    if uploaded_file.size > PREVIEW_BYTES:
+        st.caption(f"Anteprima dell'inizio del file ({uploaded_file.size / 1e6:.1f} MB in totale).")
 
     if 'summary' not in st.session_state:
-        st.session_state['summary'] = ''
+        st.session_state['summary'] = None
 
     if 'email' not in st.session_state:
         st.session_state['email'] = ''
@@ -70,59 +94,76 @@ if uploaded_file is not None:
         else:
             with st.spinner("Sto generando il riassunto..."):
                 try:
-                    chunks = chunk_text(file_content)
-                    chunk_summaries = []
-                    
-                    for chunk in chunks:
-                        chunk_summary = summarize_chunk(client, chunk, openai_model)
-                        chunk_summaries.append(chunk_summary)
-                    
-                    # Combine chunk summaries
-                    combined_summary = " ".join(chunk_summaries)
-                    
-                    # Generate final summary
-                    final_summary = summarize_chunk(client, combined_summary, openai_model)
+                    file_content = session_store.read_text(text_handle)
+                    # Show the final summary token by token while it is generated
+                    streaming_placeholder = st.empty()
+                    streamed_tokens = []
+
+                    def show_token(token):
+                        streamed_tokens.append(token)
+                        streaming_placeholder.markdown("".join(streamed_tokens))
+
+                    # Chunks are summarized concurrently and merged as a tree
+                    final_summary = summarize_text(
+                        client,
+                        file_content,
+                        model=openai_model,
+                        prompt=SUMMARY_PROMPT,
+                        system_prompt=SYSTEM_PROMPT,
+                        max_tokens=1000,
+                        reduce_prompt=REDUCE_PROMPT,
+                        max_workers=max_workers,
+                        on_token=show_token,
+                        map_model=map_model
+                    )
+                    streaming_placeholder.empty()
                     
-                    st.session_state['summary'] = final_summary
+                    if st.session_state['summary']:
+                        session_store.delete(st.session_state['summary'])
+                    st.session_state['summary'] = session_store.put_text(current_session_id(), final_summary)
+                    # Keep the document and its summary searchable from the search page
+                    archive_safely("add_text", file_content, summary=final_summary, title=uploaded_file.name)
 
                 except Exception as e:
+                    handle_auth_error(e, api_keys)
                     st.error(f"Si è verificato un errore: {str(e)}")
 
-    if st.session_state['summary']:
+    # The summary can be gone if the session went over its quota
+    summary_handle = st.session_state['summary']
+    if session_store.exists(summary_handle):
         st.subheader("Riassunto:")
-        st.write(st.session_state['summary'])
+        st.write(session_store.read_text(summary_handle))
 
         # Add download button for summary
         summary_filename = f"{uploaded_file.name.rsplit('.', 1)[0]}_riassunto.txt"
         st.download_button(
             label="Scarica riassunto come TXT",
-            data=st.session_state['summary'],
+            data=lambda: session_store.read_text(summary_handle),
             file_name=summary_filename,
             mime="text/plain"
         )
 
         # Email sending section
-        st.subheader("Invia riassunto via email")
-        st.session_state['email'] = st.text_input("Inserisci il tuo indirizzo email", value=st.session_state['email'])
-
-        if st.button("Invia Email"):
-            if not st.session_state['email']:
-                st.error("Per favore, inserisci un indirizzo email valido.")
-            else:
-                email_body = f"<h2>Riassunto</h2><p>{st.session_state['summary']}</p>"
-                filename = uploaded_file.name.rsplit('.', 1)[0]  # Get filename without extension
-                email_subject = f"Riassunto di {filename}"
-
-                with st.spinner("Invio email in corso..."):
-                    status_code, response = send_email(
-                        st.session_state['email'],
-                        email_subject,
-                        email_body
-                    )
-                    if status_code == 200:
+        if email_configured():
+            st.subheader("Invia riassunto via email")
+            st.session_state['email'] = st.text_input("Inserisci il tuo indirizzo email", value=st.session_state['email'])
+
+            if st.button("Invia Email"):
+                if not st.session_state['email']:
+                    st.error("Per favore, inserisci un indirizzo email valido.")
+                else:
+                    filename = uploaded_file.name.rsplit('.', 1)[0]  # Get filename without extension
+                    try:
+                        message = compose(
+                            st.session_state['email'],
+                            f"Riassunto di {filename}",
+                            [("Riassunto", session_store.read_text(summary_handle), "riassunto.txt")],
+                        )
+                        with st.spinner("Invio email in corso..."):
+                            send(message)
                         st.success("Email inviata con successo!")
-                    else:
-                        st.error(f"Errore nell'invio dell'email. Codice di stato: {status_code}, Dettagli: {response}")
+                    except EmailError as e:
+                        st.error(f"Errore nell'invio dell'email: {e}")
 
 # Add footer
 st.markdown("---")
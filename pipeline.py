@@ -0,0 +1,342 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from clients import get_openai_client
+from credentials import get_assemblyai_capabilities
+from functions import (
+    is_valid_youtube_url,
+    extract_youtube_video_id,
+    extract_google_drive_file_id,
+    download_file_from_google_drive,
+    download_youtube_audio,
+    download_audio_from_url,
+    summarize_transcript,
+    transcript_summary_options
+)
+from downloads import GrowingFile
+from summarization import EarlySummarizer
+from transcription import can_transcribe_stream, transcribe_stream, transcribe_with_whisper
+from local_whisper import LOCAL_WHISPER_MODEL, transcribe_local as transcribe_local_whisper
+import assemblyai_async
+from disk_cache import audio_key, transcript_cache, transcript_cache_key
+from metrics import span
+from singleflight import SingleFlight
+import transcripts
+from transcripts import Transcript
+
+# Transcription and summarization steps shared by the Streamlit pages and the job workers.
+# Nothing in here touches the Streamlit UI, progress is reported through callbacks.
+# The assemblyai SDK and the diarization stack (NumPy) are imported by the steps that need
+# them, so importing the engine registry stays cheap.
+
+ENGINE_OPENAI = "openai"
+ENGINE_ASSEMBLYAI = "assemblyai"
+ENGINE_LOCAL = "local"
+# Whisper transcription with speakers from the local diarization stage
+ENGINE_OPENAI_DIARIZED = "openai_diarized"
+ENGINE_LOCAL_DIARIZED = "local_diarized"
+
+# Languages offered for both OpenAI and AssemblyAI
+LANGUAGES = {
+    "Italiano": "it",
+    "English": "en",
+    "Français": "fr",
+    "Deutsch": "de",
+    "Español": "es"
+}
+
+# Concurrent requests for the same source or the same transcript share one run
+download_flight = SingleFlight("download")
+transcription_flight = SingleFlight("transcribe")
+
+# Downloads started ahead of time, as soon as the user enters a URL
+PREFETCH_WORKERS = 4
+prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="sbobinator-prefetch")
+_downloads = {}
+_downloads_lock = threading.Lock()
+
+# The same video or file can arrive under different URLs (youtu.be, watch?v=, Drive share links)
+def source_key(url):
+    video_id = extract_youtube_video_id(url)
+    if video_id:
+        return f"youtube:{video_id}"
+    file_id = extract_google_drive_file_id(url)
+    if file_id:
+        return f"google_drive:{file_id}"
+    return f"url:{url.strip()}"
+
+def _download(url, progress=None):
+    if is_valid_youtube_url(url):
+        download, source = download_youtube_audio, "youtube"
+    elif extract_google_drive_file_id(url):
+        download, source = download_file_from_google_drive, "google_drive"
+    else:
+        download, source = download_audio_from_url, "url"
+
+    with span("download", provider=source) as info:
+        audio_path, file_name = download(url, _progress=progress)
+        if not os.path.exists(audio_path):
+            # The spool file expired while the download was still cached
+            download.clear()
+            audio_path, file_name = download(url, _progress=progress)
+        info["bytes_out"] = os.path.getsize(audio_path)
+
+    if not info["bytes_out"]:
+        raise ValueError("No audio data downloaded")
+    return audio_path, file_name
+
+def download_source(url):
+    result, _ = download_flight.do(source_key(url), lambda: _download(url))
+    return result
+
+# A download running in the background. stream follows its bytes while they arrive,
+# result() waits for (audio path, file name) like download_source().
+class SourceDownload:
+    def __init__(self, url):
+        self.url = url
+        self.stream = GrowingFile()
+        self.future = Future()
+
+    def run(self):
+        try:
+            result, _ = download_flight.do(source_key(self.url), lambda: _download(self.url, self.stream))
+        except Exception as e:
+            self.stream.fail(e)
+            self.future.set_exception(e)
+            return
+        self.stream.finish(result[0])
+        self.future.set_result(result)
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+    # Failed downloads and files removed by the spool cleanup are started again
+    def usable(self):
+        if not self.future.done():
+            return True
+        return self.future.exception() is None and os.path.exists(self.future.result()[0])
+
+# Start downloading url in the background, or return the download already started for it.
+# The home page calls this as soon as a URL is entered, so by the time the job starts the
+# audio is partly or entirely there. Errors are only raised by result().
+def start_download(url):
+    key = source_key(url)
+    with _downloads_lock:
+        for stale in [k for k, d in _downloads.items() if not d.usable()]:
+            del _downloads[stale]
+        download = _downloads.get(key)
+        if download is None:
+            download = _downloads[key] = SourceDownload(url)
+            prefetch_executor.submit(download.run)
+        return download
+
+# Serve repeated requests for the same audio from the transcript cache, and let concurrent
+# requests wait for the one already running. compute(on_segment) returns a Transcript;
+# streams tells whether it reports pieces to on_segment itself, otherwise (and for cached or
+# shared results) the whole transcript is handed to on_segment once it is ready.
+# Transcripts are cached in their compact columnar form.
+def _transcribe_once(cache_key, compute, on_segment, streams=False):
+    def run():
+        cached = transcript_cache.get(cache_key)
+        if cached is not None:
+            return Transcript.from_dict(cached), False
+        transcript = compute(on_segment)
+        transcript_cache.set(cache_key, transcript.to_columns())
+        return transcript, True
+
+    (transcript, computed), shared = transcription_flight.do(cache_key, run)
+    if on_segment and (shared or not computed or not streams):
+        on_segment(transcript.text, transcript.segments)
+    return transcript
+
+# on_segment(text, segments) receives the transcript piece by piece while it is produced
+def transcribe_openai(api_key, audio_path, language, on_segment=None):
+    cache_key = transcript_cache_key(audio_key(audio_path), ENGINE_OPENAI, "whisper-1", language)
+
+    def compute(on_segment):
+        with span("transcribe", provider=ENGINE_OPENAI, model="whisper-1", bytes_in=os.path.getsize(audio_path)):
+            result = transcribe_with_whisper(get_openai_client(api_key), audio_path, language, on_segment=on_segment)
+        return transcripts.from_whisper(result, ENGINE_OPENAI, language)
+
+    return _transcribe_once(cache_key, compute, on_segment, streams=True)
+
+def transcribe_assemblyai(api_key, audio_path, language, on_segment=None):
+    cache_key = transcript_cache_key(audio_key(audio_path), ENGINE_ASSEMBLYAI, "speaker_labels", language)
+
+    def compute(on_segment):
+        with span("transcribe", provider=ENGINE_ASSEMBLYAI, model="speaker_labels", bytes_in=os.path.getsize(audio_path)):
+            transcript = transcripts.from_assemblyai(assemblyai_async.transcribe_file(api_key, audio_path, language), language)
+        if not len(transcript):
+            raise ValueError("La trascrizione non contiene utterances")
+        return transcript
+
+    return _transcribe_once(cache_key, compute, on_segment)
+
+def transcribe_local(audio_path, language, on_segment=None):
+    cache_key = transcript_cache_key(audio_key(audio_path), ENGINE_LOCAL, LOCAL_WHISPER_MODEL, language)
+
+    def compute(on_segment):
+        with span("transcribe", provider=ENGINE_LOCAL, model=LOCAL_WHISPER_MODEL, bytes_in=os.path.getsize(audio_path)):
+            return transcripts.from_whisper(transcribe_local_whisper(audio_path, language), ENGINE_LOCAL, language)
+
+    return _transcribe_once(cache_key, compute, on_segment)
+
+# Whisper transcription of a download that is still running: segments are cut and sent
+# while the rest downloads (transcription.transcribe_stream). The transcript is cached under
+# the finished file's key, like transcribe_openai() would, and under the video or file ID,
+# so a repeat of the same source is served before its download finished. Sessions streaming
+# the same source at the same time share one run. Returns None when the audio can't be read
+# as a stream (e.g. an mp4 with its index at the end) before anything was transcribed; the
+# caller then waits for the download and transcribes the file.
+def transcribe_openai_stream(api_key, download, language, on_segment=None):
+    source = source_key(download.url)
+    # What a plain URL serves can change, those are only found by content once downloaded
+    source_cache_key = None if source.startswith("url:") else transcript_cache_key(source, ENGINE_OPENAI, "whisper-1", language)
+    reported = []
+
+    def report(text, segments):
+        reported.append(len(segments))
+        if on_segment:
+            on_segment(text, segments)
+
+    def cached():
+        keys = [source_cache_key] if source_cache_key else []
+        if download.done() and download.usable():
+            keys.append(transcript_cache_key(audio_key(download.result()[0]), ENGINE_OPENAI, "whisper-1", language))
+        for key in keys:
+            columns = transcript_cache.get(key)
+            if columns is not None:
+                return Transcript.from_dict(columns)
+        return None
+
+    def run():
+        transcript = cached()
+        if transcript is not None:
+            return transcript, False
+        try:
+            with span("transcribe", provider=ENGINE_OPENAI, model="whisper-1", streamed=True):
+                result = transcribe_stream(get_openai_client(api_key), download.stream.chunks(), language, on_segment=report)
+        except ValueError:
+            if reported:
+                raise
+            return None, False
+        transcript = transcripts.from_whisper(result, ENGINE_OPENAI, language)
+        audio_path, _ = download.result()
+        transcript_cache.set(transcript_cache_key(audio_key(audio_path), ENGINE_OPENAI, "whisper-1", language), transcript.to_columns())
+        if source_cache_key:
+            transcript_cache.set(source_cache_key, transcript.to_columns())
+        return transcript, True
+
+    (transcript, computed), shared = transcription_flight.do(f"stream:{source}:{language}", run)
+    if transcript is not None and on_segment and (shared or not computed):
+        on_segment(transcript.text, transcript.segments)
+    return transcript
+
+def can_stream(engine):
+    return engine == ENGINE_OPENAI and can_transcribe_stream()
+
+# Diarization runs on the CPU while Whisper is transcribing, then the two are merged
+def _with_local_diarization(audio_path, transcribe, engine, language):
+    import diarization
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="sbobinator-diarize") as executor:
+        turns = executor.submit(diarization.diarize, audio_path)
+        result = transcribe()
+        return diarization.merge_transcript(result, turns.result(), engine, language)
+
+def transcribe_openai_diarized(api_key, audio_path, language, on_segment=None):
+    import diarization
+    model = f"whisper-1+{diarization.DIARIZATION_MODEL}"
+    cache_key = transcript_cache_key(audio_key(audio_path), ENGINE_OPENAI_DIARIZED, model, language)
+
+    def compute(on_segment):
+        with span("transcribe", provider=ENGINE_OPENAI_DIARIZED, model=model, bytes_in=os.path.getsize(audio_path)):
+            return _with_local_diarization(
+                audio_path,
+                lambda: transcribe_with_whisper(get_openai_client(api_key), audio_path, language),
+                ENGINE_OPENAI_DIARIZED,
+                language
+            )
+
+    return _transcribe_once(cache_key, compute, on_segment)
+
+def transcribe_local_diarized(audio_path, language, on_segment=None):
+    import diarization
+    model = f"{LOCAL_WHISPER_MODEL}+{diarization.DIARIZATION_MODEL}"
+    cache_key = transcript_cache_key(audio_key(audio_path), ENGINE_LOCAL_DIARIZED, model, language)
+
+    def compute(on_segment):
+        with span("transcribe", provider=ENGINE_LOCAL_DIARIZED, model=model, bytes_in=os.path.getsize(audio_path)):
+            return _with_local_diarization(
+                audio_path,
+                lambda: transcribe_local_whisper(audio_path, language),
+                ENGINE_LOCAL_DIARIZED,
+                language
+            )
+
+    return _transcribe_once(cache_key, compute, on_segment)
+
+# Plain-text rendering of a transcript from any engine, "Speaker X:" paragraphs when diarized
+def transcript_text(transcript):
+    return transcript.text
+
+# Summary calls made while the transcript is still being produced (see EarlySummarizer).
+# The pieces are collected in a Transcript, so the text is exactly the one summarize() gets.
+class EarlySummary:
+    def __init__(self, api_key, language_name):
+        self.summarizer = EarlySummarizer(get_openai_client(api_key), **transcript_summary_options(language_name))
+        self.transcript = Transcript()
+
+    # segments as passed to on_segment: dicts while streaming, Segments for a whole transcript
+    def add(self, segments):
+        for segment in segments:
+            if isinstance(segment, dict):
+                self.transcript.add_segment(segment["start"], segment["end"], segment["text"], segment.get("speaker"))
+            else:
+                self.transcript.add_segment(segment.start, segment.end, segment.text, segment.speaker)
+        self.summarizer.update(transcript_text(self.transcript))
+
+    def wait(self):
+        self.summarizer.wait()
+
+    def close(self):
+        self.summarizer.close()
+
+# LeMUR summarizes on AssemblyAI's side, the other engines need an OpenAI key
+def start_early_summary(api_keys, engine, language_name):
+    if engine == ENGINE_ASSEMBLYAI or not api_keys.get("openai"):
+        return None
+    return EarlySummary(api_keys["openai"], language_name)
+
+# Returns the summary and an optional warning to show when LeMUR had to fall back to OpenAI
+def summarize_assemblyai(api_keys, transcript, language_name, on_token=None):
+    full_transcript = transcript_text(transcript)
+    try:
+        # Check if the API key has access to LeMUR
+        if get_assemblyai_capabilities(api_keys["assemblyai"])["lemur_enabled"]:
+            import assemblyai as aai
+            # Use LeMUR for summarization
+            aai.settings.api_key = api_keys["assemblyai"]
+            aai.settings.base_url = assemblyai_async.ASSEMBLYAI_BASE_URL
+            with span("summarize", provider="assemblyai", model="lemur"):
+                summary = aai.Transcript.get_by_id(transcript.id).lemur.summarize(
+                    context="",
+                    answer_format="**<topic header>**\n<topic summary>"
+                )
+            return summary.response, None
+        # Fallback to OpenAI summarization
+        return summarize_transcript(api_keys["openai"], full_transcript, language_name, on_token), None
+    except Exception as e:
+        warning = f"Errore durante la generazione del riassunto con LeMUR: {str(e)}. Utilizzo il fallback con OpenAI per generare il riassunto."
+        return summarize_transcript(api_keys["openai"], full_transcript, language_name, on_token), warning
+
+# Summary for any engine; returns the summary and an optional warning for the user
+def summarize(api_keys, engine, transcript, language_name, on_token=None):
+    if engine == ENGINE_ASSEMBLYAI:
+        return summarize_assemblyai(api_keys, transcript, language_name, on_token)
+    if not api_keys.get("openai"):
+        # Local transcription works without any key, the summary doesn't
+        return "", "Riassunto non generato: serve una API Key di OpenAI."
+    return summarize_transcript(api_keys["openai"], transcript_text(transcript), language_name, on_token), None
@@ -0,0 +1,147 @@
+import bisect
+import json
+import os
+import time
+import uuid
+from pydub.exceptions import CouldntEncodeError
+from pydub.silence import detect_silence
+from disk_cache import hash_file, register_audio_key
+from spool import get_spool_dir
+from metrics import span
+from transcription import decode_mono
+from singleflight import SingleFlight
+
+# Speech only needs 16 kHz mono, a low-bitrate Opus stream keeps it intelligible at a fraction of the size
+TARGET_FRAME_RATE = 16000
+OPUS_BITRATE = "24k"
+# Used when the local ffmpeg has no libopus
+FALLBACK_MP3_BITRATE = "32k"
+# Pauses longer than this are shortened to KEEP_SILENCE_MS
+MAX_SILENCE_MS = 2000
+KEEP_SILENCE_MS = 500
+SILENCE_THRESH_OFFSET_DB = 16
+# Only used to estimate the upload time saved
+UPLOAD_BANDWIDTH_BYTES_PER_SECOND = int(os.environ.get("SBOBINATOR_UPLOAD_BANDWIDTH", str(10 * 1000 * 1000 // 8)))
+
+# Shorten every pause longer than MAX_SILENCE_MS, keeping KEEP_SILENCE_MS of it.
+# Returns the trimmed audio and its timeline: [trimmed_ms, shift_ms] pairs, from trimmed_ms
+# on the trimmed audio is shift_ms behind the original (see restore_timeline()).
+def trim_silences(audio):
+    silences = detect_silence(
+        audio,
+        min_silence_len=MAX_SILENCE_MS,
+        silence_thresh=audio.dBFS - SILENCE_THRESH_OFFSET_DB,
+        seek_step=50
+    )
+    if not silences:
+        return audio, [[0, 0]]
+
+    # Join the raw frames once, repeated AudioSegment concatenation copies everything each time
+    pieces = []
+    timeline = [[0, 0]]
+    position = 0
+    trimmed_ms = 0
+    for silence_start, silence_end in silences:
+        piece_end = silence_start + KEEP_SILENCE_MS // 2
+        pieces.append(audio[position:piece_end].raw_data)
+        trimmed_ms += piece_end - position
+        position = silence_end - KEEP_SILENCE_MS // 2
+        timeline.append([trimmed_ms, position - trimmed_ms])
+    pieces.append(audio[position:].raw_data)
+    return audio._spawn(b"".join(pieces)), timeline
+
+# Copy of a transcript of trimmed audio with its times on the original recording's timeline,
+# so subtitles and deep links point at the right moment of the source
+def restore_timeline(transcript, timeline):
+    if not timeline or len(timeline) < 2:
+        return transcript
+    starts = [trimmed_ms for trimmed_ms, _ in timeline]
+
+    def original(seconds):
+        index = bisect.bisect_right(starts, max(seconds, 0) * 1000) - 1
+        return seconds + timeline[index][1] / 1000
+
+    # Cached and shared transcripts are used by other jobs too, never change them in place
+    restored = type(transcript).from_dict(transcript.to_columns())
+    restored.map_times(original)
+    return restored
+
+# Encode to a temporary name first, so concurrent jobs never pick up a half-written file
+def _export(audio, base_path):
+    tmp_path = f"{base_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        audio.export(tmp_path, format="ogg", codec="libopus", bitrate=OPUS_BITRATE)
+        extension = ".ogg"
+    except CouldntEncodeError:
+        audio.export(tmp_path, format="mp3", bitrate=FALLBACK_MP3_BITRATE)
+        extension = ".mp3"
+    os.replace(tmp_path, base_path + extension)
+    return base_path + extension
+
+transcode_flight = SingleFlight("transcode")
+
+# Everything that changes the preprocessed audio. Encoders don't produce the same bytes twice,
+# so the output is identified by its source hash and these parameters instead of its own hash.
+def preprocessing_variant(trim):
+    variant = f"{TARGET_FRAME_RATE}hz-opus{OPUS_BITRATE}-mp3{FALLBACK_MP3_BITRATE}"
+    if trim:
+        variant += f"-trim{MAX_SILENCE_MS}-{KEEP_SILENCE_MS}-{SILENCE_THRESH_OFFSET_DB}db"
+    return variant
+
+# Downmix, resample, trim long pauses and re-encode for upload. Returns the new path
+# and a stats dict; the result is kept in the spool, keyed by the source hash, so the
+# same audio is only processed once. The transcript cache sees the output under the
+# source hash and variant (disk_cache.audio_key), so it still hits after the spool
+# file was cleaned up and encoded again.
+# stats["timeline"] maps the trimmed file's timestamps back to the original recording.
+# upload_bytes(path) is what the engine sends for a file (TranscriptionEngine.upload_bytes),
+# the savings are measured on that rather than on the file sizes.
+def normalize_audio(path, trim=True, upload_bytes=os.path.getsize):
+    started = time.perf_counter()
+    bytes_in = upload_bytes(path)
+    key = f"{hash_file(path)}-{preprocessing_variant(trim)}"
+    base_path = os.path.join(get_spool_dir(), f"normalized-{key}")
+
+    # The timeline is kept next to the output, written before it so a reused output has one
+    timeline_path = base_path + ".json"
+
+    def transcode():
+        existing = next((base_path + ext for ext in (".ogg", ".mp3") if os.path.exists(base_path + ext)), None)
+        if existing and os.path.exists(timeline_path):
+            with open(timeline_path) as f:
+                return existing, json.load(f)
+        with span("preprocess", bytes_in=os.path.getsize(path)) as info:
+            audio = decode_mono(path, TARGET_FRAME_RATE)
+            timeline = [[0, 0]]
+            if trim:
+                audio, timeline = trim_silences(audio)
+            with open(timeline_path + ".tmp", "w") as f:
+                json.dump(timeline, f)
+            os.replace(timeline_path + ".tmp", timeline_path)
+            output = _export(audio, base_path)
+            info["bytes_out"] = os.path.getsize(output)
+        return output, timeline
+
+    # Sessions normalizing the same audio at the same time share one transcode
+    (output_path, timeline), _ = transcode_flight.do(base_path, transcode)
+
+    bytes_out = upload_bytes(output_path)
+    # Never make the upload bigger, e.g. for a source that is already a compact speech file.
+    # Local engines upload nothing, for them the shorter audio is the only gain.
+    if bytes_in and bytes_out >= bytes_in:
+        output_path = path
+        bytes_out = bytes_in
+        timeline = [[0, 0]]
+    else:
+        register_audio_key(output_path, key)
+
+    bytes_saved = bytes_in - bytes_out
+    processing_seconds = time.perf_counter() - started
+    return output_path, {
+        "bytes_in": bytes_in,
+        "bytes_out": bytes_out,
+        "bytes_saved": bytes_saved,
+        "processing_seconds": processing_seconds,
+        "upload_seconds_saved": bytes_saved / UPLOAD_BANDWIDTH_BYTES_PER_SECOND - processing_seconds,
+        "timeline": timeline,
+    }
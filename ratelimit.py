@@ -0,0 +1,231 @@
+import asyncio
+import contextvars
+import hashlib
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Process-wide scheduler for provider calls. Every provider/key pair has token buckets for
+# requests per minute and tokens per minute; callers queue by priority (interactive before
+# batch), and a 429 pauses the whole queue for that key until Retry-After has passed.
+# Limits and ordering only cover the calls of this process: other processes using the same
+# keys (a second server, a CLI batch) are only seen through the 429s they cause.
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+PROVIDER_OPENAI_AUDIO = "openai-audio"
+PROVIDER_OPENAI_CHAT = "openai-chat"
+PROVIDER_ASSEMBLYAI = "assemblyai"
+PROVIDER_RESEND = "resend"
+
+def _env_limit(name, default):
+    return float(os.environ.get(f"SBOBINATOR_LIMIT_{name}", default))
+
+# Requests and tokens per minute; a missing entry means unlimited
+PROVIDER_LIMITS = {
+    PROVIDER_OPENAI_AUDIO: {"rpm": _env_limit("OPENAI_AUDIO_RPM", 50)},
+    PROVIDER_OPENAI_CHAT: {"rpm": _env_limit("OPENAI_CHAT_RPM", 500), "tpm": _env_limit("OPENAI_CHAT_TPM", 200000)},
+    PROVIDER_ASSEMBLYAI: {"rpm": _env_limit("ASSEMBLYAI_RPM", 300)},
+    PROVIDER_RESEND: {"rpm": _env_limit("RESEND_RPM", 120)},
+}
+# Without Retry-After, pauses grow from BACKOFF_BASE_SECONDS with each consecutive failure
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+# How often a coroutine waiting behind other callers checks whether it is its turn
+ASYNC_POLL_SECONDS = 0.05
+
+# Priority of the code running in this context, see Scheduler.priority()
+_priority = contextvars.ContextVar("sbobinator_priority", default=None)
+
+# Executor threads don't inherit the submitter's context: tasks submitted through this run
+# with a copy of it, so the priority follows the work into worker pools
+def submit_in_context(executor, fn, *args, **kwargs):
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.available = per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    # Seconds to wait before amount can be taken, 0 if it can be taken now
+    def wait_time(self, amount, now):
+        self._refill(now)
+        # A single request larger than the bucket only has to wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def take(self, amount):
+        self.available -= min(amount, self.capacity)
+
+class _ProviderQueue:
+    def __init__(self, limits):
+        self.requests = TokenBucket(limits["rpm"]) if "rpm" in limits else None
+        self.tokens = TokenBucket(limits["tpm"]) if "tpm" in limits else None
+        self.paused_until = 0.0
+        self.consecutive_limited = 0
+        self.waiters = []
+        self.condition = threading.Condition()
+
+    def wait_time(self, tokens, now):
+        wait = max(0.0, self.paused_until - now)
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    # Called with the condition held by the caller at the head of the queue, once wait_time() is 0
+    def take(self, tokens):
+        heapq.heappop(self.waiters)
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens and tokens:
+            self.tokens.take(tokens)
+
+class Scheduler:
+    def __init__(self, limits=PROVIDER_LIMITS):
+        self.limits = limits
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    def _queue(self, provider, api_key):
+        key = (provider, hashlib.sha256((api_key or "").encode("utf-8")).hexdigest())
+        with self._lock:
+            if key not in self._queues:
+                self._queues[key] = _ProviderQueue(self.limits.get(provider, {}))
+            return self._queues[key]
+
+    # Priority for calls made in this context, e.g. `with scheduler.priority(PRIORITY_BATCH):`.
+    # Work handed to other threads keeps it when submitted with submit_in_context().
+    @contextmanager
+    def priority(self, value):
+        token = _priority.set(value)
+        try:
+            yield
+        finally:
+            _priority.reset(token)
+
+    def current_priority(self):
+        priority = _priority.get()
+        return PRIORITY_INTERACTIVE if priority is None else priority
+
+    # Block until the call may go out; tokens is the expected prompt + completion size
+    def acquire(self, provider, api_key, tokens=0, priority=None):
+        if priority is None:
+            priority = self.current_priority()
+        queue = self._queue(provider, api_key)
+        entry = (priority, next(self._sequence))
+        with queue.condition:
+            heapq.heappush(queue.waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if queue.waiters[0] == entry:
+                        wait = queue.wait_time(tokens, now)
+                        if wait <= 0:
+                            break
+                        queue.condition.wait(timeout=wait)
+                    else:
+                        # Someone ahead of us in the queue goes first
+                        queue.condition.wait()
+                queue.take(tokens)
+            except BaseException:
+                queue.waiters.remove(entry)
+                heapq.heapify(queue.waiters)
+                raise
+            finally:
+                queue.condition.notify_all()
+
+    # Like acquire(), for coroutines: waits in the same queue with asyncio.sleep instead of
+    # blocking a thread. Threads waiting on the condition are woken when this one goes out.
+    async def acquire_async(self, provider, api_key, tokens=0, priority=None):
+        if priority is None:
+            priority = self.current_priority()
+        queue = self._queue(provider, api_key)
+        entry = (priority, next(self._sequence))
+        with queue.condition:
+            heapq.heappush(queue.waiters, entry)
+        try:
+            while True:
+                with queue.condition:
+                    wait = queue.wait_time(tokens, time.monotonic())
+                    if queue.waiters[0] == entry:
+                        if wait <= 0:
+                            queue.take(tokens)
+                            queue.condition.notify_all()
+                            return
+                    else:
+                        # Someone ahead of us goes first, there is no condition to wake us
+                        wait = max(wait, ASYNC_POLL_SECONDS)
+                await asyncio.sleep(wait)
+        except BaseException:
+            with queue.condition:
+                if entry in queue.waiters:
+                    queue.waiters.remove(entry)
+                    heapq.heapify(queue.waiters)
+                queue.condition.notify_all()
+            raise
+
+    # A provider answered 429: pause every caller on this key, for Retry-After if given
+    def report_rate_limited(self, provider, api_key, retry_after=None):
+        queue = self._queue(provider, api_key)
+        with queue.condition:
+            queue.consecutive_limited += 1
+            if retry_after is None:
+                retry_after = backoff_seconds(queue.consecutive_limited - 1)
+            queue.paused_until = max(queue.paused_until, time.monotonic() + retry_after)
+            queue.condition.notify_all()
+
+    # A call failed and will be retried; response is the provider's answer, None when there was
+    # none (connection error, timeout). A 429 pauses every caller on the key and the next
+    # acquire() waits it out; any other failure only delays this caller. Returns the seconds
+    # the caller should sleep before acquiring again.
+    def report_failure(self, provider, api_key, attempt, response=None):
+        retry_after = retry_after_seconds(response.headers) if response is not None else None
+        if response is not None and response.status_code == 429:
+            self.report_rate_limited(provider, api_key, retry_after)
+            return 0.0
+        return backoff_seconds(attempt, retry_after)
+
+    def report_success(self, provider, api_key):
+        queue = self._queue(provider, api_key)
+        with queue.condition:
+            queue.consecutive_limited = 0
+
+# Seconds from a Retry-After header (only the delta-seconds form), None when missing
+def retry_after_seconds(headers):
+    value = headers.get("retry-after") if headers is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+# Delay before retry number attempt (from 0): Retry-After when the provider sent one,
+# otherwise exponential backoff with jitter so callers that failed together don't retry together
+def backoff_seconds(attempt, retry_after=None):
+    if retry_after is not None:
+        return min(retry_after, BACKOFF_MAX_SECONDS)
+    return min(BACKOFF_BASE_SECONDS * 2 ** attempt, BACKOFF_MAX_SECONDS) * (0.5 + random.random() / 2)
+
+# True for 429s from any of the clients in use (openai, httpx, requests)
+def is_rate_limit_error(error):
+    response = getattr(error, "response", None)
+    return getattr(error, "status_code", None) == 429 or getattr(response, "status_code", None) == 429
+
+RATE_LIMIT_MESSAGE = "Il servizio ha raggiunto il limite di richieste per questa API Key, riprova tra qualche minuto."
+
+scheduler = Scheduler()
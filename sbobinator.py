@@ -0,0 +1,226 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pipeline
+from preprocessing import normalize_audio, restore_timeline
+from ratelimit import PRIORITY_BATCH, scheduler, submit_in_context
+from engines import ENGINES, get_engine
+from transcripts import Transcript
+from functions import is_valid_youtube_url, list_youtube_playlist
+import emails
+
+# Headless batch mode: python -m sbobinator batch <dir|playlist|urls.txt|url> -o <output dir>
+# Each source gets its own folder in the output directory; sources whose outputs already
+# exist are skipped, so an interrupted batch can simply be run again. With --email every
+# recipient gets one digest of the whole batch at the end.
+
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".ogg", ".mp4", ".m4a", ".flac", ".webm", ".opus")
+TRANSCRIPT_FILE = "trascrizione.txt"
+TRANSCRIPT_JSON_FILE = "trascrizione.json"
+SUMMARY_FILE = "riassunto.txt"
+SUBTITLES_SRT_FILE = "sottotitoli.srt"
+SUBTITLES_VTT_FILE = "sottotitoli.vtt"
+
+# Expand the batch argument into a list of sources (local paths or URLs)
+def collect_sources(target):
+    if os.path.isdir(target):
+        return sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(target)
+            for name in names
+            if name.lower().endswith(AUDIO_EXTENSIONS)
+        )
+    if os.path.isfile(target) and target.lower().endswith(".txt"):
+        with open(target, encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    if os.path.isfile(target):
+        return [target]
+    if is_valid_youtube_url(target) and ("list=" in target or "/playlist" in target):
+        return list_youtube_playlist(target)
+    return [target]
+
+# Stable, filesystem-safe folder name for a source
+def source_slug(source):
+    base = os.path.splitext(os.path.basename(source.rstrip("/")))[0] or "audio"
+    base = re.sub(r"[^\w.-]+", "_", base)[:60]
+    return f"{base}-{hashlib.sha1(source.encode('utf-8')).hexdigest()[:8]}"
+
+def write_atomic(path, content):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def process_source(source, args, api_keys, limits):
+    out_dir = os.path.join(args.output, source_slug(source))
+    final_file = os.path.join(out_dir, TRANSCRIPT_FILE if args.no_summary else SUMMARY_FILE)
+    if os.path.exists(final_file):
+        return "skipped"
+    os.makedirs(out_dir, exist_ok=True)
+
+    # A run that stopped after transcribing resumes from the saved transcript, without the audio
+    transcript_file = os.path.join(out_dir, TRANSCRIPT_JSON_FILE)
+    if os.path.exists(transcript_file):
+        with open(transcript_file, encoding="utf-8") as f:
+            transcript = Transcript.from_dict(json.load(f))
+    else:
+        if os.path.exists(source):
+            audio_path = source
+        else:
+            with limits["download"]:
+                audio_path, _ = pipeline.download_source(source)
+        stats = None
+        if args.preprocess:
+            audio_path, stats = normalize_audio(audio_path, upload_bytes=get_engine(args.engine).upload_bytes)
+            if stats["bytes_in"]:
+                print(f"[{source}] audio ottimizzato: {stats['bytes_saved'] / 1e6:.1f} MB in meno, ~{stats['upload_seconds_saved']:.0f} s risparmiati")
+
+        with limits[args.engine]:
+            transcript = get_engine(args.engine).transcribe(api_keys, audio_path, args.language)
+        if stats:
+            transcript = restore_timeline(transcript, stats["timeline"])
+        write_atomic(transcript_file, transcript.to_json())
+    write_atomic(os.path.join(out_dir, TRANSCRIPT_FILE), pipeline.transcript_text(transcript))
+    write_atomic(os.path.join(out_dir, SUBTITLES_SRT_FILE), transcript.to_srt())
+    write_atomic(os.path.join(out_dir, SUBTITLES_VTT_FILE), transcript.to_vtt())
+
+    if not args.no_summary:
+        language_name = next(name for name, code in pipeline.LANGUAGES.items() if code == args.language)
+        with limits["chat"]:
+            summary, warning = pipeline.summarize(api_keys, args.engine, transcript, language_name)
+        if warning:
+            print(f"[{source}] {warning}", file=sys.stderr)
+        write_atomic(os.path.join(out_dir, SUMMARY_FILE), summary)
+    return "done"
+
+def _read_output(out_dir, name):
+    path = os.path.join(out_dir, name)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+# One digest per recipient with the summaries of the finished sources and their transcripts
+# attached. Resend's batch endpoint takes no attachments, so every digest is its own call,
+# paced by the scheduler; the message (and its zip) is only composed once.
+def send_digests(args, sources):
+    entries = []
+    for source in sources:
+        out_dir = os.path.join(args.output, source_slug(source))
+        entries.append({
+            "title": os.path.basename(source.rstrip("/")) or source,
+            "summary": _read_output(out_dir, SUMMARY_FILE),
+            "transcript": _read_output(out_dir, TRANSCRIPT_FILE),
+        })
+    subject = f"Sbobinator - {len(entries)} trascrizioni"
+    email_queue = emails.get_email_queue()
+    futures = {}
+    try:
+        digest = emails.compose_digest(args.email, subject, entries)
+    except emails.EmailError as e:
+        print(f"Invio dei riepiloghi non riuscito: {e}", file=sys.stderr)
+        return len(args.email)
+    failures = 0
+    for recipient in args.email:
+        try:
+            futures[recipient] = email_queue.submit(dict(digest, to=[recipient]), args.resend_key)
+        except emails.EmailError as e:
+            failures += 1
+            print(f"Invio del riepilogo a {recipient} non riuscito: {e}", file=sys.stderr)
+    for recipient, future in futures.items():
+        try:
+            future.result()
+            print(f"Riepilogo inviato a {recipient}")
+        except emails.EmailError as e:
+            failures += 1
+            print(f"Invio del riepilogo a {recipient} non riuscito: {e}", file=sys.stderr)
+    return failures
+
+def run_batch(args):
+    api_keys = {
+        "openai": args.openai_key or os.environ.get("OPENAI_API_KEY", ""),
+        "assemblyai": args.assemblyai_key or os.environ.get("ASSEMBLYAI_API_KEY", "")
+    }
+    engine = get_engine(args.engine)
+    if not engine.is_available():
+        sys.exit(f"Il motore {args.engine} non è installato")
+    if engine.api_key_name == "assemblyai" and not api_keys["assemblyai"]:
+        sys.exit("Serve una API Key di AssemblyAI (--assemblyai-key o ASSEMBLYAI_API_KEY)")
+    if (engine.api_key_name == "openai" or not args.no_summary) and not api_keys["openai"]:
+        sys.exit("Serve una API Key di OpenAI (--openai-key o OPENAI_API_KEY)")
+    # Recipients can be repeated or comma separated
+    args.email = [address.strip() for value in args.email or [] for address in value.split(",") if address.strip()]
+    args.resend_key = args.resend_key or emails.RESEND_API_KEY
+    if args.email and not args.resend_key:
+        sys.exit("Serve una API Key di Resend per inviare i riepiloghi (--resend-key o RESEND_API_KEY)")
+
+    sources = collect_sources(args.target)
+    if not sources:
+        sys.exit(f"Nessun file audio trovato in {args.target}")
+    os.makedirs(args.output, exist_ok=True)
+
+    # Per-provider limits on top of the worker pool
+    limits = {
+        "download": threading.BoundedSemaphore(args.download_concurrency),
+        pipeline.ENGINE_OPENAI: threading.BoundedSemaphore(args.openai_concurrency),
+        pipeline.ENGINE_ASSEMBLYAI: threading.BoundedSemaphore(args.assemblyai_concurrency),
+        # The local engine is already bounded by its process pool
+        pipeline.ENGINE_LOCAL: threading.BoundedSemaphore(args.workers),
+        "chat": threading.BoundedSemaphore(args.chat_concurrency),
+    }
+    # Local diarization shares the limit of the Whisper engine it runs with
+    limits[pipeline.ENGINE_OPENAI_DIARIZED] = limits[pipeline.ENGINE_OPENAI]
+    limits[pipeline.ENGINE_LOCAL_DIARIZED] = limits[pipeline.ENGINE_LOCAL]
+
+    failures = 0
+    completed = set()
+    # Batch work: interactive calls made in the same process go first. The workers get
+    # the priority through submit_in_context()
+    with scheduler.priority(PRIORITY_BATCH), ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {submit_in_context(executor, process_source, source, args, api_keys, limits): source for source in sources}
+        for index, future in enumerate(as_completed(futures), start=1):
+            source = futures[future]
+            try:
+                status = future.result()
+                completed.add(source)
+                print(f"[{index}/{len(sources)}] {status}: {source}")
+            except Exception as e:
+                failures += 1
+                print(f"[{index}/{len(sources)}] errore: {source}: {e}", file=sys.stderr)
+    if args.email and completed:
+        # Same order as the sources, not the completion order
+        failures += send_digests(args, [source for source in sources if source in completed])
+    return 1 if failures else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="sbobinator", description="Trascrizione e riassunto di file audio")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch = commands.add_parser("batch", help="Trascrivi una cartella, una playlist YouTube o un elenco di URL")
+    batch.add_argument("target", help="Cartella di file audio, URL di una playlist, file .txt con un URL per riga o singolo URL")
+    batch.add_argument("-o", "--output", default="output", help="Cartella in cui salvare trascrizioni e riassunti")
+    batch.add_argument("--engine", choices=list(ENGINES), default=pipeline.ENGINE_OPENAI)
+    batch.add_argument("--language", choices=list(pipeline.LANGUAGES.values()), default="it")
+    batch.add_argument("--no-summary", action="store_true", help="Salta la generazione dei riassunti")
+    batch.add_argument("--preprocess", action="store_true", help="Converte l'audio in mono 16 kHz compresso prima dell'invio")
+    batch.add_argument("--workers", type=int, default=8)
+    batch.add_argument("--download-concurrency", type=int, default=4)
+    batch.add_argument("--openai-concurrency", type=int, default=2)
+    batch.add_argument("--assemblyai-concurrency", type=int, default=8)
+    batch.add_argument("--chat-concurrency", type=int, default=4)
+    batch.add_argument("--openai-key")
+    batch.add_argument("--assemblyai-key")
+    batch.add_argument("--email", action="append", help="Invia a questo indirizzo un riepilogo del batch (ripetibile o separato da virgole)")
+    batch.add_argument("--resend-key", help="API Key di Resend (default: RESEND_API_KEY)")
+
+    args = parser.parse_args(argv)
+    if args.command == "batch":
+        return run_batch(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
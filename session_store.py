@@ -0,0 +1,171 @@
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import streamlit as st
+from metrics import span
+from spool import CHUNK_SIZE, SPOOL_TTL_SECONDS, new_spool_path
+
+# Large per-session data (uploaded audio, texts, summaries) lives in files under one
+# directory per browser session; st.session_state only holds the handles. Every session
+# has a disk quota, and sessions nobody has touched for SESSION_TTL_SECONDS are removed,
+# so an idle tab costs neither memory nor, eventually, disk.
+
+SESSION_DIR = os.environ.get("SBOBINATOR_SESSION_DIR", os.path.join(tempfile.gettempdir(), "sbobinator-sessions"))
+SESSION_QUOTA_BYTES = int(os.environ.get("SBOBINATOR_SESSION_QUOTA_MB", "1024")) * 1024 * 1024
+SESSION_TTL_SECONDS = int(os.environ.get("SBOBINATOR_SESSION_TTL_SECONDS", str(SPOOL_TTL_SECONDS)))
+CLEANUP_INTERVAL_SECONDS = 10 * 60
+
+SESSION_ID_KEY = "session_store_id"
+
+class SessionQuotaError(Exception):
+    pass
+
+class SessionStore:
+    def __init__(self, root=SESSION_DIR, quota_bytes=SESSION_QUOTA_BYTES, ttl_seconds=SESSION_TTL_SECONDS):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+        os.makedirs(root, exist_ok=True)
+
+    # The session directory's mtime is the session's last activity
+    def _session_dir(self, session_id):
+        path = os.path.join(self.root, session_id)
+        os.makedirs(path, exist_ok=True)
+        os.utime(path)
+        return path
+
+    def path(self, handle):
+        return os.path.join(self.root, handle)
+
+    def exists(self, handle):
+        return bool(handle) and os.path.exists(self.path(handle))
+
+    def usage(self, session_id):
+        return sum(entry.stat().st_size for entry in os.scandir(self._session_dir(session_id)) if entry.is_file())
+
+    # Make room for size more bytes by removing the session's least recently used blobs.
+    # Handles of removed blobs stop existing, pages check exists() before using one.
+    def _reserve(self, session_id, size):
+        if size > self.quota_bytes:
+            raise SessionQuotaError(f"Il file supera lo spazio disponibile per la sessione ({self.quota_bytes // (1024 * 1024)} MB)")
+        entries = sorted(
+            (entry for entry in os.scandir(self._session_dir(session_id)) if entry.is_file() and not entry.name.endswith(".tmp")),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        used = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if used + size <= self.quota_bytes:
+                break
+            try:
+                used -= entry.stat().st_size
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+    # Write an iterable of byte chunks as a new blob of the session and return its handle
+    def put_chunks(self, session_id, chunks, suffix="", size=None):
+        self.cleanup()
+        blob_name = f"{uuid.uuid4().hex}{suffix}"
+        path = os.path.join(self._session_dir(session_id), blob_name)
+        tmp_path = path + ".tmp"
+        with self._lock:
+            self._reserve(session_id, size or 0)
+        try:
+            with span("session_store") as info, open(tmp_path, "wb") as blob_file:
+                info["bytes_out"] = 0
+                for chunk in chunks:
+                    if chunk:
+                        blob_file.write(chunk)
+                        info["bytes_out"] += len(chunk)
+                        if info["bytes_out"] > self.quota_bytes:
+                            raise SessionQuotaError(f"Il file supera lo spazio disponibile per la sessione ({self.quota_bytes // (1024 * 1024)} MB)")
+            if size is None:
+                with self._lock:
+                    self._reserve(session_id, info["bytes_out"])
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return f"{session_id}/{blob_name}"
+
+    # Copy a file-like object (e.g. a Streamlit upload) into the session in chunks
+    def put_fileobj(self, session_id, fileobj, suffix="", size=None):
+        fileobj.seek(0)
+        return self.put_chunks(session_id, iter(lambda: fileobj.read(CHUNK_SIZE), b""), suffix, size)
+
+    def put_text(self, session_id, text, suffix=".txt"):
+        data = text.encode("utf-8")
+        return self.put_chunks(session_id, [data], suffix, len(data))
+
+    # Blobs are read through a memory map: the pages of the file come from the OS cache
+    # and only the requested range is decoded, so a preview of a long text stays cheap
+    def read_text(self, handle, limit=None):
+        path = self.path(handle)
+        os.utime(path)
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    # A limit can cut a multi-byte character in half, drop it
+                    return str(view[:limit], "utf-8", errors="ignore" if limit else "strict")
+                finally:
+                    view.release()
+
+    # Give a job its own reference to a blob: a hard link in the spool (a copy when the two
+    # directories are on different filesystems), so neither LRU eviction nor the session's
+    # expiry can remove the file while the job is still reading it
+    def to_spool(self, handle):
+        path = self.path(handle)
+        spool_path = new_spool_path(os.path.splitext(path)[1])
+        try:
+            os.link(path, spool_path)
+        except OSError:
+            shutil.copyfile(path, spool_path)
+        # The spool cleanup goes by mtime, the link shares the upload's
+        os.utime(spool_path)
+        return spool_path
+
+    def delete(self, handle):
+        try:
+            os.unlink(self.path(handle))
+        except FileNotFoundError:
+            pass
+
+    # Remove sessions with no activity for ttl_seconds
+    def cleanup(self, force=False):
+        now = time.time()
+        if not force and now - self._last_cleanup < CLEANUP_INTERVAL_SECONDS:
+            return
+        self._last_cleanup = now
+
+        for entry in os.scandir(self.root):
+            try:
+                if entry.is_dir() and now - entry.stat().st_mtime >= self.ttl_seconds:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except FileNotFoundError:
+                pass
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_session_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore()
+        return _store
+
+# ID of the browser session running the page, kept in its session state
+def current_session_id():
+    if SESSION_ID_KEY not in st.session_state:
+        st.session_state[SESSION_ID_KEY] = uuid.uuid4().hex
+    return st.session_state[SESSION_ID_KEY]
@@ -0,0 +1,42 @@
+import threading
+from concurrent.futures import Future
+from metrics import span
+
+# Single-flight coordination: while a computation for a key is running, other callers asking
+# for the same key wait for it and share its result instead of starting their own.
+# Used for downloads, transcodes and transcriptions, so that several sessions submitting the
+# same lecture at once only do the work once.
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    # Returns (result, shared); shared is True when the result came from another caller's run.
+    # A failure is not shared: waiters run fn themselves, since the error may be specific to
+    # the first caller (e.g. an invalid API key).
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            owner = future is None
+            if owner:
+                future = self._calls[key] = Future()
+
+        if not owner:
+            try:
+                with span("singleflight_wait", provider=self.name):
+                    return future.result(), True
+            except Exception:
+                return fn(), False
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from metrics import span
+
+# Audio travels through the app as files in this directory instead of in-memory bytes
+SPOOL_DIR = os.environ.get("SBOBINATOR_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "sbobinator-spool"))
+CHUNK_SIZE = 1024 * 1024
+# Spooled files older than this are considered abandoned and removed
+SPOOL_TTL_SECONDS = 6 * 60 * 60
+CLEANUP_INTERVAL_SECONDS = 10 * 60
+
+_last_cleanup = 0.0
+
+def get_spool_dir():
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    return SPOOL_DIR
+
+# Remove spooled files and directories that outlived SPOOL_TTL_SECONDS
+def cleanup_spool(max_age=SPOOL_TTL_SECONDS, force=False):
+    global _last_cleanup
+    now = time.time()
+    if not force and now - _last_cleanup < CLEANUP_INTERVAL_SECONDS:
+        return
+    _last_cleanup = now
+
+    for entry in os.scandir(get_spool_dir()):
+        try:
+            if now - entry.stat().st_mtime < max_age:
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.unlink(entry.path)
+        except FileNotFoundError:
+            pass
+
+def new_spool_path(suffix=""):
+    cleanup_spool()
+    return os.path.join(get_spool_dir(), f"{uuid.uuid4().hex}{suffix}")
+
+# Tools like yt-dlp and gdown pick their own file names, give them a private directory
+def new_spool_dir():
+    cleanup_spool()
+    return tempfile.mkdtemp(dir=get_spool_dir())
+
+# Write an iterable of byte chunks to a new spool file and return its path
+def spool_chunks(chunks, suffix=""):
+    path = new_spool_path(suffix)
+    try:
+        with span("spool") as info, open(path, "wb") as spool_file:
+            info["bytes_out"] = 0
+            for chunk in chunks:
+                if chunk:
+                    spool_file.write(chunk)
+                    info["bytes_out"] += len(chunk)
+    except BaseException:
+        if os.path.exists(path):
+            os.unlink(path)
+        raise
+    return path
+
+# Copy a file-like object (e.g. a Streamlit upload) to a new spool file in chunks
+def spool_fileobj(fileobj, suffix=""):
+    fileobj.seek(0)
+    return spool_chunks(iter(lambda: fileobj.read(CHUNK_SIZE), b""), suffix)
@@ -0,0 +1,248 @@
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from disk_cache import summary_cache, summary_cache_key
+from metrics import span
+from ratelimit import PROVIDER_OPENAI_CHAT, scheduler, submit_in_context
+
+# Context windows of the chat models offered in the app, unknown models get the smallest one
+MODEL_CONTEXT_TOKENS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo-preview": 128000,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+# Smaller chunks mean more map calls running in parallel and less detail lost per call
+DEFAULT_CHUNK_TOKENS = 3000
+# Room left in the context for the system message and the prompt around the text
+PROMPT_OVERHEAD_TOKENS = 500
+MAX_WORKERS = int(os.environ.get("SBOBINATOR_SUMMARY_WORKERS", "4"))
+MAX_RETRIES = 6
+
+_encodings = {}
+
+# tiktoken is used when available, otherwise fall back to the usual ~4 characters per token.
+# tiktoken fetches its encoding files on first use, so an offline host also takes the fallback
+def _get_encoding(model):
+    if model not in _encodings:
+        try:
+            import tiktoken
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encodings[model] = None
+    return _encodings[model]
+
+def count_tokens(text, model):
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+# Cut a single oversized piece into slices of at most max_tokens tokens
+def _split_by_tokens(text, max_tokens, model):
+    encoding = _get_encoding(model)
+    if encoding is None:
+        step = max_tokens * 4
+        return [text[i:i + step] for i in range(0, len(text), step)]
+    tokens = encoding.encode(text, disallowed_special=())
+    return [encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+
+# A paragraph as it is packed into chunks: whole if it fits, otherwise by sentence
+def _paragraph_pieces(paragraph, max_tokens, model):
+    if count_tokens(paragraph, model) <= max_tokens:
+        return [paragraph.strip()]
+    return _sentence_pieces(re.split(r"(?<=[.!?])\s+", paragraph), max_tokens, model)
+
+def _sentence_pieces(sentences, max_tokens, model):
+    pieces = []
+    for sentence in sentences:
+        if count_tokens(sentence, model) <= max_tokens:
+            pieces.append(sentence)
+        else:
+            pieces.extend(_split_by_tokens(sentence, max_tokens, model))
+    return pieces
+
+def _pack(pieces, max_tokens, model):
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece in pieces:
+        piece_tokens = count_tokens(piece, model)
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current = []
+            current_tokens = 0
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+# Pack paragraphs and sentences greedily into chunks of at most max_tokens tokens
+def chunk_by_tokens(text, max_tokens, model):
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        if paragraph.strip():
+            pieces.extend(_paragraph_pieces(paragraph, max_tokens, model))
+    return _pack(pieces, max_tokens, model)
+
+# The chunks of a text that is still growing which chunk_by_tokens() will return unchanged
+# however the text continues. The last paragraph may be incomplete: only its finished
+# sentences count, and only once it is already too long to be a single piece. Of the
+# chunks packed from what is left, the last one could still take more pieces.
+def stable_chunks(text, max_tokens, model):
+    paragraphs = re.split(r"\n\s*\n", text)
+    pieces = []
+    for paragraph in paragraphs[:-1]:
+        if paragraph.strip():
+            pieces.extend(_paragraph_pieces(paragraph, max_tokens, model))
+    tail = paragraphs[-1]
+    if count_tokens(tail, model) > max_tokens:
+        pieces.extend(_sentence_pieces(re.split(r"(?<=[.!?])\s+", tail)[:-1], max_tokens, model))
+    return _pack(pieces, max_tokens, model)[:-1]
+
+def chunk_budget(model, max_tokens, chunk_tokens=None):
+    context = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+    fit = context - max_tokens - PROMPT_OVERHEAD_TOKENS
+    return min(chunk_tokens or DEFAULT_CHUNK_TOKENS, fit)
+
+# With on_token the completion is streamed and on_token(text) is called for every delta.
+# Results are memoized on disk by input, prompt and model; a cached result is passed to
+# on_token in one piece.
+def summarize_chunk(client, chunk, model, prompt, system_prompt, max_tokens, on_token=None):
+    cache_key = summary_cache_key(chunk, model, prompt, system_prompt, max_tokens)
+    cached = summary_cache.get(cache_key)
+    if cached is not None:
+        if on_token is not None:
+            on_token(cached)
+        return cached
+
+    # Already imported by the client, importing it here keeps this module light
+    import openai
+    retryable_errors = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt.replace("{text}", chunk)}
+    ]
+    # Reserve prompt and completion tokens up front, the tokens-per-minute limit counts both
+    tokens = count_tokens(system_prompt, model) + count_tokens(messages[1]["content"], model) + max_tokens
+    for attempt in range(MAX_RETRIES + 1):
+        streamed = False
+        scheduler.acquire(PROVIDER_OPENAI_CHAT, client.api_key, tokens)
+        try:
+            with span("chat_completion", provider="openai", model=model, tokens_in=tokens - max_tokens) as info:
+                if on_token is None:
+                    response = client.chat.completions.create(model=model, messages=messages, max_tokens=max_tokens)
+                    if response.usage:
+                        info["tokens_in"] = response.usage.prompt_tokens
+                        info["tokens_out"] = response.usage.completion_tokens
+                    text = response.choices[0].message.content.strip()
+                else:
+                    # Build the text from a list of deltas, not by repeated concatenation
+                    parts = []
+                    for event in client.chat.completions.create(model=model, messages=messages, max_tokens=max_tokens, stream=True):
+                        delta = event.choices[0].delta.content if event.choices else None
+                        if delta:
+                            streamed = True
+                            parts.append(delta)
+                            on_token(delta)
+                    text = "".join(parts).strip()
+                    # Streamed responses carry no usage, count the completion ourselves
+                    info["tokens_out"] = count_tokens(text, model)
+            scheduler.report_success(PROVIDER_OPENAI_CHAT, client.api_key)
+            summary_cache.set(cache_key, text)
+            return text
+        except retryable_errors as e:
+            # Once tokens have been shown, a retry would repeat them
+            if attempt == MAX_RETRIES or streamed:
+                raise
+            # A 429 pauses every caller on this key, other errors only this one
+            time.sleep(scheduler.report_failure(PROVIDER_OPENAI_CHAT, client.api_key, attempt, getattr(e, "response", None)))
+
+def _summarize_all(client, chunks, model, prompt, system_prompt, max_tokens, max_workers):
+    if len(chunks) == 1:
+        return [summarize_chunk(client, chunks[0], model, prompt, system_prompt, max_tokens)]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        futures = [
+            submit_in_context(executor, summarize_chunk, client, chunk, model, prompt, system_prompt, max_tokens)
+            for chunk in chunks
+        ]
+        return [future.result() for future in futures]
+
+# Map-reduce summary: summarize token-bounded chunks concurrently, then reduce the
+# partial summaries as a tree until they fit in a single final call.
+# Prompts are templates with a {text} placeholder. A text that fits in one chunk gets a
+# single call with prompt; longer texts use map_prompt (default: prompt) for the chunks.
+# map_model (default: model) makes the chunk and intermediate calls, model the final one.
+# Every call is memoized (see summarize_chunk), so changing only the final model, or
+# appending text, redoes the final call and the chunks that changed.
+# Only the final call is streamed to on_token.
+def summarize_text(client, text, model, prompt, system_prompt, max_tokens=1000, reduce_prompt=None,
+                   max_workers=MAX_WORKERS, chunk_tokens=None, on_token=None, map_model=None, map_prompt=None):
+    reduce_prompt = reduce_prompt or prompt
+    map_model = map_model or model
+    map_prompt = map_prompt or prompt
+    # Chunks have to fit both models
+    budget = min(chunk_budget(model, max_tokens, chunk_tokens), chunk_budget(map_model, max_tokens, chunk_tokens))
+    with span("summarize", provider="openai", model=model, bytes_in=len(text.encode("utf-8"))) as info:
+        chunks = chunk_by_tokens(text, budget, model)
+        info["chunks"] = len(chunks)
+        if not chunks:
+            return ""
+        if len(chunks) == 1:
+            return summarize_chunk(client, chunks[0], model, prompt, system_prompt, max_tokens, on_token)
+
+        summaries = _summarize_all(client, chunks, map_model, map_prompt, system_prompt, max_tokens, max_workers)
+        while True:
+            groups = chunk_by_tokens("\n\n".join(summaries), budget, model)
+            if len(groups) == 1 or len(groups) >= len(summaries):
+                break
+            summaries = _summarize_all(client, groups, map_model, reduce_prompt, system_prompt, max_tokens, max_workers)
+
+        return summarize_chunk(client, "\n\n".join(summaries), model, reduce_prompt, system_prompt, max_tokens, on_token)
+
+# Starts the chunk calls of summarize_text() while the text is still being produced: every
+# update() sends the chunks that can no longer change, and since each call is memoized the
+# final summarize_text() on the complete text finds them already done. Takes the same
+# arguments as summarize_text(); a chunk call that fails is simply made again by it.
+class EarlySummarizer:
+    def __init__(self, client, model, prompt, system_prompt, max_tokens=1000, reduce_prompt=None,
+                 max_workers=MAX_WORKERS, chunk_tokens=None, map_model=None, map_prompt=None):
+        self.client = client
+        self.model = model
+        self.map_model = map_model or model
+        self.map_prompt = map_prompt or prompt
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.budget = min(chunk_budget(model, max_tokens, chunk_tokens), chunk_budget(self.map_model, max_tokens, chunk_tokens))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sbobinator-early-summary")
+        self._futures = []
+        self._sent = 0
+
+    def update(self, text):
+        # Stable chunks only ever grow at the end, the first ones were already sent
+        chunks = stable_chunks(text, self.budget, self.model)
+        for chunk in chunks[self._sent:]:
+            self._futures.append(submit_in_context(
+                self._executor,
+                summarize_chunk, self.client, chunk, self.map_model, self.map_prompt, self.system_prompt, self.max_tokens
+            ))
+        self._sent = max(self._sent, len(chunks))
+
+    # Wait for the calls in flight, so summarize_text() doesn't make them a second time
+    def wait(self):
+        with span("early_summary", provider="openai", model=self.map_model, chunks=len(self._futures)):
+            for future in self._futures:
+                try:
+                    future.result()
+                except Exception:
+                    pass
+        self._executor.shutdown()
+
+    # Drop the calls not started yet and let the threads go, e.g. when the job failed first
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
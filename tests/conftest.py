@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# The app is a set of top-level modules that read their directories from the environment
+# at import time: point them at a throwaway directory before any test imports them.
+_root = tempfile.mkdtemp(prefix="sbobinator-tests-")
+os.environ.setdefault("SBOBINATOR_CACHE_DIR", os.path.join(_root, "cache"))
+os.environ.setdefault("SBOBINATOR_SPOOL_DIR", os.path.join(_root, "spool"))
+os.environ.setdefault("SBOBINATOR_SESSION_DIR", os.path.join(_root, "sessions"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,77 @@
+import os
+import sqlite3
+import pytest
+from archive import FIELD_SUMMARY, FIELD_TRANSCRIPT, Archive, fts_query
+from transcripts import Transcript
+
+@pytest.mark.parametrize("text, expected", [
+    ("lezione", '"lezione"*'),
+    ("storia romana", '"storia"* "romana"*'),
+    ('"impero romano" augusto', '"impero romano" "augusto"*'),
+    # FTS5 operators and syntax typed by the user are searched as plain words
+    ("cesare AND NOT bruto", '"cesare"* "AND"* "NOT"* "bruto"*'),
+    ("NEAR(a b)", '"NEAR"* "a"* "b"*'),
+    ("col:valore^2", '"col"* "valore"* "2"*'),
+    ("pre-romano", '"pre"* "romano"*'),
+    ('l\'"impero', '"l"* "impero"*'),
+    ("città perché", '"città"* "perché"*'),
+    ("", ""),
+    ('"" * - ()', ""),
+])
+def test_fts_query_quotes_every_term(text, expected):
+    assert fts_query(text) == expected
+
+@pytest.fixture
+def archive(tmp_path):
+    return Archive(os.path.join(tmp_path, "archive.sqlite3"))
+
+def test_search_finds_prefixes_phrases_and_timestamps(archive):
+    transcript = Transcript(engine="openai", language="it")
+    transcript.add_segment(0.0, 4.0, "Oggi parliamo dell'impero romano.")
+    transcript.add_segment(4.0, 9.5, "Le lezioni successive riguardano il medioevo.")
+    document_id = archive.add_transcript(transcript, summary="Riassunto sull'impero.", title="Storia", job_id="job-1")
+
+    hits = archive.search("lezion")
+    assert [(hit["document_id"], hit["field"], hit["start"]) for hit in hits] == [(document_id, FIELD_TRANSCRIPT, 4.0)]
+    assert "**lezioni**" in hits[0]["snippet"]
+
+    assert {hit["field"] for hit in archive.search('"impero romano"')} == {FIELD_TRANSCRIPT}
+    assert {hit["field"] for hit in archive.search("impero")} == {FIELD_TRANSCRIPT, FIELD_SUMMARY}
+    assert [hit["field"] for hit in archive.search("impero", field=FIELD_SUMMARY)] == [FIELD_SUMMARY]
+
+    # The same job is only archived once
+    assert archive.add_transcript(transcript, job_id="job-1") == document_id
+    assert archive.stats()["documents"] == 1
+
+@pytest.mark.parametrize("query", ['"', "AND", "OR NOT", "a*b", "(", "^", "NEAR(", '"impero', ":", "-"])
+def test_search_never_fails_on_user_input(archive, query):
+    archive.add_text("L'impero romano e le sue province.", title="Appunti")
+    assert isinstance(archive.search(query), list)
+
+def test_summarizing_a_text_again_replaces_its_document(archive):
+    text = "Appunti sulla rivoluzione francese."
+    document_id = archive.add_text(text, summary="Primo riassunto.", title="appunti.txt")
+    assert archive.add_text(text, summary="Secondo riassunto.", title="appunti.txt") == document_id
+
+    assert archive.stats()["documents"] == 1
+    assert archive.search("primo") == []
+    assert [hit["field"] for hit in archive.search("secondo")] == [FIELD_SUMMARY]
+    assert [hit["field"] for hit in archive.search("rivoluzione")] == [FIELD_TRANSCRIPT]
+
+    # Other content is a new document
+    assert archive.add_text("Altri appunti.", summary="Terzo.") != document_id
+    assert archive.stats()["documents"] == 2
+
+def test_archives_without_content_keys_are_upgraded(tmp_path):
+    path = os.path.join(tmp_path, "old.sqlite3")
+    Archive(path).add_text("Testo.", summary="Riassunto.")
+    conn = sqlite3.connect(path)
+    conn.execute("DROP INDEX documents_content_key")
+    conn.execute("ALTER TABLE documents DROP COLUMN content_key")
+    conn.close()
+
+    archive = Archive(path)
+    archive.add_text("Testo.", summary="Riassunto.")
+    archive.add_text("Testo.", summary="Riassunto.")
+    # The row from before the upgrade has no key, the new one is added once
+    assert archive.stats()["documents"] == 2
@@ -0,0 +1,38 @@
+from diarization import merge_transcript
+
+def whisper_result(segments):
+    result = {"segments": [], "words": []}
+    for start, end, text in segments:
+        result["segments"].append({"start": start, "end": end, "text": f" {text}", "confidence": 0.8})
+        words = text.split()
+        step = (end - start) / len(words)
+        for i, word in enumerate(words):
+            result["words"].append({"start": start + i * step, "end": start + (i + 1) * step, "text": word.strip(",.?!")})
+    return result
+
+def test_segments_keep_their_punctuation_and_join_per_speaker():
+    result = whisper_result([
+        (0.0, 2.0, "Buongiorno a tutti."),
+        (2.0, 4.0, "Oggi parliamo di reti, anzi di grafi."),
+        (4.5, 6.0, "Posso fare una domanda?"),
+    ])
+    turns = [(0.0, 4.2, 0), (4.2, 6.0, 1)]
+
+    transcript = merge_transcript(result, turns, "openai-diarized", "it")
+    assert [(s.speaker, s.start, s.end, s.text) for s in transcript.segments] == [
+        ("A", 0.0, 4.0, "Buongiorno a tutti. Oggi parliamo di reti, anzi di grafi."),
+        ("B", 4.5, 6.0, "Posso fare una domanda?"),
+    ]
+    assert [w.text for w in transcript.segments[1].words] == ["Posso", "fare", "una", "domanda"]
+
+def test_a_segment_goes_to_the_speaker_of_most_of_its_words():
+    result = whisper_result([(0.0, 4.0, "uno due tre quattro")])
+    # The turn boundary falls inside the last word
+    turns = [(0.0, 3.5, 0), (3.5, 6.0, 1)]
+    transcript = merge_transcript(result, turns, "openai-diarized")
+    assert [(s.speaker, s.text) for s in transcript.segments] == [("A", "uno due tre quattro")]
+
+def test_words_without_segments_are_grouped_per_speaker():
+    words = [{"start": i, "end": i + 0.5, "text": f"p{i}"} for i in range(4)]
+    transcript = merge_transcript({"words": words}, [(0.0, 2.0, 0), (2.0, 4.0, 1)], "local-diarized")
+    assert [(s.speaker, s.text) for s in transcript.segments] == [("A", "p0 p1"), ("B", "p2 p3")]
@@ -0,0 +1,149 @@
+import base64
+import hashlib
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from downloads import DownloadError, DownloadManager, GrowingFile
+
+SEGMENT_SIZE = 64 * 1024
+
+def md5_header(data):
+    return base64.b64encode(hashlib.md5(data).digest()).decode("ascii")
+
+# A file server with the behaviours the download manager has to cope with
+class FileServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, data):
+        super().__init__(("127.0.0.1", 0), _FileHandler)
+        self.data = data
+        self.ranges = True
+        # Range start -> status code returned instead of the bytes
+        self.failing = {}
+        # Range starts whose next response carries zeroed bytes
+        self.corrupt = set()
+        self.bad_md5 = False
+        self.requests = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def url(self, name="audio.mp3"):
+        return f"http://127.0.0.1:{self.server_port}/{name}"
+
+class _FileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        data = server.data
+        match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if not server.ranges or not match:
+            server.requests.append(None)
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/mpeg")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Content-MD5", md5_header(b"x" if server.bad_md5 else data))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        start, end = int(match.group(1)), min(int(match.group(2)), len(data) - 1)
+        server.requests.append(start)
+        if start in server.failing:
+            self.send_response(server.failing[start])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = data[start:end + 1]
+        checksum = md5_header(body)
+        if start in server.corrupt:
+            server.corrupt.discard(start)
+            body = bytes(len(body))
+        self.send_response(206)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-MD5", checksum)
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+@pytest.fixture
+def data():
+    return os.urandom(5 * SEGMENT_SIZE + 1234)
+
+@pytest.fixture
+def server(data):
+    server = FileServer(data)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def manager():
+    manager = DownloadManager(segment_size=SEGMENT_SIZE, max_workers=3)
+    yield manager
+    manager.executor.shutdown()
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_ranged_download_in_parallel_segments(server, manager, data):
+    path, file_name, content_type = manager.download(server.url())
+    assert read(path) == data
+    assert (file_name, content_type) == ("audio.mp3", "audio/mpeg")
+    assert sorted(server.requests) == list(range(0, len(data), SEGMENT_SIZE))
+
+def test_server_without_ranges_sends_the_whole_body(server, manager, data):
+    server.ranges = False
+    path, _, _ = manager.download(server.url())
+    assert read(path) == data
+    assert server.requests == [None]
+
+def test_whole_body_checksum_mismatch_is_an_error(server, manager):
+    server.ranges = False
+    server.bad_md5 = True
+    with pytest.raises(DownloadError):
+        manager.download(server.url())
+
+def test_corrupt_segment_is_fetched_again(server, manager, data):
+    server.corrupt = {SEGMENT_SIZE * 2, SEGMENT_SIZE * 4}
+    path, _, _ = manager.download(server.url())
+    assert read(path) == data
+    assert server.requests.count(SEGMENT_SIZE * 2) == 2
+
+def test_failed_download_resumes_where_it_stopped(server, manager, data):
+    server.failing = {SEGMENT_SIZE * 3: 404}
+    with pytest.raises(requests.HTTPError):
+        manager.download(server.url())
+
+    server.failing = {}
+    server.requests.clear()
+    path, _, _ = manager.download(server.url())
+    assert read(path) == data
+    # The metadata request, then only the segments that were not on disk yet
+    assert server.requests[0] == 0
+    assert SEGMENT_SIZE * 3 in server.requests
+    assert len(server.requests) < len(range(0, len(data), SEGMENT_SIZE)) + 1
+
+def test_growing_file_follows_the_download(server, manager, data):
+    progress = GrowingFile()
+    received = []
+    reader = threading.Thread(target=lambda: received.extend(progress.chunks()))
+    reader.start()
+    path, _, _ = manager.download(server.url(), progress)
+    progress.finish(path)
+    reader.join(timeout=10)
+    assert b"".join(received) == data
+
+def test_growing_file_reports_download_errors():
+    progress = GrowingFile()
+    progress.fail(DownloadError("interrotto"))
+    with pytest.raises(DownloadError):
+        list(progress.chunks())
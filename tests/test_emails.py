@@ -0,0 +1,22 @@
+from concurrent.futures import Future
+import pytest
+from emails import EmailError, EmailQueue
+
+def test_short_batch_responses_fail_the_unanswered_messages():
+    futures = [Future() for _ in range(3)]
+    EmailQueue._resolve(futures, lambda: [{"id": "a"}, {"id": "b"}])
+
+    assert [future.result(timeout=0) for future in futures[:2]] == [{"id": "a"}, {"id": "b"}]
+    with pytest.raises(EmailError):
+        futures[2].result(timeout=0)
+
+def test_failed_sends_fail_every_message():
+    futures = [Future() for _ in range(2)]
+
+    def send():
+        raise EmailError("rifiutato")
+
+    EmailQueue._resolve(futures, send)
+    for future in futures:
+        with pytest.raises(EmailError):
+            future.result(timeout=0)
@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from ratelimit import PRIORITY_BATCH, PRIORITY_INTERACTIVE, Scheduler, TokenBucket, scheduler, submit_in_context
+
+def test_token_bucket_starts_full_and_refills_at_its_rate():
+    bucket = TokenBucket(60)
+    now = bucket.updated_at
+    assert bucket.wait_time(60, now) == 0
+    bucket.take(60)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    # Half a minute later half of the bucket is back
+    assert bucket.wait_time(30, now + 30) == 0
+    assert bucket.wait_time(31, now + 30) == pytest.approx(1.0)
+
+def test_token_bucket_never_holds_more_than_its_capacity():
+    bucket = TokenBucket(60)
+    now = bucket.updated_at
+    bucket.take(10)
+    assert bucket.wait_time(60, now + 3600) == 0
+    assert bucket.available == 60
+
+def test_requests_larger_than_the_bucket_wait_for_a_full_bucket():
+    bucket = TokenBucket(60)
+    now = bucket.updated_at
+    assert bucket.wait_time(1000, now) == 0
+    bucket.take(1000)
+    assert bucket.available == 0
+    assert bucket.wait_time(1000, now) == pytest.approx(60.0)
+
+def test_waiting_callers_are_served_by_priority():
+    limiter = Scheduler({"test": {"rpm": 600}})
+    # Drain the bucket, every further request waits 0.1 s for the next token
+    for _ in range(600):
+        limiter.acquire("test", "key")
+    order = []
+
+    def call(priority, name):
+        limiter.acquire("test", "key", priority=priority)
+        order.append(name)
+
+    threads = [threading.Thread(target=call, args=(PRIORITY_BATCH, f"batch{i}")) for i in range(3)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.01)
+    interactive = threading.Thread(target=call, args=(PRIORITY_INTERACTIVE, "interactive"))
+    interactive.start()
+    for thread in threads + [interactive]:
+        thread.join()
+    # The first batch call was already at the head of the queue, the interactive one goes next
+    assert order.index("interactive") <= 1
+
+def test_rate_limited_key_is_paused():
+    limiter = Scheduler({})
+    limiter.report_rate_limited("test", "key", retry_after=0.2)
+    started = time.monotonic()
+    limiter.acquire("test", "key")
+    assert time.monotonic() - started >= 0.19
+    # Other keys are not affected
+    started = time.monotonic()
+    limiter.acquire("test", "other")
+    assert time.monotonic() - started < 0.1
+
+def test_priority_follows_work_submitted_in_context():
+    with ThreadPoolExecutor(max_workers=1) as executor, scheduler.priority(PRIORITY_BATCH):
+        assert submit_in_context(executor, scheduler.current_priority).result() == PRIORITY_BATCH
+        assert executor.submit(scheduler.current_priority).result() == PRIORITY_INTERACTIVE
+    assert scheduler.current_priority() == PRIORITY_INTERACTIVE
+
+def test_coroutines_wait_in_the_same_queue_as_threads():
+    limiter = Scheduler({"test": {"rpm": 600}})
+    for _ in range(600):
+        limiter.acquire("test", "key")
+    order = []
+
+    def call(name):
+        limiter.acquire("test", "key", priority=PRIORITY_BATCH)
+        order.append(name)
+
+    async def main():
+        batch = threading.Thread(target=call, args=("thread",))
+        batch.start()
+        await asyncio.sleep(0.01)
+        await limiter.acquire_async("test", "key", priority=PRIORITY_INTERACTIVE)
+        order.append("coroutine")
+        await limiter.acquire_async("test", "key", priority=PRIORITY_BATCH)
+        order.append("coroutine")
+        await asyncio.to_thread(batch.join)
+
+    started = time.monotonic()
+    asyncio.run(main())
+    # One token every 0.1 s: the interactive coroutine goes before the waiting thread,
+    # the batch one queues behind it
+    assert order == ["coroutine", "thread", "coroutine"]
+    assert time.monotonic() - started >= 0.29
+
+def test_cancelled_coroutines_leave_the_queue():
+    limiter = Scheduler({"test": {"rpm": 60}})
+    limiter.acquire("test", "key")
+    limiter.report_rate_limited("test", "key", retry_after=0.1)
+
+    async def main():
+        waiter = asyncio.create_task(limiter.acquire_async("test", "key"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(main())
+    assert limiter._queue("test", "key").waiters == []
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+def test_failures_pause_the_key_only_for_rate_limits():
+    limiter = Scheduler({})
+    # A server error delays the caller that got it, honouring Retry-After
+    assert limiter.report_failure("test", "key", 0, FakeResponse(503, {"retry-after": "2"})) == 2.0
+    assert 0.5 <= limiter.report_failure("test", "key", 0) <= 1.0
+    assert limiter._queue("test", "key").paused_until == 0.0
+    # A 429 pauses the key for everyone and the caller just acquires again
+    assert limiter.report_failure("test", "key", 0, FakeResponse(429, {"retry-after": "0.2"})) == 0.0
+    started = time.monotonic()
+    limiter.acquire("test", "key")
+    assert time.monotonic() - started >= 0.19
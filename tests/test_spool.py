@@ -0,0 +1,64 @@
+import io
+import os
+import time
+import pytest
+import spool
+from session_store import SessionStore
+from spool import cleanup_spool, get_spool_dir, new_spool_dir, spool_chunks, spool_fileobj
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_chunks_are_written_to_a_new_spool_file():
+    path = spool_chunks(iter([b"abc", b"", b"def"]), ".mp3")
+    assert os.path.dirname(path) == get_spool_dir()
+    assert path.endswith(".mp3")
+    assert read(path) == b"abcdef"
+    assert spool_chunks([b"x"], ".mp3") != path
+
+def test_failed_write_leaves_no_partial_file():
+    before = set(os.listdir(get_spool_dir()))
+
+    def broken():
+        yield b"abc"
+        raise ConnectionError("interrotto")
+
+    with pytest.raises(ConnectionError):
+        spool_chunks(broken(), ".part-test")
+    assert set(os.listdir(get_spool_dir())) == before
+
+def test_file_objects_are_copied_from_the_start():
+    upload = io.BytesIO(b"0123456789" * 1000)
+    upload.read(5)
+    assert read(spool_fileobj(upload, ".wav")) == b"0123456789" * 1000
+
+def test_cleanup_removes_only_expired_files_and_directories(monkeypatch, tmp_path):
+    monkeypatch.setattr(spool, "SPOOL_DIR", str(tmp_path))
+    old_file = spool_chunks([b"old"])
+    old_dir = new_spool_dir()
+    with open(os.path.join(old_dir, "audio.webm"), "wb") as f:
+        f.write(b"old")
+    new_file = spool_chunks([b"new"])
+    expired = time.time() - 3600
+    for path in (old_file, old_dir):
+        os.utime(path, (expired, expired))
+
+    cleanup_spool(max_age=60, force=True)
+    assert not os.path.exists(old_file)
+    assert not os.path.exists(old_dir)
+    assert read(new_file) == b"new"
+
+def test_jobs_keep_their_copy_of_an_evicted_upload(tmp_path):
+    store = SessionStore(root=str(tmp_path / "sessions"), quota_bytes=3000)
+    handle = store.put_fileobj("session", io.BytesIO(b"a" * 2000), ".wav", size=2000)
+    expired = time.time() - 3600
+    os.utime(store.path(handle), (expired, expired))
+
+    job_path = store.to_spool(handle)
+    # The job's file is fresh for the spool cleanup, whatever the age of the upload
+    assert time.time() - os.path.getmtime(job_path) < 60
+    # Making room for a new blob evicts the upload from the session, not from the job
+    store.put_text("session", "b" * 2000)
+    assert not store.exists(handle)
+    assert read(job_path) == b"a" * 2000
@@ -0,0 +1,83 @@
+import random
+import pytest
+import summarization
+from summarization import EarlySummarizer, chunk_by_tokens, count_tokens, stable_chunks, summarize_text
+
+MODEL = "gpt-3.5-turbo"
+
+@pytest.fixture(autouse=True)
+def offline_token_counts(monkeypatch):
+    # The ~4 characters per token fallback: deterministic and never downloads encodings
+    monkeypatch.setattr(summarization, "_get_encoding", lambda model: None)
+
+def growing_text(seed=0, paragraphs=12):
+    rng = random.Random(seed)
+    words = ["lezione", "storia", "impero", "romano", "provincia", "senato", "console", "guerra"]
+    text = []
+    for _ in range(paragraphs):
+        sentences = [
+            " ".join(rng.choice(words) for _ in range(rng.randint(3, 25))).capitalize() + "."
+            for _ in range(rng.randint(1, 8))
+        ]
+        text.append(" ".join(sentences))
+    return "\n\n".join(text)
+
+def test_chunks_respect_the_budget():
+    text = growing_text()
+    chunks = chunk_by_tokens(text, 60, MODEL)
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk, MODEL) <= 60 + 1 for chunk in chunks)
+    assert " ".join(" ".join(chunks).split()) == " ".join(text.split())
+
+def test_long_texts_are_mapped_then_reduced(monkeypatch):
+    calls = []
+
+    def fake_summarize_chunk(client, chunk, model, prompt, system_prompt, max_tokens, on_token=None):
+        calls.append((prompt, on_token is not None))
+        return "sintesi breve"
+
+    monkeypatch.setattr(summarization, "summarize_chunk", fake_summarize_chunk)
+    text = growing_text()
+    summary = summarize_text(None, text, MODEL, "finale {text}", "sistema", max_tokens=100,
+                             chunk_tokens=60, map_prompt="parte {text}", on_token=lambda token: None)
+    chunks = chunk_by_tokens(text, 60, MODEL)
+    assert summary == "sintesi breve"
+    assert calls[:len(chunks)] == [("parte {text}", False)] * len(chunks)
+    # Partial summaries that don't fit one call are reduced in rounds, only the final call streams
+    assert calls[len(chunks):-1] == [("finale {text}", False)] * (len(calls) - len(chunks) - 1)
+    assert calls[-1] == ("finale {text}", True)
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("max_tokens", [20, 60, 200])
+def test_stable_chunks_never_change_as_the_text_grows(seed, max_tokens):
+    text = growing_text(seed)
+    final = chunk_by_tokens(text, max_tokens, MODEL)
+    sent = []
+    # Feed the text the way a transcription does, a few words at a time
+    for end in range(0, len(text) + 1, 37):
+        stable = stable_chunks(text[:end], max_tokens, MODEL)
+        assert stable[:len(sent)] == sent
+        assert final[:len(stable)] == stable
+        sent = stable
+    # Once a new paragraph starts, everything but the last chunk is settled
+    assert stable_chunks(text + "\n\nAltro", max_tokens, MODEL) == final[:-1]
+
+def test_early_summarizer_sends_the_chunks_summarize_text_will_use(monkeypatch):
+    calls = []
+
+    # summarize_chunk is memoized in the summary cache: a chunk sent early is a cache hit later
+    def fake_summarize_chunk(client, chunk, model, prompt, system_prompt, max_tokens, on_token=None):
+        calls.append(chunk)
+        return "sintesi"
+
+    monkeypatch.setattr(summarization, "summarize_chunk", fake_summarize_chunk)
+    text = growing_text(3)
+    early = EarlySummarizer(None, MODEL, "{text}", "sistema", max_tokens=100, chunk_tokens=60, max_workers=1)
+    for end in list(range(0, len(text), 200)) + [len(text)]:
+        early.update(text[:end])
+    early.wait()
+
+    chunks = chunk_by_tokens(text, 60, MODEL)
+    assert calls == stable_chunks(text, 60, MODEL)
+    assert calls == chunks[:len(calls)]
+    assert 0 < len(calls) < len(chunks)
@@ -0,0 +1,41 @@
+import wave
+import numpy as np
+from transcription import LEVEL_STEP_MS, audio_levels, split_audio
+
+LOUD = 3000.0 ** 2
+QUIET = 30.0 ** 2
+
+# Power every LEVEL_STEP_MS for (milliseconds, power) stretches
+def levels(*stretches):
+    return np.concatenate([np.full(ms // LEVEL_STEP_MS, power) for ms, power in stretches])
+
+def test_cuts_fall_in_the_middle_of_the_last_pause():
+    recording = levels((40000, LOUD), (1000, QUIET), (15000, LOUD), (800, QUIET), (20000, LOUD))
+    duration_ms = len(recording) * LEVEL_STEP_MS
+
+    bounds = split_audio(recording, duration_ms, 60000)
+    # The pause at 56 s is the last one before the 60 s limit
+    assert bounds == [(0, 56400), (56400, duration_ms)]
+
+def test_without_pauses_the_cut_is_at_the_limit():
+    recording = levels((150000, LOUD))
+    assert split_audio(recording, 150000, 60000) == [(0, 60000), (60000, 120000), (120000, 150000)]
+
+def test_short_blips_do_not_count_as_pauses():
+    recording = levels((50000, LOUD), (300, QUIET), (20000, LOUD))
+    assert split_audio(recording, 70300, 60000) == [(0, 60000), (60000, 70300)]
+
+def test_levels_are_measured_on_the_file(tmp_path):
+    path = str(tmp_path / "audio.wav")
+    samples = np.concatenate([np.full(16000, 1000, dtype=np.int16), np.zeros(8000, dtype=np.int16)])
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(samples.tobytes())
+
+    recording, duration_ms = audio_levels(path)
+    assert duration_ms == 1500
+    assert len(recording) == 150
+    assert np.allclose(recording[:95], 1000.0 ** 2, rtol=0.01)
+    assert np.all(recording[105:] == 0)
@@ -0,0 +1,90 @@
+import json
+import math
+from transcripts import Transcript, from_whisper
+
+def sample_transcript():
+    transcript = Transcript(id="t1", engine="assemblyai", language="it")
+    transcript.add_segment(0.0, 2.5, "Buongiorno a tutti.", "A", 0.9, [
+        {"start": 0.0, "end": 1.0, "text": "Buongiorno", "confidence": 0.95},
+        {"start": 1.1, "end": 1.5, "text": "a"},
+        {"start": 1.6, "end": 2.5, "text": "tutti."},
+    ])
+    transcript.add_segment(3.0, 4.25, "Iniziamo.", "B")
+    return transcript
+
+def test_columns_round_trip_keeps_segments_words_and_speakers():
+    original = sample_transcript()
+    # The columns go through JSON in the transcript cache and in job results
+    restored = Transcript.from_dict(json.loads(json.dumps(original.to_columns())))
+
+    assert (restored.id, restored.engine, restored.language) == ("t1", "assemblyai", "it")
+    assert restored.speakers == ["A", "B"]
+    assert [(s.start, s.end, s.speaker, s.text) for s in restored.segments] == [
+        (0.0, 2.5, "A", "Buongiorno a tutti."),
+        (3.0, 4.25, "B", "Iniziamo."),
+    ]
+    assert math.isclose(restored.segments[0].confidence, 0.9, rel_tol=1e-6)
+    assert restored.segments[1].confidence is None
+    assert [w.text for w in restored.segments[0].words] == ["Buongiorno", "a", "tutti."]
+    assert restored.segments[1].words == []
+    assert restored.text == original.text
+    assert restored.to_srt() == original.to_srt()
+    assert restored.to_vtt() == original.to_vtt()
+
+def test_srt_and_vtt():
+    transcript = sample_transcript()
+    assert transcript.to_srt() == (
+        "1\n00:00:00,000 --> 00:00:02,500\nSpeaker A: Buongiorno a tutti.\n\n"
+        "2\n00:00:03,000 --> 00:00:04,250\nSpeaker B: Iniziamo.\n"
+    )
+    assert transcript.to_vtt() == (
+        "WEBVTT\n\n"
+        "00:00:00.000 --> 00:00:02.500\n<v Speaker A>Buongiorno a tutti.\n\n"
+        "00:00:03.000 --> 00:00:04.250\n<v Speaker B>Iniziamo.\n"
+    )
+
+def test_long_segments_are_split_into_cues_on_words():
+    words = [{"start": i * 1.0, "end": i * 1.0 + 0.8, "text": f"parola{i}"} for i in range(20)]
+    transcript = from_whisper(
+        {"segments": [{"start": 0.0, "end": 20.0, "text": " ".join(w["text"] for w in words)}], "words": words},
+        "openai"
+    )
+    srt = transcript.to_srt()
+    cues = [block for block in srt.split("\n\n") if block]
+    assert len(cues) > 1
+    assert cues[0].splitlines()[1] == "00:00:00,000 --> 00:00:06,800"
+    # Every word ends up in exactly one cue
+    assert " ".join(block.splitlines()[2] for block in cues) == " ".join(w["text"] for w in words)
+
+def test_map_times_moves_segments_and_words():
+    transcript = sample_transcript()
+    transcript.map_times(lambda seconds: seconds + 10)
+    assert [(s.start, s.end) for s in transcript.segments] == [(10.0, 12.5), (13.0, 14.25)]
+    assert [w.start for w in transcript.words] == [10.0, 11.1, 11.6]
+
+def test_legacy_assemblyai_dict_is_in_milliseconds():
+    transcript = Transcript.from_dict({
+        "id": "old",
+        "utterances": [{"start": 1500, "end": 3000, "text": "Ciao", "speaker": "A"}],
+    })
+    assert [(s.start, s.end, s.speaker) for s in transcript.segments] == [(1.5, 3.0, "A")]
+
+def test_whisper_words_after_the_last_segment_are_kept():
+    transcript = from_whisper({
+        "segments": [{"start": 0.0, "end": 1.0, "text": "Ciao a"}],
+        "words": [
+            {"start": 0.0, "end": 0.4, "text": "Ciao"},
+            {"start": 0.5, "end": 1.0, "text": "a"},
+            {"start": 1.0, "end": 1.6, "text": "tutti"},
+        ],
+    }, "openai")
+    assert [w.text for w in transcript.segments[0].words] == ["Ciao", "a", "tutti"]
+    assert transcript.segments[0].end == 1.6
+
+def test_whisper_text_without_segments_becomes_one_segment():
+    transcript = from_whisper({"text": " Solo testo.", "segments": []}, "openai")
+    assert [(s.start, s.end, s.text) for s in transcript.segments] == [(0.0, 0.0, "Solo testo.")]
+
+    transcript = from_whisper({"text": "Ciao.", "words": [{"start": 0.2, "end": 0.7, "text": "Ciao"}]}, "local")
+    assert [(s.start, s.end, s.text) for s in transcript.segments] == [(0.2, 0.7, "Ciao.")]
+    assert len(transcript.words) == 1
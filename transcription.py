@@ -0,0 +1,390 @@
+import csv
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pydub import AudioSegment
+from pydub.exceptions import CouldntDecodeError
+from metrics import span
+from ratelimit import PROVIDER_OPENAI_AUDIO, scheduler, submit_in_context
+
+# Whisper works on 16 kHz mono internally
+WHISPER_FRAME_RATE = 16000
+# Whisper rejects uploads above 25 MB, keep some headroom for container overhead
+WHISPER_MAX_BYTES = 24 * 1024 * 1024
+# Segments are re-encoded at a speech-friendly bitrate before being uploaded
+SEGMENT_BITRATE_KBPS = 64
+# Files in these formats at or below SEGMENT_BITRATE_KBPS (e.g. preprocessing's output) are
+# cut with -c copy instead, so Whisper gets the bytes that are on disk: extension -> segment extension
+COPY_FORMATS = {".mp3": ".mp3", ".ogg": ".ogg", ".opus": ".ogg", ".m4a": ".m4a"}
+# Shorter segments give more parallelism, ten minutes still leaves Whisper plenty of context
+TARGET_SEGMENT_MS = 10 * 60 * 1000
+# How far back from a cut point we look for a pause to split on
+SILENCE_SEARCH_MS = 30 * 1000
+# Pauses are found on the loudness of every LEVEL_STEP_MS, measured at a low sample rate
+LEVEL_FRAME_RATE = 8000
+LEVEL_STEP_MS = 10
+# Samples read from ffmpeg at a time when streaming a decode
+STREAM_BLOCK_SAMPLES = 60 * WHISPER_FRAME_RATE
+MIN_SILENCE_MS = 500
+SILENCE_THRESH_OFFSET_DB = 16
+MAX_WORKERS = 4
+# Retries of a failed upload, paced by the scheduler (the client itself doesn't retry)
+MAX_RETRIES = 6
+# How often a streamed transcription checks for segments ffmpeg has finished
+STREAM_POLL_SECONDS = 0.2
+
+# Longest segment that still fits in one Whisper request at SEGMENT_BITRATE_KBPS
+def max_segment_ms(max_bytes=WHISPER_MAX_BYTES, bitrate_kbps=SEGMENT_BITRATE_KBPS):
+    bytes_per_ms = bitrate_kbps * 1000 / 8 / 1000
+    return int(max_bytes / bytes_per_ms)
+
+# Decode any input straight to 16-bit mono at frame_rate. ffmpeg does the downmix and
+# resampling, so only the final samples are held in memory: decoding at the source rate
+# first takes ~400 MB for twenty minutes of stereo audio, this takes ~40 MB.
+def decode_mono(path, frame_rate=WHISPER_FRAME_RATE):
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        # pydub still reads WAV files without ffmpeg
+        return AudioSegment.from_file(path).set_channels(1).set_frame_rate(frame_rate).set_sample_width(2)
+    result = subprocess.run(
+        [ffmpeg, "-nostdin", "-v", "error", "-i", path, "-vn", "-ac", "1", "-ar", str(frame_rate), "-f", "s16le", "-"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        raise CouldntDecodeError(f"Decoding failed. ffmpeg returned error code: {result.returncode}\n\n{result.stderr.decode(errors='replace')}")
+    return AudioSegment(data=result.stdout, sample_width=2, frame_rate=frame_rate, channels=1)
+
+# Like decode_mono(), as a stream of raw 16-bit blocks of at most block_samples samples,
+# so long recordings can be analysed without holding them in memory
+def stream_mono(path, frame_rate=WHISPER_FRAME_RATE, block_samples=STREAM_BLOCK_SAMPLES):
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raw_data = decode_mono(path, frame_rate).raw_data
+        for offset in range(0, len(raw_data), 2 * block_samples):
+            yield raw_data[offset:offset + 2 * block_samples]
+        return
+    with tempfile.TemporaryFile() as log:
+        process = subprocess.Popen(
+            [ffmpeg, "-nostdin", "-v", "error", "-i", path, "-vn", "-ac", "1", "-ar", str(frame_rate), "-f", "s16le", "-"],
+            stdout=subprocess.PIPE,
+            stderr=log
+        )
+        try:
+            while True:
+                block = process.stdout.read(2 * block_samples)
+                if not block:
+                    break
+                yield block
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+        if process.returncode != 0:
+            log.seek(0)
+            raise CouldntDecodeError(f"Decoding failed. ffmpeg returned error code: {process.returncode}\n\n{log.read().decode(errors='replace')}")
+
+# Duration in seconds from ffprobe, None when it isn't available or can't read the file
+def probe_duration(path):
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is None:
+        return None
+    result = subprocess.run(
+        [ffprobe, "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True
+    )
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return None
+
+# Extension for segments cut from path with -c copy, or None when they have to be re-encoded
+def copy_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in COPY_FORMATS or shutil.which("ffmpeg") is None:
+        return None
+    duration = probe_duration(path)
+    if not duration or os.path.getsize(path) * 8 / duration > SEGMENT_BITRATE_KBPS * 1000:
+        return None
+    return COPY_FORMATS[extension]
+
+# Bytes transcribe_with_whisper() uploads for path, used to report what preprocessing saves
+def upload_bytes(path):
+    if copy_format(path):
+        return os.path.getsize(path)
+    duration = probe_duration(path)
+    if duration is None:
+        return os.path.getsize(path)
+    return int(duration * SEGMENT_BITRATE_KBPS * 1000 / 8)
+
+# Cut start_ms..end_ms of the file on disk into segment_path, as it is or re-encoded for Whisper
+def cut_segment(source_path, start_ms, end_ms, segment_path, copy):
+    if copy:
+        codec = ["-c", "copy"]
+    else:
+        codec = ["-ac", "1", "-ar", str(WHISPER_FRAME_RATE), "-c:a", "libmp3lame", "-b:a", f"{SEGMENT_BITRATE_KBPS}k"]
+    result = subprocess.run(
+        [
+            "ffmpeg", "-nostdin", "-v", "error", "-y",
+            "-ss", f"{start_ms / 1000:.3f}", "-t", f"{(end_ms - start_ms) / 1000:.3f}", "-i", source_path,
+            "-map", "0:a:0", *codec, segment_path
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        raise ValueError(f"Conversione dell'audio non riuscita: {result.stderr.decode(errors='replace').strip()[-500:]}")
+
+# Mean power of every LEVEL_STEP_MS of the recording, from one streamed pass at LEVEL_FRAME_RATE,
+# and its duration in ms. This is all split_audio() needs, the samples are never held in memory.
+def audio_levels(path):
+    import numpy as np
+    step = LEVEL_FRAME_RATE * LEVEL_STEP_MS // 1000
+    levels = []
+    pending = np.zeros(0, dtype=np.float64)
+    samples = 0
+    for block in stream_mono(path, LEVEL_FRAME_RATE):
+        values = np.concatenate((pending, np.frombuffer(block, dtype=np.int16).astype(np.float64)))
+        whole = len(values) // step * step
+        levels.append(np.mean(values[:whole].reshape(-1, step) ** 2, axis=1))
+        pending = values[whole:]
+        samples += len(block) // 2
+    if len(pending):
+        levels.append(np.array([np.mean(pending ** 2)]))
+    return (np.concatenate(levels) if levels else np.zeros(0)), samples * 1000 // LEVEL_FRAME_RATE
+
+# Mean power of a signal this many dB below full scale, as audio_levels() measures it
+def _power(dbfs):
+    return 32768.0 ** 2 * 10 ** (dbfs / 10)
+
+# Find the middle of the last pause before end_ms, or fall back to a hard cut. A pause is a
+# stretch of at least MIN_SILENCE_MS whose loudness is at most silence_thresh dBFS, which is
+# relative to the whole recording: split_audio() computes it once.
+def find_cut_point(levels, start_ms, end_ms, silence_thresh):
+    import numpy as np
+    window_start = max(start_ms, end_ms - SILENCE_SEARCH_MS)
+    first, last = window_start // LEVEL_STEP_MS, end_ms // LEVEL_STEP_MS
+    steps = MIN_SILENCE_MS // LEVEL_STEP_MS
+    if last - first < steps:
+        return end_ms
+    # Power of every MIN_SILENCE_MS stretch starting in the window, from the cumulative sums
+    cumulative = np.concatenate(([0.0], np.cumsum(levels[first:last])))
+    quiet = np.flatnonzero((cumulative[steps:] - cumulative[:-steps]) / steps <= _power(silence_thresh))
+    if not len(quiet):
+        return end_ms
+    breaks = np.flatnonzero(np.diff(quiet) > 1)
+    run_start = quiet[breaks[-1] + 1] if len(breaks) else quiet[0]
+    silence_start = (first + run_start) * LEVEL_STEP_MS
+    silence_end = (first + quiet[-1] + steps) * LEVEL_STEP_MS
+    cut = int(silence_start + silence_end) // 2
+    return cut if cut > start_ms else end_ms
+
+# Split a recording of duration_ms into (start_ms, end_ms) ranges no longer than segment_ms
+def split_audio(levels, duration_ms, segment_ms):
+    import numpy as np
+    bounds = []
+    start = 0
+    mean_power = float(np.mean(levels)) if len(levels) else 0.0
+    silence_thresh = (10 * math.log10(mean_power / 32768.0 ** 2) if mean_power > 0 else -math.inf) - SILENCE_THRESH_OFFSET_DB
+    while start < duration_ms:
+        end = start + segment_ms
+        if end >= duration_ms:
+            end = duration_ms
+        else:
+            end = find_cut_point(levels, start, end, silence_thresh)
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+# copy: keep the codec and bitrate of source_path (see copy_format()), otherwise re-encode at SEGMENT_BITRATE_KBPS
+def transcribe_segment(client, source_path, copy, start_ms, end_ms, segment_path, language, model):
+    with span("segment_export", bytes_out=0) as info:
+        cut_segment(source_path, start_ms, end_ms, segment_path, copy)
+        info["bytes_out"] = os.path.getsize(segment_path)
+    return transcribe_segment_file(client, segment_path, start_ms, language, model)
+
+# Send an exported segment that starts start_ms into the recording, then delete it
+def transcribe_segment_file(client, segment_path, start_ms, language, model):
+    # Already imported by the client, importing it here keeps this module light
+    import openai
+    retryable_errors = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+    for attempt in range(MAX_RETRIES + 1):
+        scheduler.acquire(PROVIDER_OPENAI_AUDIO, client.api_key)
+        try:
+            # Upload and provider processing happen in the same request
+            with span("whisper_request", provider="openai", model=model, bytes_in=os.path.getsize(segment_path)), open(segment_path, "rb") as audio_file:
+                response = client.audio.transcriptions.create(
+                    model=model,
+                    file=audio_file,
+                    language=language,
+                    response_format="verbose_json",
+                    timestamp_granularities=["segment", "word"]
+                )
+            scheduler.report_success(PROVIDER_OPENAI_AUDIO, client.api_key)
+            break
+        except retryable_errors as e:
+            if attempt == MAX_RETRIES:
+                raise
+            # A 429 pauses every segment on this key, other errors only this one
+            time.sleep(scheduler.report_failure(PROVIDER_OPENAI_AUDIO, client.api_key, attempt, getattr(e, "response", None)))
+    os.unlink(segment_path)
+
+    # Whisper timestamps are relative to the segment, shift them to the full recording
+    offset = start_ms / 1000
+    segments = [
+        {
+            "start": segment.start + offset,
+            "end": segment.end + offset,
+            "text": segment.text.strip(),
+            # Whisper gives a mean log-probability per segment, not a confidence
+            "confidence": math.exp(segment.avg_logprob) if segment.avg_logprob is not None else None
+        }
+        for segment in (response.segments or [])
+    ]
+    words = [
+        {"start": word.start + offset, "end": word.end + offset, "text": word.word.strip()}
+        for word in (getattr(response, "words", None) or [])
+    ]
+    return response.text.strip(), segments, words
+
+# Transcribe a recording of any length by splitting it on silence and sending the pieces in parallel.
+# on_segment(text, segments) is called for each piece, in order, as soon as it and all earlier ones are done.
+def transcribe_with_whisper(client, file_path, language, model="whisper-1", max_workers=MAX_WORKERS, on_segment=None):
+    levels, duration_ms = audio_levels(file_path)
+    bounds = split_audio(levels, duration_ms, min(TARGET_SEGMENT_MS, max_segment_ms()))
+    if not bounds:
+        raise ValueError("Il file audio è vuoto")
+    extension = copy_format(file_path)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(bounds))) as executor:
+            futures = [
+                submit_in_context(
+                    executor,
+                    transcribe_segment,
+                    client,
+                    file_path,
+                    extension is not None,
+                    start_ms,
+                    end_ms,
+                    os.path.join(temp_dir, f"segment_{index:04d}{extension or '.mp3'}"),
+                    language,
+                    model
+                )
+                for index, (start_ms, end_ms) in enumerate(bounds)
+            ]
+            # Collect in submission order so the text is stitched back in sequence
+            results = []
+            for future in futures:
+                results.append(future.result())
+                if on_segment:
+                    on_segment(*results[-1][:2])
+
+    return {
+        "text": " ".join(text for text, _, _ in results if text),
+        "segments": [segment for _, segments, _ in results for segment in segments],
+        "words": [word for _, _, words in results for word in words]
+    }
+
+def can_transcribe_stream():
+    return shutil.which("ffmpeg") is not None
+
+# Write the audio into ffmpeg's stdin; runs in its own thread so segments can be collected
+# meanwhile. feed["error"] is set when reading the chunks fails (e.g. the download broke).
+def _feed(chunks, process, feed):
+    try:
+        for chunk in chunks:
+            process.stdin.write(chunk)
+            feed["bytes"] += len(chunk)
+    except BrokenPipeError:
+        # ffmpeg gave up, its exit status tells why
+        pass
+    except Exception as e:
+        feed["error"] = e
+        process.kill()
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+def _read_segment_list(list_path):
+    try:
+        with open(list_path, newline="") as f:
+            return [row for row in csv.reader(f) if len(row) == 3]
+    except FileNotFoundError:
+        return []
+
+# Like transcribe_with_whisper(), for audio that is still arriving: chunks (an iterable of
+# bytes, e.g. a download in progress) is piped into ffmpeg, which re-encodes it and cuts it
+# into fixed-length segments, and every segment goes to Whisper as soon as ffmpeg closes it.
+# The cuts are at fixed times instead of pauses, since the rest of the audio isn't there yet.
+def transcribe_stream(client, chunks, language, model="whisper-1", max_workers=MAX_WORKERS, on_segment=None):
+    segment_seconds = min(TARGET_SEGMENT_MS, max_segment_ms()) / 1000
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir, open(os.path.join(temp_dir, "ffmpeg.log"), "w+") as log:
+        list_path = os.path.join(temp_dir, "segments.csv")
+        process = subprocess.Popen(
+            [
+                "ffmpeg", "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+                "-vn", "-ac", "1", "-ar", "16000", "-c:a", "libmp3lame", "-b:a", f"{SEGMENT_BITRATE_KBPS}k",
+                "-f", "segment", "-segment_time", str(segment_seconds), "-reset_timestamps", "1",
+                # A "file,start,end" line is appended as soon as a segment is complete
+                "-segment_list", list_path, "-segment_list_type", "csv",
+                os.path.join(temp_dir, "segment_%04d.mp3"),
+            ],
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=log
+        )
+        feed = {"bytes": 0, "error": None}
+        feeder = threading.Thread(target=_feed, args=(chunks, process, feed), name="sbobinator-stream-feed", daemon=True)
+        feeder.start()
+
+        with span("stream_transcription", provider="openai", model=model) as info, ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = []
+            try:
+                while feed["error"] is None:
+                    finished = process.poll() is not None
+                    for name, start, _ in _read_segment_list(list_path)[len(futures):]:
+                        futures.append(submit_in_context(
+                            executor,
+                            transcribe_segment_file, client, os.path.join(temp_dir, name), int(float(start) * 1000), language, model
+                        ))
+                    # Report segments in order as they come back, while later ones are still arriving
+                    while len(results) < len(futures) and (finished or futures[len(results)].done()):
+                        results.append(futures[len(results)].result())
+                        if on_segment:
+                            on_segment(*results[-1][:2])
+                    if finished and len(results) == len(futures):
+                        break
+                    if not finished:
+                        time.sleep(STREAM_POLL_SECONDS)
+            finally:
+                for future in futures:
+                    future.cancel()
+                if process.poll() is None:
+                    process.kill()
+            feeder.join()
+            info["bytes_in"] = feed["bytes"]
+            info["segments"] = len(results)
+
+        if feed["error"] is not None:
+            raise feed["error"]
+        if process.returncode != 0:
+            log.seek(0)
+            raise ValueError(f"Conversione dell'audio non riuscita: {log.read().strip()[-500:]}")
+
+    if not results:
+        raise ValueError("Il file audio è vuoto")
+    return {
+        "text": " ".join(text for text, _, _ in results if text),
+        "segments": [segment for _, segments, _ in results for segment in segments],
+        "words": [word for _, _, words in results for word in words]
+    }
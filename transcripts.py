@@ -0,0 +1,343 @@
+import base64
+import json
+import math
+import sys
+import zlib
+from array import array
+
+# Transcript model shared by every engine. Segments (Whisper segments or AssemblyAI
+# utterances) and words are stored column by column in typed arrays instead of one dict per
+# item, times are in seconds. Stored transcripts are decoded lazily: segments on first use,
+# words only when something actually needs them (word-level exports, subtitles splitting).
+
+FORMAT = "sbobinator-columns"
+FORMAT_VERSION = 1
+NO_SPEAKER = -1
+# Subtitle cues are split at word boundaries to stay readable
+SUBTITLE_MAX_SECONDS = 7.0
+SUBTITLE_MAX_CHARS = 84
+
+# Column name -> array typecode; "texts" columns are lists of strings
+SEGMENT_COLUMNS = {"start": "d", "end": "d", "speaker": "i", "confidence": "f", "word_offset": "I"}
+WORD_COLUMNS = {"start": "d", "end": "d", "speaker": "i", "confidence": "f"}
+
+def _encode_array(values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return base64.b64encode(zlib.compress(values.tobytes())).decode("ascii")
+
+def _decode_array(typecode, data):
+    values = array(typecode)
+    values.frombytes(zlib.decompress(base64.b64decode(data)))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+def _encode_texts(texts):
+    return base64.b64encode(zlib.compress("\n".join(texts).encode("utf-8"))).decode("ascii")
+
+def _decode_texts(data, count):
+    if not count:
+        return []
+    return zlib.decompress(base64.b64decode(data)).decode("utf-8").split("\n")
+
+def _clean(text):
+    return " ".join((text or "").split())
+
+def _confidence(value):
+    return float("nan") if value is None else value
+
+def _optional(value):
+    return None if math.isnan(value) else value
+
+def _timestamp(seconds, separator):
+    millis = int(round(max(seconds, 0) * 1000))
+    hours, millis = divmod(millis, 3600 * 1000)
+    minutes, millis = divmod(millis, 60 * 1000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{millis:03d}"
+
+class Word:
+    __slots__ = ("start", "end", "text", "speaker", "confidence")
+
+    def __init__(self, start, end, text, speaker=None, confidence=None):
+        self.start = start
+        self.end = end
+        self.text = text
+        self.speaker = speaker
+        self.confidence = confidence
+
+class Segment:
+    __slots__ = ("start", "end", "text", "speaker", "confidence", "_transcript", "_index")
+
+    def __init__(self, transcript, index, start, end, text, speaker, confidence):
+        self._transcript = transcript
+        self._index = index
+        self.start = start
+        self.end = end
+        self.text = text
+        self.speaker = speaker
+        self.confidence = confidence
+
+    @property
+    def words(self):
+        return self._transcript.segment_words(self._index)
+
+class Transcript:
+    def __init__(self, id=None, engine=None, language=None):
+        self.id = id
+        self.engine = engine
+        self.language = language
+        self.speakers = []
+        self._segments = {name: array(code) for name, code in SEGMENT_COLUMNS.items()}
+        self._segments["word_offset"].append(0)
+        self._segment_texts = []
+        self._words = {name: array(code) for name, code in WORD_COLUMNS.items()}
+        self._word_texts = []
+        # Encoded columns not decoded yet, see from_columns()
+        self._encoded_segments = None
+        self._encoded_words = None
+
+    def _speaker_index(self, speaker):
+        if speaker is None:
+            return NO_SPEAKER
+        speaker = str(speaker)
+        if speaker not in self.speakers:
+            self.speakers.append(speaker)
+        return self.speakers.index(speaker)
+
+    # words is an iterable of dicts with start, end, text and optionally speaker and confidence
+    def add_segment(self, start, end, text, speaker=None, confidence=None, words=()):
+        self._load_segments()
+        self._load_words()
+        speaker_index = self._speaker_index(speaker)
+        for word in words:
+            self._words["start"].append(word["start"])
+            self._words["end"].append(word["end"])
+            self._words["speaker"].append(self._speaker_index(word.get("speaker", speaker)))
+            self._words["confidence"].append(_confidence(word.get("confidence")))
+            self._word_texts.append(_clean(word["text"]))
+        self._segments["start"].append(start)
+        self._segments["end"].append(end)
+        self._segments["speaker"].append(speaker_index)
+        self._segments["confidence"].append(_confidence(confidence))
+        self._segments["word_offset"].append(len(self._word_texts))
+        self._segment_texts.append(_clean(text))
+
+    def _load_segments(self):
+        if self._encoded_segments is not None:
+            encoded, self._encoded_segments = self._encoded_segments, None
+            self._segments = {name: _decode_array(code, encoded[name]) for name, code in SEGMENT_COLUMNS.items()}
+            self._segment_texts = _decode_texts(encoded["text"], len(self._segments["start"]))
+
+    def _load_words(self):
+        if self._encoded_words is not None:
+            encoded, self._encoded_words = self._encoded_words, None
+            self._words = {name: _decode_array(code, encoded[name]) for name, code in WORD_COLUMNS.items()}
+            self._word_texts = _decode_texts(encoded["text"], len(self._words["start"]))
+
+    def __len__(self):
+        self._load_segments()
+        return len(self._segment_texts)
+
+    @property
+    def diarized(self):
+        return bool(self.speakers)
+
+    @property
+    def duration(self):
+        self._load_segments()
+        return self._segments["end"][-1] if self._segment_texts else 0.0
+
+    def _speaker(self, index):
+        return None if index == NO_SPEAKER else self.speakers[index]
+
+    @property
+    def segments(self):
+        self._load_segments()
+        columns = self._segments
+        return [
+            Segment(self, i, columns["start"][i], columns["end"][i], text,
+                    self._speaker(columns["speaker"][i]), _optional(columns["confidence"][i]))
+            for i, text in enumerate(self._segment_texts)
+        ]
+
+    def segment_words(self, index):
+        self._load_segments()
+        self._load_words()
+        offsets = self._segments["word_offset"]
+        columns = self._words
+        return [
+            Word(columns["start"][i], columns["end"][i], self._word_texts[i],
+                 self._speaker(columns["speaker"][i]), _optional(columns["confidence"][i]))
+            for i in range(offsets[index], offsets[index + 1])
+        ]
+
+    @property
+    def words(self):
+        return [word for index in range(len(self)) for word in self.segment_words(index)]
+
+    # Plain text as shown in the app: one "Speaker X:" paragraph per utterance when diarized
+    @property
+    def text(self):
+        self._load_segments()
+        if not self.diarized:
+            return " ".join(text for text in self._segment_texts if text)
+        return "\n\n".join(
+            f"Speaker {segment.speaker}: {segment.text}" for segment in self.segments
+        ) + "\n\n"
+
+    # Map every start and end time through fn (seconds -> seconds)
+    def map_times(self, fn):
+        self._load_segments()
+        self._load_words()
+        for columns in (self._segments, self._words):
+            for name in ("start", "end"):
+                values = columns[name]
+                for i in range(len(values)):
+                    values[i] = fn(values[i])
+
+    def to_columns(self):
+        self._load_segments()
+        self._load_words()
+        return {
+            "format": FORMAT,
+            "version": FORMAT_VERSION,
+            "id": self.id,
+            "engine": self.engine,
+            "language": self.language,
+            "speakers": self.speakers,
+            "segments": {
+                **{name: _encode_array(values) for name, values in self._segments.items()},
+                "text": _encode_texts(self._segment_texts),
+            },
+            "words": {
+                **{name: _encode_array(values) for name, values in self._words.items()},
+                "text": _encode_texts(self._word_texts),
+            },
+        }
+
+    @classmethod
+    def from_columns(cls, data):
+        transcript = cls(data.get("id"), data.get("engine"), data.get("language"))
+        transcript.speakers = list(data.get("speakers") or [])
+        transcript._encoded_segments = data["segments"]
+        transcript._encoded_words = data["words"]
+        return transcript
+
+    # Readable export with nested words, also accepted back by from_dict()
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "engine": self.engine,
+            "language": self.language,
+            "speakers": self.speakers,
+            "text": self.text,
+            "segments": [
+                {
+                    "start": segment.start,
+                    "end": segment.end,
+                    "speaker": segment.speaker,
+                    "confidence": segment.confidence,
+                    "text": segment.text,
+                    "words": [
+                        {"start": w.start, "end": w.end, "text": w.text, "speaker": w.speaker, "confidence": w.confidence}
+                        for w in segment.words
+                    ],
+                }
+                for segment in self.segments
+            ],
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+    # Accepts to_columns() and to_dict() output, and the plain dicts stored before this model
+    # existed: {"text", "segments"} from Whisper and {"id", "utterances"} (in ms) from AssemblyAI
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("format") == FORMAT:
+            return cls.from_columns(data)
+        transcript = cls(data.get("id"), data.get("engine"), data.get("language"))
+        if "utterances" in data:
+            for u in data["utterances"]:
+                transcript.add_segment(u["start"] / 1000, u["end"] / 1000, u["text"], u["speaker"], u.get("confidence"))
+            return transcript
+        for s in data.get("segments") or []:
+            transcript.add_segment(s["start"], s["end"], s["text"], s.get("speaker"), s.get("confidence"), s.get("words") or ())
+        if not len(transcript) and data.get("text"):
+            transcript.add_segment(0.0, 0.0, data["text"])
+        return transcript
+
+    # Subtitle cues (start, end, text), long segments are split on word boundaries
+    def _cues(self):
+        for segment in self.segments:
+            words = segment.words
+            if not words or (segment.end - segment.start <= SUBTITLE_MAX_SECONDS and len(segment.text) <= SUBTITLE_MAX_CHARS):
+                yield segment.start, segment.end, segment.speaker, segment.text
+                continue
+            current = []
+            for word in words:
+                if current and (
+                    word.end - current[0].start > SUBTITLE_MAX_SECONDS
+                    or sum(len(w.text) + 1 for w in current) + len(word.text) > SUBTITLE_MAX_CHARS
+                ):
+                    yield current[0].start, current[-1].end, segment.speaker, " ".join(w.text for w in current)
+                    current = []
+                current.append(word)
+            if current:
+                yield current[0].start, current[-1].end, segment.speaker, " ".join(w.text for w in current)
+
+    def to_srt(self):
+        blocks = []
+        for index, (start, end, speaker, text) in enumerate(self._cues(), start=1):
+            if speaker is not None:
+                text = f"Speaker {speaker}: {text}"
+            blocks.append(f"{index}\n{_timestamp(start, ',')} --> {_timestamp(end, ',')}\n{text}\n")
+        return "\n".join(blocks)
+
+    def to_vtt(self):
+        blocks = ["WEBVTT\n"]
+        for start, end, speaker, text in self._cues():
+            if speaker is not None:
+                text = f"<v Speaker {speaker}>{text}"
+            blocks.append(f"{_timestamp(start, '.')} --> {_timestamp(end, '.')}\n{text}\n")
+        return "\n".join(blocks)
+
+# Whisper output ({"segments", "words"} with times in seconds) from the API or faster-whisper.
+# Words are not nested in segments there, they are assigned to segments by time; words after
+# the last segment go to it. Without segments the whole text becomes one.
+def from_whisper(result, engine, language=None):
+    transcript = Transcript(engine=engine, language=language)
+    words = sorted(result.get("words") or [], key=lambda w: w["start"])
+    segments = result.get("segments") or []
+    text = (result.get("text") or "").strip()
+    if not segments and text:
+        segments = [{
+            "start": words[0]["start"] if words else 0.0,
+            "end": words[-1]["end"] if words else result.get("duration") or 0.0,
+            "text": text,
+        }]
+    position = 0
+    for index, segment in enumerate(segments):
+        segment_words = []
+        last = index == len(segments) - 1
+        while position < len(words) and (last or words[position]["start"] < segment["end"]):
+            segment_words.append(words[position])
+            position += 1
+        end = max([segment["end"]] + [w["end"] for w in segment_words[-1:]])
+        transcript.add_segment(segment["start"], end, segment["text"], None, segment.get("confidence"), segment_words)
+    return transcript
+
+# Completed AssemblyAI transcript JSON; utterances keep their words, speakers and confidences
+def from_assemblyai(data, language=None):
+    transcript = Transcript(id=data["id"], engine="assemblyai", language=language or data.get("language_code"))
+    for u in data.get("utterances") or []:
+        words = [
+            {"start": w["start"] / 1000, "end": w["end"] / 1000, "text": w["text"],
+             "speaker": w.get("speaker"), "confidence": w.get("confidence")}
+            for w in u.get("words") or []
+        ]
+        transcript.add_segment(u["start"] / 1000, u["end"] / 1000, u["text"], u["speaker"], u.get("confidence"), words)
+    return transcript